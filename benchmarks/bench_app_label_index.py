@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Benchmark for resolving migration files in a directory to their app labels.
+
+Builds a synthetic directory with 500 apps and 5,000 migration files and
+compares the indexed resolution used by the loaders with the old approach of
+checking every file name against every app label.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from django.conf import settings  # noqa
+
+settings.configure()
+
+from django_migrate_project.loader import AppLabelIndex  # noqa
+
+
+APP_COUNT = 500
+FILE_COUNT = 5000
+
+
+def make_directory(app_labels):
+    directory = tempfile.mkdtemp()
+
+    for idx in range(FILE_COUNT):
+        app_label = app_labels[idx % len(app_labels)]
+        filename = "%s_%04d_project.py" % (app_label, idx // len(app_labels))
+
+        open(os.path.join(directory, filename), 'w').close()
+
+    return directory
+
+
+def resolve_naive(app_labels, names):
+    resolved = []
+
+    for app_label in app_labels:
+        for name in names:
+            if name.startswith(app_label):
+                resolved.append((app_label, name.lstrip(app_label)[1:]))
+
+    return resolved
+
+
+def resolve_indexed(app_labels, names):
+    index = AppLabelIndex(app_labels)
+
+    return [index.resolve(name) for name in names]
+
+
+def main():
+    # Every tenth app has a label that's a prefix of another app's label
+    app_labels = []
+
+    for idx in range(APP_COUNT // 10):
+        app_labels.append("app%d" % idx)
+        app_labels.extend("app%d_sub%d" % (idx, sub) for sub in range(9))
+
+    directory = make_directory(app_labels)
+
+    try:
+        names = [name.rsplit('.', 1)[0] for name in os.listdir(directory)]
+
+        for label, func in (('naive', resolve_naive),
+                            ('indexed', resolve_indexed)):
+            timer = timeit.Timer(lambda: func(app_labels, names))
+            best = min(timer.repeat(repeat=3, number=1))
+            print("%-8s %d apps, %d files: %.4fs" % (
+                label, len(app_labels), len(names), best))
+
+        # The naive approach double counts files for prefix labels
+        print("naive matches: %d, indexed matches: %d" % (
+            len(resolve_naive(app_labels, names)),
+            len([r for r in resolve_indexed(app_labels, names) if r])))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
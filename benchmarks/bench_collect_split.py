@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmark for splitting the collected migrations of each app.
+
+Builds synthetic migration graphs with a growing number of apps, where every
+app depends on the one before it and every fifth group of apps depends on
+each other in a cycle, and times the split used by collectmigrations. It
+finds the cycles in a single pass over the app dependency graph, then splits
+the apps in each of them. For comparison it also times walking the forwards
+plan of both leaves for every pair of apps, which is what the old pairwise
+split did at the very least.
+
+The time per app for the split should stay roughly flat.
+"""
+
+from __future__ import print_function, unicode_literals
+
+from itertools import combinations
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from django.conf import settings  # noqa
+
+settings.configure()
+
+from django.db.migrations.graph import MigrationGraph  # noqa
+
+from django_migrate_project.graph import split_app_migrations  # noqa
+
+
+APP_COUNTS = (50, 100, 200, 400, 800)
+PAIRWISE_APP_COUNTS = (25, 50, 100)
+MIGRATIONS_PER_APP = 10
+CYCLE_SIZE = 5
+
+
+def make_graph(app_count):
+    graph = MigrationGraph()
+    app_labels = ["app%d" % idx for idx in range(app_count)]
+
+    for app_label in app_labels:
+        for idx in range(MIGRATIONS_PER_APP):
+            graph.add_node((app_label, "%04d" % idx), None)
+
+    for app_idx, app_label in enumerate(app_labels):
+        for idx in range(1, MIGRATIONS_PER_APP):
+            graph.add_dependency(None, (app_label, "%04d" % idx),
+                                 (app_label, "%04d" % (idx - 1)))
+
+        if app_idx == 0:
+            continue
+
+        previous_app = app_labels[app_idx - 1]
+
+        if app_idx % CYCLE_SIZE:
+            # Late in this app depends on early in the previous app, and
+            # late in the previous app depends on early in this one
+            graph.add_dependency(
+                None, (app_label, "0007"), (previous_app, "0002"))
+            graph.add_dependency(
+                None, (previous_app, "0008"), (app_label, "0001"))
+        else:
+            graph.add_dependency(
+                None, (app_label, "0000"),
+                (previous_app, "%04d" % (MIGRATIONS_PER_APP - 1)))
+
+    return graph, app_labels
+
+
+def split(graph, app_labels):
+    return split_app_migrations(graph, graph.nodes)
+
+
+def pairwise(graph, app_labels):
+    leaf = "%04d" % (MIGRATIONS_PER_APP - 1)
+
+    for app1, app2 in combinations(app_labels, 2):
+        graph.forwards_plan((app1, leaf))
+        graph.forwards_plan((app2, leaf))
+
+
+def main():
+    # The pairwise walk is slow enough that once is plenty
+    for label, func, app_counts, repeat in (
+            ('split', split, APP_COUNTS, 3),
+            ('pairwise', pairwise, PAIRWISE_APP_COUNTS, 1)):
+        for app_count in app_counts:
+            graph, app_labels = make_graph(app_count)
+            timer = timeit.Timer(lambda: func(graph, app_labels))
+            best = min(timer.repeat(repeat=repeat, number=1))
+
+            print("%-8s %4d apps: %.4fs (%.3fms per app)" % (
+                label, app_count, best, best * 1000 / app_count))
+
+    graph, app_labels = make_graph(APP_COUNTS[0])
+    set_count = sum(len(sets) for sets in split(graph, app_labels).values())
+    print("split    %4d apps: %d collected migrations" % (
+        len(app_labels), set_count))
+
+
+if __name__ == '__main__':
+    main()
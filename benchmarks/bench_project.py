@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+Benchmark for the management commands on a large synthetic project.
+
+Generates a throwaway project with synthetic_project, then times running
+collectmigrations, applymigrations, applymigrations --unapply,
+makeprojectmigrations and migrateproject on it, in that order, against a
+fresh SQLite database. Each command runs in its own process, and the phase
+timings it reports with --timings-file are kept alongside its wall time.
+
+The results are saved as JSON, and a previous results file can be given to
+compare against:
+
+    $ python benchmarks/bench_project.py --apps 100 --output before.json
+    $ python benchmarks/bench_project.py --apps 100 --compare before.json
+
+With --rows, each app is first migrated to its first migration and given
+that many rows, so applying the rest of its migrations changes the fields of
+a table with data in it. The time spent on each table is then reported too,
+which with --coalesce-rebuilds can be compared to applying with the table
+rebuilds on SQLite coalesced:
+
+    $ python benchmarks/bench_project.py --rows 1000 --output before.json
+    $ python benchmarks/bench_project.py --rows 1000 --coalesce-rebuilds \
+          --compare before.json
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+import django  # noqa
+
+from benchmarks.synthetic_project import generate_project  # noqa
+from django_migrate_project import __version__  # noqa
+
+
+# makeprojectmigrations runs before migrateproject, so there are project
+# migrations for migrateproject to apply
+COMMANDS = (
+    ('collectmigrations', ['collectmigrations']),
+    ('applymigrations', ['applymigrations', '--noinput']),
+    ('applymigrations --unapply',
+     ['applymigrations', '--unapply', '--noinput']),
+    ('makeprojectmigrations', ['makeprojectmigrations', '--noinput']),
+    ('migrateproject', ['migrateproject', '--noinput']),
+)
+
+# The commands which take --coalesce-rebuilds
+MIGRATE_COMMANDS = ('applymigrations', 'migrateproject')
+
+# Prefix of the phases timing the changes to each table
+TABLE_PHASE_PREFIX = 'executor.table.'
+
+# How many of the slowest tables are listed for each command
+TABLE_SUMMARY_LENGTH = 5
+
+# Migrates each app to its first migration, and adds rows to its table
+PREPARE_SCRIPT = """\
+import os
+import sys
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+django.setup()
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+rows = int(sys.argv[1])
+executor = MigrationExecutor(connection)
+targets = executor.loader.graph.root_nodes()
+executor.migrate(targets)
+
+executor.loader.build_graph()
+state = executor.loader.project_state(targets)
+apps = state.apps if django.VERSION >= (1, 8) else state.render()
+
+for app_label, migration_name in targets:
+    model = apps.get_model(app_label, 'Item')
+    # The primary keys are given, as tables with no other columns can't be
+    # bulk inserted into otherwise
+    model.objects.bulk_create([model(pk=idx + 1) for idx in range(rows)])
+"""
+
+
+def project_env():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [ROOT_DIR] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+    env.pop('DJANGO_SETTINGS_MODULE', None)  # Use the project's settings
+
+    return env
+
+
+def run_in_project(project_dir, command, description):
+    """ Runs a command in the project, returning its wall time """
+
+    start = time.time()
+    process = subprocess.Popen(command, cwd=project_dir, env=project_env(),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    wall = time.time() - start
+
+    if process.returncode != 0:
+        raise RuntimeError("'%s' failed:\n%s" % (
+            description, stderr.decode('utf-8', 'replace')))
+
+    return wall
+
+
+def prepare_project(project_dir, rows):
+    """ Migrates each app to its first migration and adds rows to it """
+
+    run_in_project(project_dir, [sys.executable, '-c', PREPARE_SCRIPT,
+                                 str(rows)], "prepare")
+
+
+def run_command(project_dir, args):
+    """ Runs a command in the project, returning its wall time and phases """
+
+    timings_path = os.path.join(project_dir, 'timings.json')
+    command = [sys.executable, 'manage.py'] + args + [
+        '--verbosity', '0', '--timings-file', timings_path]
+    wall = run_in_project(project_dir, command, " ".join(args))
+
+    with open(timings_path) as timings_file:
+        phases = json.load(timings_file)['phases']
+
+    os.remove(timings_path)
+
+    return wall, phases
+
+
+def table_times(phases):
+    """ Returns the total time spent changing each table in the phases """
+
+    tables = {}
+
+    for phase in phases:
+        if phase['name'].startswith(TABLE_PHASE_PREFIX):
+            table = phase['name'][len(TABLE_PHASE_PREFIX):]
+            tables[table] = tables.get(table, 0) + phase['wall']
+
+    return tables
+
+
+def run_benchmark(config, repeat, keep=False, rows=None,
+                  coalesce_rebuilds=False):
+    """
+    Runs every command on a freshly generated project, repeat times, and
+    returns the results for each command. If rows is given the project is
+    prepared with prepare_project first.
+    """
+
+    results = [{'command': label, 'wall': [], 'phases': None}
+               for label, args in COMMANDS]
+
+    for run in range(repeat):
+        project_dir = tempfile.mkdtemp(prefix='migrate-project-bench-')
+
+        try:
+            generate_project(project_dir, **config)
+
+            if rows is not None:
+                prepare_project(project_dir, rows)
+
+            for result, (label, args) in zip(results, COMMANDS):
+                if coalesce_rebuilds and args[0] in MIGRATE_COMMANDS:
+                    args = args + ['--coalesce-rebuilds']
+
+                wall, phases = run_command(project_dir, args)
+                result['wall'].append(wall)
+
+                if result['phases'] is None or wall <= min(result['wall']):
+                    result['phases'] = phases
+        finally:
+            if keep:
+                print("Kept project in %s" % project_dir)
+            else:
+                shutil.rmtree(project_dir)
+
+    for result in results:
+        result['best'] = min(result['wall'])
+        result['tables'] = table_times(result['phases'])
+
+    return results
+
+
+def format_time(time_taken, before=None):
+    line = "%8.3fs" % time_taken
+
+    if before:
+        line += "  (was %.3fs, %.2fx)" % (before, time_taken / before)
+
+    return line
+
+
+def print_results(results, previous=None):
+    previous_results = {}
+
+    if previous is not None:
+        previous_results = dict((result['command'], result)
+                                for result in previous['results'])
+
+    for result in results:
+        before = previous_results.get(result['command'], {})
+        print("%-28s %s" % (result['command'], format_time(
+            result['best'], before.get('best'))))
+
+        tables = result['tables']
+        before_tables = before.get('tables', {})
+
+        if not tables:
+            continue
+
+        print("  %-26s %s" % ("%d tables" % len(tables), format_time(
+            sum(tables.values()), sum(before_tables.values()))))
+
+        slowest = sorted(tables, key=tables.get, reverse=True)
+
+        for table in slowest[:TABLE_SUMMARY_LENGTH]:
+            print("    %-24s %s" % (table, format_time(
+                tables[table], before_tables.get(table))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split(
+        '\n\n')[0])
+    parser.add_argument('--apps', type=int, default=50,
+                        help="Number of apps with migrations.")
+    parser.add_argument('--migrations', type=int, default=20,
+                        help="Number of migrations per app.")
+    parser.add_argument('--dependency-density', type=float, default=0.2,
+                        help=("Chance of each migration depending on an "
+                              "earlier app."))
+    parser.add_argument('--squashed', type=float, default=0.1,
+                        help="Share of apps with a squashed migration.")
+    parser.add_argument('--project-apps', type=int, default=2,
+                        help="Number of apps using project migrations.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed for generating the project.")
+    parser.add_argument('--rows', type=int, default=None,
+                        help=("Migrate each app to its first migration and "
+                              "add this many rows before the commands."))
+    parser.add_argument('--coalesce-rebuilds', action='store_true',
+                        help=("Apply migrations with the table rebuilds "
+                              "coalesced."))
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of times to run every command.")
+    parser.add_argument('--output', help="Write the results to this file.")
+    parser.add_argument('--compare', help="Compare with a results file.")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the generated projects.")
+    options = parser.parse_args(argv)
+
+    config = {
+        'app_count': options.apps,
+        'migration_count': options.migrations,
+        'dependency_density': options.dependency_density,
+        'squashed_ratio': options.squashed,
+        'project_app_count': options.project_apps,
+        'seed': options.seed,
+    }
+
+    print("%d apps, %d migrations per app, repeated %d times" % (
+        options.apps, options.migrations, options.repeat))
+
+    report = {
+        'config': dict(config, rows=options.rows),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'django_migrate_project': __version__,
+            'platform': platform.platform(),
+        },
+        'coalesce_rebuilds': options.coalesce_rebuilds,
+        'results': run_benchmark(
+            config, options.repeat, options.keep, options.rows,
+            options.coalesce_rebuilds),
+    }
+
+    previous = None
+
+    if options.compare:
+        with open(options.compare) as previous_file:
+            previous = json.load(previous_file)
+
+        if previous['config'] != report['config']:
+            print("Warning: comparing with a run of a different project")
+
+    print_results(report['results'], previous)
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
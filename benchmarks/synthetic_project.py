@@ -0,0 +1,287 @@
+"""
+Generates throwaway Django projects with a large migration history, for
+benchmarking the commands on something closer to a real project than the
+test project.
+
+Each app has a single model, created by its first migration, which every
+later migration adds a field to. A share of the later migrations add a
+foreign key to the model of an earlier app instead, and depend on one of
+its migrations, giving cross-app dependencies. Some apps can have their
+first half of migrations squashed, with the replaced migrations left in
+place as they would be while a project moves over to the squashed one.
+
+The project also has apps with no migrations of their own, listed in
+PROJECT_MIGRATIONS, for makeprojectmigrations and migrateproject.
+"""
+
+from __future__ import unicode_literals
+
+import io
+import os
+import random
+
+
+SETTINGS_TEMPLATE = """\
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SECRET_KEY = 'benchmark'
+
+# The contrib apps are left out, the RunPython operations in their migrations
+# can't be collected
+INSTALLED_APPS = (
+    'django_migrate_project',
+%(apps)s
+)
+
+MIDDLEWARE_CLASSES = ()
+
+PROJECT_MIGRATIONS = [
+%(project_apps)s
+]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    }
+}
+"""
+
+MANAGE_TEMPLATE = """\
+#!/usr/bin/env python
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+    from django.core.management import execute_from_command_line
+
+    execute_from_command_line(sys.argv)
+"""
+
+MIGRATION_TEMPLATE = """\
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+%(replaces)s
+    dependencies = [
+%(dependencies)s    ]
+
+    operations = [
+%(operations)s
+    ]
+"""
+
+MODELS_TEMPLATE = """\
+from __future__ import unicode_literals
+
+from django.db import models
+
+
+class Item(models.Model):
+%(fields)s
+"""
+
+CREATE_MODEL = """\
+        migrations.CreateModel(
+            name='Item',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, \
+auto_created=True, primary_key=True)),
+            ],
+        ),"""
+
+ADD_FIELD = """\
+        migrations.AddField(
+            model_name='item',
+            name='%(name)s',
+            field=%(field)s,
+        ),"""
+
+CHAR_FIELD = "models.CharField(default='', max_length=50)"
+FOREIGN_KEY = ("models.ForeignKey(%s'%s.Item', related_name='+', null=True, "
+               "on_delete=models.CASCADE)")
+
+
+def render_field(target, in_migration=True):
+    """ Renders a char field, or a foreign key to the target app's model """
+
+    if target is None:
+        return CHAR_FIELD
+
+    return FOREIGN_KEY % ('to=' if in_migration else '', target)
+
+
+def render_key(key):
+    return "        ('%s', '%s'),\n" % key
+
+
+class SyntheticMigration(object):
+    """ A migration to generate, see generate_project """
+
+    def __init__(self, app_label, name, operations, fields,
+                 dependencies=(), replaces=()):
+        self.app_label = app_label
+        self.name = name
+        self.operations = operations
+        self.fields = fields
+        self.dependencies = list(dependencies)
+        self.replaces = list(replaces)
+
+    def render(self):
+        replaces = ""
+
+        if self.replaces:
+            replaces = "\n    replaces = [\n%s    ]\n" % "".join(
+                render_key(key) for key in self.replaces)
+
+        return MIGRATION_TEMPLATE % {
+            'replaces': replaces,
+            'dependencies': "".join(
+                render_key(key) for key in self.dependencies),
+            'operations': "\n".join(self.operations),
+        }
+
+
+def plan_app_migrations(app_idx, app_labels, migration_count,
+                        dependency_density, rand, migration_names):
+    """
+    Returns the migrations of an app. Each migration lists the fields it
+    adds as (name, target) pairs, where the target is the app label a foreign
+    key points to, or None for a char field. The names of the migrations of
+    earlier apps are looked up in migration_names.
+    """
+
+    app_label = app_labels[app_idx]
+    migrations = [
+        SyntheticMigration(app_label, '0001_initial', [CREATE_MODEL], [])]
+
+    for idx in range(2, migration_count + 1):
+        previous = migrations[-1]
+        dependencies = [(app_label, previous.name)]
+
+        if app_idx > 0 and rand.random() < dependency_density:
+            # Link to the model of an earlier app, depending on one of its
+            # migrations, which all come after the one creating the model
+            other_label = app_labels[rand.randrange(app_idx)]
+            other_name = rand.choice(migration_names[other_label])
+
+            name = 'link_%d' % idx
+            target = other_label
+            dependencies.append((other_label, other_name))
+        else:
+            name = 'field_%d' % idx
+            target = None
+
+        operation = ADD_FIELD % {'name': name, 'field': render_field(target)}
+        migrations.append(SyntheticMigration(
+            app_label, '%04d_%s' % (idx, name), [operation],
+            [(name, target)], dependencies))
+
+    return migrations
+
+
+def squash_migrations(migrations):
+    """ Returns a migration replacing the given ones, like squashmigrations """
+
+    app_label = migrations[0].app_label
+    operations = []
+    dependencies = []
+
+    for migration in migrations:
+        operations.extend(migration.operations)
+
+        for key in migration.dependencies:
+            if key[0] != app_label and key not in dependencies:
+                dependencies.append(key)
+
+    name = '0001_squashed_%s' % migrations[-1].name
+
+    return SyntheticMigration(
+        app_label, name, operations, [], dependencies,
+        [(app_label, migration.name) for migration in migrations])
+
+
+def write_file(path, contents):
+    with io.open(path, 'w', encoding='utf-8') as output_file:
+        output_file.write(contents)
+
+
+def write_package(path, modules=()):
+    os.mkdir(path)
+    write_file(os.path.join(path, '__init__.py'), "")
+
+    for name, contents in modules:
+        write_file(os.path.join(path, name + '.py'), contents)
+
+
+def render_models(fields):
+    lines = ["    %s = %s" % (name, render_field(target, in_migration=False))
+             for name, target in fields]
+
+    return MODELS_TEMPLATE % {'fields': "\n".join(lines) or "    pass"}
+
+
+def generate_project(directory, app_count=20, migration_count=10,
+                     dependency_density=0.2, squashed_ratio=0.0,
+                     project_app_count=2, seed=0):
+    """
+    Writes a project with the given number of apps and migrations per app
+    to an empty or missing directory, and returns the labels of its apps.
+
+    The dependency density is the chance of each migration after the first
+    linking to an earlier app, and the squashed ratio is the share of apps
+    with a squashed migration. The same arguments always give the same
+    project.
+    """
+
+    rand = random.Random(seed)
+    app_labels = ['app%d' % idx for idx in range(app_count)]
+    project_labels = ['project%d' % idx for idx in range(project_app_count)]
+    squashed_count = int(round(app_count * squashed_ratio))
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    migration_names = {}
+
+    for app_idx, app_label in enumerate(app_labels):
+        migrations = plan_app_migrations(
+            app_idx, app_labels, migration_count, dependency_density, rand,
+            migration_names)
+        migration_names[app_label] = [
+            migration.name for migration in migrations]
+        fields = [field for migration in migrations
+                  for field in migration.fields]
+
+        if app_idx < squashed_count and migration_count > 1:
+            migrations.append(squash_migrations(
+                migrations[:max(migration_count // 2, 2)]))
+
+        app_dir = os.path.join(directory, app_label)
+        write_package(app_dir, [('models', render_models(fields))])
+        write_package(os.path.join(app_dir, 'migrations'), [
+            (migration.name, migration.render()) for migration in migrations])
+
+    for project_label in project_labels:
+        write_package(os.path.join(directory, project_label), [
+            ('models', render_models([('name', None)]))])
+
+    write_package(os.path.join(directory, 'migrations'))
+
+    write_file(os.path.join(directory, 'settings.py'), SETTINGS_TEMPLATE % {
+        'apps': "\n".join("    '%s'," % label
+                          for label in app_labels + project_labels),
+        'project_apps': "\n".join("    '%s'," % label
+                                  for label in project_labels),
+    })
+    write_file(os.path.join(directory, 'manage.py'), MANAGE_TEMPLATE)
+
+    return app_labels + project_labels
@@ -0,0 +1,362 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import tempfile
+
+import django
+from django.conf import settings
+from django.db.migrations.migration import (
+    swappable_dependency, SwappableTuple
+)
+from django.db.migrations.writer import OperationWriter
+from django.utils.six.moves import cPickle as pickle
+
+
+DEFAULT_GRAPH_CACHE_FILENAME = '.migration_graph_cache.json'
+GRAPH_CACHE_VERSION = 2
+
+DEFAULT_OPTIMIZER_CACHE_DIRNAME = '.migration_optimizer_cache'
+DEFAULT_OPTIMIZER_CACHE_SIZE = 64 * 1024 * 1024
+OPTIMIZER_CACHE_VERSION = 1
+
+
+def get_graph_cache():
+    """
+    Returns the graph cache configured by the PROJECT_MIGRATIONS_GRAPH_CACHE
+    setting, or None if the cache is disabled (the default).
+
+    The setting can be True to keep the cache in BASE_DIR, or a file path.
+    """
+
+    try:
+        cache_setting = settings.PROJECT_MIGRATIONS_GRAPH_CACHE
+    except AttributeError:
+        return None
+
+    if not cache_setting:
+        return None
+    elif cache_setting is True:
+        cache_path = os.path.join(
+            settings.BASE_DIR, DEFAULT_GRAPH_CACHE_FILENAME)
+    else:
+        cache_path = cache_setting
+
+    return MigrationGraphCache(cache_path)
+
+
+def get_optimizer_cache():
+    """
+    Returns the optimizer cache configured by the
+    PROJECT_MIGRATIONS_OPTIMIZER_CACHE setting, or None if the cache is
+    disabled (the default).
+
+    The setting can be True to keep the cache in BASE_DIR, or a directory
+    path. PROJECT_MIGRATIONS_OPTIMIZER_CACHE_SIZE bounds its size in bytes.
+    """
+
+    cache_setting = getattr(settings, 'PROJECT_MIGRATIONS_OPTIMIZER_CACHE',
+                            None)
+    max_size = getattr(settings, 'PROJECT_MIGRATIONS_OPTIMIZER_CACHE_SIZE',
+                       DEFAULT_OPTIMIZER_CACHE_SIZE)
+
+    if not cache_setting:
+        return None
+    elif cache_setting is True:
+        cache_path = os.path.join(
+            settings.BASE_DIR, DEFAULT_OPTIMIZER_CACHE_DIRNAME)
+    else:
+        cache_path = cache_setting
+
+    return OptimizerCache(cache_path, max_size)
+
+
+def hash_file(path):
+    """ Returns the SHA-1 hex digest for the contents of a file. """
+
+    with open(path, 'rb') as source_file:
+        return hashlib.sha1(source_file.read()).hexdigest()
+
+
+class MigrationGraphCache(object):
+    """
+    On-disk cache of the graph metadata for migration files.
+
+    Entries are keyed on the migration file path and store the file's
+    mtime, size and content hash alongside the migration's dependencies,
+    replaces and run_before. An entry is only used if the file is unchanged,
+    which is checked by mtime and size first and by content hash when those
+    differ, so touching a file doesn't throw away its entry.
+
+    Swappable dependencies are stored as the name of their setting and
+    resolved when read, so changing the setting doesn't need the cache
+    throwing away. Migrations with swappable dependencies whose setting
+    isn't known, which only happens for imported migrations, aren't cached.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.seen = set()
+        self.dirty = False
+
+        try:
+            with open(path, 'rb') as cache_file:
+                data = json.loads(cache_file.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            data = None
+
+        if data and data.get('environment') == self.environment():
+            self.entries = data.get('files', {})
+
+    def environment(self):
+        """ Things which invalidate the whole cache if they change """
+
+        return {
+            'version': GRAPH_CACHE_VERSION,
+            'django': django.get_version(),
+        }
+
+    def get(self, path):
+        """
+        Returns the cached metadata for the migration file at path, as a dict
+        of keyword arguments for LazyMigration, or None if it's stale.
+        """
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+
+        self.seen.add(path)
+
+        if entry is None:
+            return None
+        elif (entry['mtime'], entry['size']) != (stat.st_mtime, stat.st_size):
+            if entry['hash'] != hash_file(path):
+                return None
+
+            # Same contents, so just remember the new mtime
+            entry['mtime'] = stat.st_mtime
+            entry['size'] = stat.st_size
+            self.dirty = True
+
+        try:
+            dependencies = [
+                self.load_key(key) for key in entry['dependencies']]
+        except AttributeError:
+            # A swappable dependency's setting is gone
+            return None
+
+        return {
+            'dependencies': dependencies,
+            'replaces': [tuple(key) for key in entry['replaces']],
+            'run_before': [tuple(key) for key in entry['run_before']],
+        }
+
+    def set(self, path, header):
+        """
+        Stores the metadata for a migration file, given as a dict with the
+        dependencies, replaces and run_before of the migration.
+        """
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        dependencies = [self.dump_key(key) for key in header['dependencies']]
+
+        self.seen.add(path)
+
+        if None in dependencies:
+            return
+
+        self.entries[path] = {
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': hash_file(path),
+            'dependencies': dependencies,
+            'replaces': [list(key) for key in header['replaces']],
+            'run_before': [list(key) for key in header['run_before']],
+        }
+        self.dirty = True
+
+    def dump_key(self, key):
+        """ Returns the key as JSON, or None if it can't be stored """
+
+        if isinstance(key, SwappableTuple):
+            setting_name = getattr(key, 'setting_name', None)
+
+            if setting_name is None:
+                return None
+
+            return {'setting': setting_name}
+
+        return list(key)
+
+    def load_key(self, key):
+        if isinstance(key, dict):
+            dependency = swappable_dependency(
+                getattr(settings, key['setting']))
+            dependency.setting_name = key['setting']
+
+            return dependency
+
+        return tuple(key)
+
+    def save(self):
+        """ Writes the cache to disk, dropping entries for deleted files. """
+
+        for path in list(self.entries):
+            if path not in self.seen:
+                del self.entries[path]
+                self.dirty = True
+
+        if not self.dirty:
+            return
+
+        data = {'environment': self.environment(), 'files': self.entries}
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        temp_path = None
+
+        try:
+            # Write to a temp file first so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(json.dumps(data).encode('utf-8'))
+
+            getattr(os, 'replace', os.rename)(temp_path, self.path)
+        except (IOError, OSError):
+            # The cache is only an optimization, so don't fail the command
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+        else:
+            self.dirty = False
+
+
+class OptimizerCache(object):
+    """
+    On-disk cache of optimized migration operations.
+
+    Entries are keyed on a hash of the serialized operations, the app label
+    and the Django version, so an app whose unapplied migrations haven't
+    changed doesn't need optimizing again. Each entry is a pickle file in
+    the cache directory, and the least recently used entries are evicted
+    once the directory grows past max_size bytes.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_OPTIMIZER_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, operations, app_label, window=None):
+        """
+        Returns the cache key for optimizing the operations for the app, with
+        the given optimizer window, or None if the operations can't be
+        serialized to work one out.
+        """
+
+        try:
+            serialized = [
+                OperationWriter(operation).serialize()[0]
+                for operation in operations]
+        except ValueError:
+            return None
+
+        data = [OPTIMIZER_CACHE_VERSION, django.get_version(), app_label,
+                window, serialized]
+
+        return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.pickle')
+
+    def get(self, key):
+        """ Returns the cached operations for a key, or None """
+
+        if key is None:
+            return None
+
+        entry_path = self.entry_path(key)
+
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                operations = pickle.loads(entry_file.read())
+
+            # Mark the entry as recently used
+            os.utime(entry_path, None)
+        except Exception:
+            # Missing, or unreadable, which is as good as missing
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        return operations
+
+    def set(self, key, operations):
+        """ Stores the optimized operations for a key """
+
+        if key is None:
+            return
+
+        try:
+            data = pickle.dumps(operations, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+
+        temp_path = None
+
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+            # Write to a temp file first so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+
+            with os.fdopen(fd, 'wb') as entry_file:
+                entry_file.write(data)
+
+            getattr(os, 'replace', os.rename)(temp_path, self.entry_path(key))
+        except (IOError, OSError):
+            # The cache is only an optimization, so don't fail the command
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def save(self):
+        """ Evicts the least recently used entries to bound the cache size """
+
+        try:
+            names = os.listdir(self.path)
+        except (IOError, OSError):
+            return
+
+        entries = []
+
+        for name in names:
+            if not name.endswith('.pickle'):
+                continue
+
+            entry_path = os.path.join(self.path, name)
+
+            try:
+                stat = os.stat(entry_path)
+            except (IOError, OSError):
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.remove(entry_path)
+            except (IOError, OSError):
+                continue
+
+            total_size -= size
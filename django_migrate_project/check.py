@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import os
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.migrations.recorder import MigrationRecorder
+
+from django_migrate_project.loader import (
+    PendingMigrationLoader, ProjectMigrationLoader
+)
+from django_migrate_project.manifest import PendingPlan
+
+
+def get_unapplied_pending_migrations(migrations_dir,
+                                     database=DEFAULT_DB_ALIAS):
+    """
+    Returns the keys of the collected migrations in the directory which
+    still need applying to the database, in the order they apply in.
+
+    If the directory's manifest matches the files in it this only takes one
+    query of the applied migrations. Otherwise the migration graph is built,
+    which reads the dependencies from the migration files (or the graph
+    cache) but doesn't import them.
+
+    Nothing is written to the database, so if it has no table of applied
+    migrations yet, none count as applied rather than the table being made.
+
+    Raises ValueError if the directory doesn't exist or is empty.
+    """
+
+    if not (os.path.isdir(migrations_dir) and os.listdir(migrations_dir)):
+        raise ValueError("Input directory (%s) doesn't exist or is empty." %
+                         migrations_dir)
+
+    connection = get_recorded_connection(connections[database])
+    pending_plan = PendingPlan.from_directory(migrations_dir)
+
+    if pending_plan is not None:
+        applied = set()
+
+        if connection is not None:
+            applied = MigrationRecorder(connection).applied_migrations()
+
+        return pending_plan.unapplied(applied)
+
+    loader = PendingMigrationLoader(
+        connection, pending_migrations_dir=migrations_dir)
+
+    return get_unapplied(loader, loader.pending_migrations)
+
+
+def get_unapplied_project_migrations(database=DEFAULT_DB_ALIAS):
+    """
+    Returns the keys of the migrations which applying the project migrations
+    would apply to the database, in the order they apply in. The migration
+    graph is built without importing the migration files, and like
+    get_unapplied_pending_migrations nothing is written to the database.
+    """
+
+    loader = ProjectMigrationLoader(
+        get_recorded_connection(connections[database]))
+
+    return get_unapplied(loader, loader.project_migrations)
+
+
+def get_recorded_connection(connection):
+    """
+    Returns the connection if its database has a table of applied
+    migrations, or else None. Reading the applied migrations would otherwise
+    create the table, and the checks only read from the database.
+    """
+
+    table_name = MigrationRecorder.Migration._meta.db_table
+
+    if table_name not in connection.introspection.table_names():
+        return None
+
+    return connection
+
+
+def get_unapplied(loader, migrations):
+    """
+    Returns the unapplied keys in the forwards plan for the leaf nodes of the
+    loader's graph which are in migrations.
+    """
+
+    unapplied = []
+    seen = set()
+
+    for target in loader.graph.leaf_nodes():
+        if target not in migrations:
+            continue
+
+        for key in loader.graph.forwards_plan(target):
+            if key not in seen and key not in loader.applied_migrations:
+                seen.add(key)
+                unapplied.append(key)
+
+    return unapplied
@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+
+from copy import copy
+
+import django
+from django.db.migrations.operations import AddField, AlterField, RemoveField
+from django.db.migrations.operations.base import Operation
+from django.db.models.fields import NOT_PROVIDED
+
+from django_migrate_project.loader import LazyMigration
+
+
+# Field operations which SQLite does by rebuilding the whole table
+TABLE_OPERATIONS = (AddField, AlterField, RemoveField)
+
+
+def get_state_model(state, app_label, model_name):
+    if django.VERSION < (1, 8):
+        return state.render().get_model(app_label, model_name)
+
+    return state.apps.get_model(app_label, model_name)
+
+
+def allow_migrate_model(operation, connection_alias, model):
+    try:
+        return operation.allow_migrate_model(connection_alias, model)
+    except AttributeError:  # Django 1.7
+        return operation.allowed_to_migrate(connection_alias, model)
+
+
+def is_rebuildable(field, connection):
+    """ Returns if a field is only a column of its model's table """
+
+    if field.primary_key or field.get_internal_type() == 'ManyToManyField':
+        return False
+
+    return field.db_parameters(connection=connection)['type'] is not None
+
+
+class TableOperations(Operation):
+    """
+    Adjacent operations on the fields of the same model. On SQLite, where
+    each of them rebuilds the model's table, they're all done with a single
+    rebuild. Otherwise they're run one by one as usual.
+    """
+
+    def __init__(self, model_name, operations):
+        self.model_name = model_name
+        self.operations = operations
+
+    @property
+    def field_names(self):
+        return [operation.name.lower() for operation in self.operations]
+
+    @property
+    def reversible(self):
+        return all(operation.reversible for operation in self.operations)
+
+    def state_forwards(self, app_label, state):
+        for operation in self.operations:
+            operation.state_forwards(app_label, state)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if not self.rebuild(app_label, schema_editor, from_state, to_state):
+            self.run_operations(app_label, schema_editor, from_state,
+                                to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if not self.rebuild(app_label, schema_editor, from_state, to_state,
+                            backwards=True):
+            self.run_operations(app_label, schema_editor, from_state,
+                                to_state, backwards=True)
+
+    def describe(self):
+        return "Change fields %s on %s" % (
+            ", ".join(self.field_names), self.model_name)
+
+    def run_operations(self, app_label, schema_editor, from_state, to_state,
+                       backwards=False):
+        """ Runs the operations one by one, as the migration would """
+
+        if len(self.operations) == 1:
+            # No intermediate states are needed for a lone operation
+            operation = self.operations[0]
+
+            if backwards:
+                operation.database_backwards(
+                    app_label, schema_editor, from_state, to_state)
+            else:
+                operation.database_forwards(
+                    app_label, schema_editor, from_state, to_state)
+
+            return
+
+        # The operations start from the state before the group either way
+        state = to_state if backwards else from_state
+        states = [state]
+
+        for operation in self.operations:
+            state = state.clone()
+            operation.state_forwards(app_label, state)
+            states.append(state)
+
+        if backwards:
+            for idx, operation in reversed(list(enumerate(self.operations))):
+                operation.database_backwards(
+                    app_label, schema_editor, states[idx + 1], states[idx])
+        else:
+            for idx, operation in enumerate(self.operations):
+                operation.database_forwards(
+                    app_label, schema_editor, states[idx], states[idx + 1])
+
+    def rebuild(self, app_label, schema_editor, from_state, to_state,
+                backwards=False):
+        """
+        Rebuilds the table once for all the operations, going from the model
+        in from_state to the one in to_state. Returns False if they can't
+        be done that way, and need running one by one instead.
+        """
+
+        connection = schema_editor.connection
+
+        if connection.vendor != 'sqlite' or len(self.operations) < 2:
+            return False
+
+        from_model = get_state_model(from_state, app_label, self.model_name)
+        to_model = get_state_model(to_state, app_label, self.model_name)
+
+        if not allow_migrate_model(self, connection.alias, to_model):
+            return True
+
+        create_fields = []
+        delete_fields = []
+        alter_fields = []
+        defaults = []
+
+        for operation in self.operations:
+            if isinstance(operation, AlterField):
+                from_field = from_model._meta.get_field(operation.name)
+                to_field = to_model._meta.get_field(operation.name)
+                alter_fields.append((from_field, to_field))
+
+                if not operation.preserve_default:
+                    defaults.append((to_field, operation.field.default))
+            elif isinstance(operation, AddField) != backwards:
+                field = to_model._meta.get_field(operation.name)
+                create_fields.append(field)
+
+                if not getattr(operation, 'preserve_default', True):
+                    defaults.append((field, operation.field.default))
+            else:
+                delete_fields.append(
+                    from_model._meta.get_field(operation.name))
+
+        fields = create_fields + delete_fields + [
+            field for fields in alter_fields for field in fields]
+
+        if not all(is_rebuildable(field, connection) for field in fields):
+            return False
+
+        # Like the operations, fields not keeping their default only have it
+        # while the table is rebuilt
+        for field, default in defaults:
+            field.default = default
+
+        try:
+            schema_editor._remake_table(
+                from_model, create_fields=create_fields,
+                delete_fields=delete_fields, alter_fields=alter_fields)
+        finally:
+            for field, default in defaults:
+                field.default = NOT_PROVIDED
+
+        return True
+
+
+def coalesce_operations(operations):
+    """
+    Returns the operations with each run of adjacent field operations on the
+    same model grouped together as TableOperations. A field is only changed
+    once in each group.
+    """
+
+    coalesced = []
+    group = None
+
+    for operation in operations:
+        if not isinstance(operation, TABLE_OPERATIONS):
+            coalesced.append(operation)
+            group = None
+            continue
+
+        model_name = operation.model_name.lower()
+
+        if (group is None or group.model_name != model_name or
+                operation.name.lower() in group.field_names):
+            group = TableOperations(model_name, [])
+            coalesced.append(group)
+
+        group.operations.append(operation)
+
+    return coalesced
+
+
+def coalesce_migration(migration):
+    """ Returns a copy of the migration with its operations coalesced """
+
+    # A lazy migration's operations belong to the real migration it loads,
+    # so copying it would share them
+    if isinstance(migration, LazyMigration):
+        migration = migration.load()
+
+    coalesced = copy(migration)
+    coalesced.operations = coalesce_operations(migration.operations)
+
+    return coalesced
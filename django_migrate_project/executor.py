@@ -1,14 +1,175 @@
 from __future__ import unicode_literals
 
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import transaction
 from django.db.migrations.executor import MigrationExecutor
 
+from django_migrate_project.coalesce import coalesce_migration
 from django_migrate_project.loader import ProjectMigrationLoader
+from django_migrate_project.recorder import ProjectMigrationRecorder
+from django_migrate_project.timings import active_recorders, phase
+
+
+# Schema editor methods which change a table, taking its model first
+TABLE_METHODS = (
+    'create_model', 'delete_model', 'add_field', 'remove_field',
+    'alter_field', 'alter_unique_together', 'alter_index_together',
+    'alter_db_table', '_remake_table',
+)
 
 
 class ProjectMigrationExecutor(MigrationExecutor):
-    def __init__(self, connection, progress_callback=None):
-        super(ProjectMigrationExecutor, self).__init__(
-            connection, progress_callback)
+    def __init__(self, connection, progress_callback=None, loader=None,
+                 coalesce_rebuilds=False):
+        # NOTE: The standard __init__ isn't called since it builds a stock
+        #       MigrationLoader, which loads the whole graph for nothing
+        self.connection = connection
+        self.recorder = ProjectMigrationRecorder(self.connection)
+        self.progress_callback = progress_callback
+        self.coalesce_rebuilds = coalesce_rebuilds
+
+        if loader is None:
+            loader = ProjectMigrationLoader(self.connection)
+
+        self.loader = loader
+
+    def migrate(self, targets, plan=None, fake=False, **kwargs):
+        if plan is None:
+            plan = self.migration_plan(targets)
+
+        if not fake:
+            if self.coalesce_rebuilds:
+                plan = [(coalesce_migration(migration), backwards)
+                        for migration, backwards in plan]
+
+            with table_phases(self):
+                return super(ProjectMigrationExecutor, self).migrate(
+                    targets, plan, fake=fake, **kwargs)
+
+        self.fake_migrations(plan)
+
+        # Django 1.8 also records squashed migrations once they're applied
+        if hasattr(self, 'check_replacements'):  # pragma: no branch
+            self.check_replacements()
+
+    def fake_migrations(self, plan):
+        """
+        Records the migrations in the plan as run without running them. The
+        project states aren't needed, so unlike a normal migrate they aren't
+        rendered, and the records are written in bulk.
+        """
+
+        applied_keys = []
+        unapplied_keys = []
+
+        for migration, backwards in plan:
+            # For replacement migrations, record individual statuses
+            keys = migration.replaces or [
+                (migration.app_label, migration.name)]
+
+            if backwards:
+                unapplied_keys.extend(keys)
+            else:
+                applied_keys.extend(keys)
+
+        self.recorder.record_unapplied_many(unapplied_keys)
+        self.recorder.record_applied_many(applied_keys)
+
+        if self.progress_callback:
+            for migration, backwards in plan:
+                action = 'unapply' if backwards else 'apply'
+                self.progress_callback(action + '_start', migration, True)
+                self.progress_callback(action + '_success', migration, True)
+
+
+@contextmanager
+def migration_transaction(connection, single_transaction=False):
+    """
+    Runs everything inside in a single transaction if asked to, so a failure
+    leaves none of it applied. The schema editor of each migration then opens
+    a savepoint in it rather than a transaction of its own, and the migration
+    records are written in it too.
+    """
+
+    if not single_transaction:
+        yield
+        return
+
+    with transaction.atomic(using=connection.alias):
+        yield
+
+
+@contextmanager
+def table_phases(executor):
+    """
+    Marks each change the executor's schema editors make to a table as a
+    phase named after the table, while phases are being recorded. Only the
+    executor's own connection is wrapped, so anything else using the
+    connection, such as a RunPython step opening a schema editor of its own,
+    gets the usual schema editor. The migrations run as they otherwise would.
+    """
+
+    if not active_recorders:
+        yield
+        return
+
+    connection = executor.connection
+    executor.connection = TimedTableConnection(connection)
+
+    try:
+        yield
+    finally:
+        executor.connection = connection
+
+
+class TimedTableConnection(object):
+    """
+    Proxies a connection, but with the changes its schema editors make to a
+    table timed.
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def schema_editor(self, *args, **kwargs):
+        schema_editor = self._connection.schema_editor(*args, **kwargs)
+        time_table_methods(schema_editor)
+
+        return schema_editor
+
+
+def time_table_methods(schema_editor):
+    """
+    Wraps the schema editor's methods which change a table in a phase named
+    after the table. Changes made as part of another, such as SQLite
+    rebuilding a table to add a field, are left in the outer phase.
+    """
+
+    changing = []
+
+    def time_method(method):
+        @wraps(method)
+        def wrapper(model, *args, **kwargs):
+            if changing:
+                return method(model, *args, **kwargs)
+
+            changing.append(model)
+
+            try:
+                with phase('executor.table.%s' % model._meta.db_table):
+                    return method(model, *args, **kwargs)
+            finally:
+                changing.pop()
+
+        return wrapper
+
+    for name in TABLE_METHODS:
+        method = getattr(schema_editor, name, None)
 
-        # Change out the migration loader
-        self.loader = ProjectMigrationLoader(self.connection)
+        if method is not None:
+            setattr(schema_editor, name, time_method(method))
@@ -0,0 +1,337 @@
+from __future__ import unicode_literals
+
+from collections import defaultdict, OrderedDict
+
+
+# Bound on the states searched to split apps into the fewest sets
+MAX_SPLIT_STATES = 10000
+
+
+def get_parents(graph, key):
+    """ Returns the keys of the direct dependencies of a node in the graph """
+
+    node_map = getattr(graph, 'node_map', None)
+
+    if node_map is not None:
+        return [parent.key for parent in node_map[key].parents]
+    else:  # pragma: no cover
+        # Django 1.7 graphs only keep dicts of keys
+        return graph.dependencies.get(key, ())
+
+
+def walk_app_migrations(loader, leaf_nodes):
+    """
+    Walks the unapplied migrations from each of the leaf nodes through their
+    dependencies, collecting the migrations reached from the same app.
+
+    Returns a dict mapping app labels to lists of migrations, newest first.
+    Migrations come after everything they depend on, even through other
+    apps, so reversing a list gives an order they can be applied in. Each
+    migration's dependencies are only walked once, and the walk is
+    iterative, so shared ancestors and deep histories are cheap.
+    """
+
+    app_migrations = defaultdict(OrderedDict)
+    walked = set()
+    finished = {}
+    applied = loader.applied_migrations
+
+    for leaf_key in leaf_nodes:
+        stack = [(leaf_key[0], leaf_key)]
+
+        while stack:
+            current_app, migration_key = stack.pop()
+
+            if current_app is None:
+                # Everything the migration depends on has been walked
+                finished[migration_key] = len(finished)
+                continue
+
+            if migration_key in applied:
+                continue
+
+            app_label = migration_key[0]
+            migration_key = (
+                loader.check_key(migration_key, current_app) or migration_key)
+
+            if app_label == current_app:
+                migrations = app_migrations[app_label]
+
+                if migration_key not in migrations:
+                    migrations[migration_key] = loader.get_migration(
+                        *migration_key)
+
+            if migration_key not in walked:
+                walked.add(migration_key)
+                migration = loader.get_migration(*migration_key)
+                stack.append((None, migration_key))
+
+                # Reversed, so the first dependency is walked first
+                for dependency in reversed(migration.dependencies):
+                    stack.append((app_label, dependency))
+
+    return dict(
+        (app_label, [migration for key, migration in sorted(
+            migrations.items(), key=lambda item: finished[item[0]],
+            reverse=True)])
+        for app_label, migrations in app_migrations.items())
+
+
+def find_strongly_connected_components(nodes, edges):
+    """
+    Tarjan's algorithm, done iteratively so large graphs don't blow the stack.
+
+    The edges map each node to the nodes it points to. Returns a list of sets
+    of nodes, with each component coming after every component it points to.
+    """
+
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for root in nodes:
+        if root in index:
+            continue
+
+        work = [(root, iter(sorted(edges.get(root, ()))))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, successors = work[-1]
+
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append(
+                        (successor, iter(sorted(edges.get(successor, ())))))
+                    break
+                elif successor in on_stack:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            else:
+                work.pop()
+
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+                if lowlink[node] == index[node]:
+                    component = set()
+
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.add(member)
+
+                        if member == node:
+                            break
+
+                    components.append(component)
+
+    return components
+
+
+def split_app_migrations(graph, migration_keys):
+    """
+    Works out how to split the given migrations for each app into as few
+    sets as possible, such that squashing each set into a single migration
+    can't create circular dependencies between the squashed migrations.
+
+    Apps only need splitting when they depend on each other in a cycle, so
+    the app-level dependency graph is condensed into its strongly connected
+    components, and every app outside of a cycle keeps all its migrations
+    in one set. Returns a dict mapping app labels to lists of sets of keys,
+    with the oldest set first.
+    """
+
+    migration_keys = set(migration_keys)
+    app_keys = defaultdict(set)
+    app_edges = defaultdict(set)
+    parents = {}
+
+    for key in migration_keys:
+        app_keys[key[0]].add(key)
+        parents[key] = [parent for parent in get_parents(graph, key)
+                        if parent in migration_keys]
+
+        for parent in parents[key]:
+            if parent[0] != key[0]:
+                app_edges[key[0]].add(parent[0])
+
+    splits = {}
+    components = find_strongly_connected_components(
+        sorted(app_keys), app_edges)
+
+    for component in components:
+        if len(component) == 1:
+            app_label, = component
+            splits[app_label] = [app_keys[app_label]]
+        else:
+            component_keys = set()
+
+            for app_label in component:
+                component_keys.update(app_keys[app_label])
+
+            splits.update(split_component(component_keys, parents))
+
+    return splits
+
+
+def split_component(keys, parents):
+    """
+    Splits the migrations of apps which depend on each other in a cycle into
+    as few sets as possible.
+
+    Sets are peeled off from the newest migrations backwards, each taking
+    the most migrations of one app it can: every one whose dependents have
+    all been taken already, or are in the same set. Taking fewer is never
+    better, since what's left then has at least as much to split. Which app
+    to peel next is chosen by a breadth-first search, so the first way found
+    to peel off everything uses the fewest sets.
+
+    With linear histories what's left is always some of the oldest
+    migrations of each app, so the search is bounded by the product of the
+    number of migrations of each app, plus one. Finding the fewest sets is
+    hard in general, so when that bound is over MAX_SPLIT_STATES, or the
+    search goes over it anyway because of branching histories, the
+    migrations are peeled greedily instead. That's polynomial in the size
+    of the component, but only a heuristic which can use more sets than
+    needed.
+    """
+
+    app_keys = defaultdict(list)
+    children = defaultdict(list)
+
+    for key in keys:
+        app_keys[key[0]].append(key)
+
+        for parent in parents[key]:
+            if parent in keys:
+                children[parent].append(key)
+
+    state_bound = 1
+
+    for app_label in app_keys:
+        state_bound *= len(app_keys[app_label]) + 1
+
+        if state_bound > MAX_SPLIT_STATES:
+            return split_component_greedily(app_keys, parents, children)
+
+    start = frozenset(keys)
+    previous = {start: None}
+    states = [start]
+
+    while frozenset() not in previous:
+        if len(previous) > MAX_SPLIT_STATES:  # pragma: no cover
+            return split_component_greedily(app_keys, parents, children)
+
+        next_states = []
+
+        for remaining in states:
+            for app_label in sorted(app_keys):
+                migration_set = peel_migrations(
+                    remaining, app_keys[app_label], parents, children)
+                state = remaining.difference(migration_set)
+
+                if migration_set and state not in previous:
+                    previous[state] = (remaining, app_label, migration_set)
+                    next_states.append(state)
+
+        states = next_states
+
+    # Walking back from the end reaches the oldest set first
+    splits = defaultdict(list)
+    state = frozenset()
+
+    while previous[state] is not None:
+        state, app_label, migration_set = previous[state]
+        splits[app_label].append(migration_set)
+
+    return dict(splits)
+
+
+def split_component_greedily(app_keys, parents, children):
+    """
+    Splits the migrations like split_component, but always peeling off an
+    app which can take all of its remaining migrations, or else the largest
+    set. This is quick but doesn't always give the fewest sets.
+
+    What an app can peel off only changes when it's peeled, or when some of
+    the dependents of its migrations are, so the sets are kept between
+    steps and only those apps are peeled again.
+    """
+
+    remaining = set(key for keys in app_keys.values() for key in keys)
+    app_counts = dict((app_label, len(keys))
+                      for app_label, keys in app_keys.items())
+    peeled = {}
+    splits = defaultdict(list)
+
+    while remaining:
+        best_app = best_set = None
+
+        for app_label in sorted(app_keys):
+            migration_set = peeled.get(app_label)
+
+            if migration_set is None:
+                migration_set = peeled[app_label] = peel_migrations(
+                    remaining, app_keys[app_label], parents, children)
+
+            if not migration_set:
+                continue
+            elif len(migration_set) == app_counts[app_label]:
+                best_app, best_set = app_label, migration_set
+                break
+            elif best_set is None or len(migration_set) > len(best_set):
+                best_app, best_set = app_label, migration_set
+
+        splits[best_app].append(best_set)
+        app_counts[best_app] -= len(best_set)
+        remaining.difference_update(best_set)
+        del peeled[best_app]
+
+        for key in best_set:
+            for parent in parents[key]:
+                peeled.pop(parent[0], None)
+
+    # The sets were peeled off newest first
+    return dict((app_label, list(reversed(migration_sets)))
+                for app_label, migration_sets in splits.items())
+
+
+def peel_migrations(remaining, app_keys, parents, children):
+    """
+    Returns the most of an app's migrations, given by app_keys, which can be
+    peeled off the remaining ones: those whose remaining dependents are all
+    in the set.
+    """
+
+    app_label = app_keys[0][0]
+    counts = {}
+    migration_set = set()
+    stack = [key for key in app_keys if key in remaining and
+             not any(child in remaining for child in children[key])]
+
+    while stack:
+        key = stack.pop()
+        migration_set.add(key)
+
+        for parent in parents[key]:
+            if parent[0] == app_label and parent in remaining:
+                count = counts.get(parent)
+
+                if count is None:
+                    count = sum(1 for child in children[parent]
+                                if child in remaining)
+
+                counts[parent] = count - 1
+
+                if count == 1:
+                    stack.append(parent)
+
+    return migration_set
@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+
+import ast
+
+from django.conf import settings
+from django.db.migrations.migration import swappable_dependency
+from django.utils import six
+
+
+HEADER_ATTRIBUTES = ('dependencies', 'replaces', 'run_before')
+MIGRATION_BASES = ('Migration', 'migrations.Migration')
+
+
+class DynamicHeaderError(ValueError):
+    """ Raised when a migration header can't be read without importing it """
+
+
+def read_migration_header(path):
+    """
+    Reads the dependencies, replaces and run_before of the migration in the
+    file at path from its source, without importing the module.
+
+    Returns a dict of those attributes, or None if the migration does
+    anything which can't be understood statically, in which case the module
+    needs to be imported instead.
+    """
+
+    with open(path, 'rb') as source_file:
+        source = source_file.read()
+
+    try:
+        module = ast.parse(source, path)
+    except SyntaxError:
+        return None  # Let the import raise a proper error
+
+    try:
+        return parse_module(module)
+    except DynamicHeaderError:
+        return None
+
+
+def parse_module(module):
+    migration_class = None
+
+    for node in module.body:
+        if isinstance(node, ast.ClassDef) and node.name == 'Migration':
+            migration_class = node
+        elif references_migration(node):
+            # Something is done to the class after it's defined
+            raise DynamicHeaderError()
+
+    if migration_class is None:
+        raise DynamicHeaderError()
+
+    bases = [dotted_name(base) for base in migration_class.bases]
+
+    # The attributes could be inherited from a custom base class
+    if len(bases) != 1 or bases[0] not in MIGRATION_BASES:
+        raise DynamicHeaderError()
+    elif getattr(migration_class, 'decorator_list', None):
+        raise DynamicHeaderError()
+
+    header = dict((attribute, []) for attribute in HEADER_ATTRIBUTES)
+
+    for node in migration_class.body:
+        if isinstance(node, ast.Assign):
+            names = [dotted_name(target) for target in node.targets]
+
+            for name in names:
+                if name in HEADER_ATTRIBUTES:
+                    header[name] = parse_keys(node.value)
+        elif isinstance(node, ast.Pass) or is_docstring(node):
+            continue
+        else:
+            # Methods (South-style migrations use them), augmented
+            # assignments and so on could all change the header
+            raise DynamicHeaderError()
+
+    return header
+
+
+def parse_keys(node):
+    """ Parses a list of (app_label, migration_name) keys """
+
+    if not isinstance(node, (ast.List, ast.Tuple)):
+        raise DynamicHeaderError()
+
+    keys = []
+
+    for element in node.elts:
+        if isinstance(element, ast.Call):
+            keys.append(parse_swappable_dependency(element))
+            continue
+
+        try:
+            key = ast.literal_eval(element)
+        except ValueError:
+            raise DynamicHeaderError()
+
+        if not (isinstance(key, (list, tuple)) and len(key) == 2):
+            raise DynamicHeaderError()
+        elif not all(isinstance(part, six.string_types) for part in key):
+            raise DynamicHeaderError()
+
+        keys.append(tuple(key))
+
+    return keys
+
+
+def parse_swappable_dependency(node):
+    """ Parses migrations.swappable_dependency(settings.<NAME>) """
+
+    function_name = dotted_name(node.func)
+    valid_names = ('swappable_dependency', 'migrations.swappable_dependency')
+
+    if function_name not in valid_names or len(node.args) != 1:
+        raise DynamicHeaderError()
+    elif node.keywords or getattr(node, 'starargs', None):
+        raise DynamicHeaderError()
+
+    setting_name = dotted_name(node.args[0])
+
+    if not setting_name or not setting_name.startswith('settings.'):
+        raise DynamicHeaderError()
+
+    setting_name = setting_name.split('.', 1)[1]
+
+    try:
+        value = getattr(settings, setting_name)
+    except AttributeError:
+        raise DynamicHeaderError()
+
+    # Keep the name of the setting, so the graph cache can resolve the
+    # dependency again rather than keep its current value
+    dependency = swappable_dependency(value)
+    dependency.setting_name = setting_name
+
+    return dependency
+
+
+def dotted_name(node):
+    """ Returns 'a.b.c' for a Name or Attribute node, otherwise None """
+
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        value = dotted_name(node.value)
+
+        if value is not None:
+            return value + '.' + node.attr
+
+    return None
+
+
+def is_docstring(node):
+    if not isinstance(node, ast.Expr):
+        return False
+
+    try:
+        return isinstance(ast.literal_eval(node.value), six.string_types)
+    except ValueError:
+        return False
+
+
+def references_migration(node):
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name) and child.id == 'Migration':
+            return True
+
+    return False
@@ -1,26 +1,386 @@
 from __future__ import unicode_literals
 
 from collections import defaultdict
+from functools import partial
 from importlib import import_module
 
 import errno
+import hashlib
 import os
 import sys
+import types
 
+import django
 from django.apps import apps
 from django.conf import settings
 from django.db.migrations.graph import MigrationGraph
-from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.loader import (
+    BadMigrationError, MigrationLoader, MIGRATIONS_MODULE_NAME
+)
+from django.db.migrations.migration import Migration
 from django.db.migrations.recorder import MigrationRecorder
 from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
 
+from django_migrate_project.cache import get_graph_cache
+from django_migrate_project.header import (
+    HEADER_ATTRIBUTES, read_migration_header
+)
+from django_migrate_project.timings import phase, timed
+
+try:
+    from importlib import invalidate_caches
+except ImportError:  # pragma: no cover
+    def invalidate_caches():
+        pass  # Python 2 has no finder caches to invalidate
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:  # pragma: no cover
+    def cache_from_source(path):
+        return path + 'c'
+
 
 PROJECT_MIGRATIONS_MODULE_NAME = 'migrations'
 DEFAULT_PENDING_MIGRATIONS_DIRECTORY = 'pending_migrations'
+PENDING_MIGRATIONS_NAMESPACE = '_django_migrate_project_pending'
+
+
+def get_pending_namespace(migrations_dir):
+    """
+    Returns the name of the private package that the files in a pending
+    migrations directory are imported under, creating it if needed.
+
+    The package's __path__ is the directory, so the standard import machinery
+    finds the migration files there and only there. Each directory gets its
+    own package, so the files never shadow (or get shadowed by) top-level
+    modules with the same name.
+    """
+
+    migrations_dir = os.path.abspath(migrations_dir)
+    digest = hashlib.sha1(migrations_dir.encode('utf-8')).hexdigest()[:12]
+    namespace = '%s_%s' % (PENDING_MIGRATIONS_NAMESPACE, digest)
+
+    if namespace not in sys.modules:
+        package = types.ModuleType(str(namespace))
+        package.__path__ = [migrations_dir]
+        sys.modules[namespace] = package
+
+    return namespace
+
+
+def import_pending(migrations_dir, module_name):
+    """
+    Imports a migration file from a pending migrations directory. A module
+    that was imported before is reused unless the file has changed since.
+    """
+
+    full_name = '%s.%s' % (get_pending_namespace(migrations_dir), module_name)
+    path = os.path.join(migrations_dir, module_name + '.py')
+    stat = os.stat(path)
+    signature = (stat.st_mtime, stat.st_size)
+    module = sys.modules.get(full_name)
+
+    if module is not None and module.__pending_signature__ != signature:
+        del sys.modules[full_name]
+        invalidate_caches()
+
+        # Bytecode is checked against the mtime in whole seconds (and on
+        # Python 3 the size), so a quick rewrite could reuse stale bytecode
+        try:
+            os.remove(cache_from_source(path))
+        except OSError:
+            pass
+
+    module = import_module(full_name)
+    module.__pending_signature__ = signature
+
+    return module
+
+
+def proxy_class_attributes(cls):
+    """
+    Class decorator for LazyMigration, proxying the class attributes of its
+    bases, such as 'initial' and 'atomic' on newer versions of Django, to
+    the real migration. Otherwise they'd be found on the class, giving the
+    defaults rather than what the real migration sets.
+    """
+
+    def proxy(name):
+        def getter(self):
+            return getattr(self.load(), name)
+
+        def setter(self, value):
+            setattr(self.load(), name, value)
+
+        return property(getter, setter)
+
+    for base in cls.__mro__[1:]:
+        for name, value in list(vars(base).items()):
+            if name.startswith('_') or name in HEADER_ATTRIBUTES:
+                continue
+            elif name in vars(cls):
+                continue
+            elif callable(value) or isinstance(
+                    value, (classmethod, staticmethod, property)):
+                continue
+
+            setattr(cls, name, proxy(name))
+
+    return cls
+
+
+@proxy_class_attributes
+class LazyMigration(Migration):
+    """
+    Stand-in for a migration whose graph metadata was read without importing
+    its module, either from the graph cache or from the migration's source.
+
+    The migration module is only imported once something other than the
+    dependencies, replaces or run_before is needed, such as the operations.
+    """
+
+    def __init__(self, name, app_label, load_module, dependencies=(),
+                 replaces=(), run_before=()):
+        self.name = name
+        self.app_label = app_label
+        self.dependencies = list(dependencies)
+        self.replaces = list(replaces)
+        self.run_before = list(run_before)
+        self._load_module = load_module
+        self._migration = None
+
+    def load(self):
+        """ Imports the migration module and returns the real migration. """
+
+        if self._migration is None:
+            module = self._load_module()
+            migration = module.Migration(self.name, self.app_label)
+
+            # Keep any dependency re-pointing done while building the graph
+            migration.dependencies = self.dependencies
+            migration.replaces = self.replaces
+            migration.run_before = self.run_before
+
+            self._migration = migration
+
+        return self._migration
+
+    @property
+    def operations(self):
+        return self.load().operations
+
+    @operations.setter
+    def operations(self, operations):
+        self.load().operations = operations
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def mutate_state(self, *args, **kwargs):
+        return self.load().mutate_state(*args, **kwargs)
+
+    def apply(self, *args, **kwargs):
+        return self.load().apply(*args, **kwargs)
+
+    def unapply(self, *args, **kwargs):
+        return self.load().unapply(*args, **kwargs)
+
+
+class AppLabelIndex(object):
+    """
+    Resolves file names of the form <app_label>_<migration_name> to the app
+    they belong to. The app labels are kept in a character trie, so a lookup
+    is O(length of the name) and always picks the longest matching label,
+    i.e. 'blog_extra_0001_project' belongs to 'blog_extra' and not 'blog'.
+    """
+
+    def __init__(self, app_labels):
+        self.trie = {}
+
+        for app_label in app_labels:
+            node = self.trie
+
+            for char in app_label:
+                node = node.setdefault(char, {})
+
+            node[None] = app_label  # Marks the end of a label
+
+    def resolve(self, name):
+        """ Returns (app_label, migration_name), or None if no app matches """
+
+        node = self.trie
+        app_label = None
+
+        for char in name:
+            if char == '_' and None in node:
+                app_label = node[None]
+
+            node = node.get(char)
+
+            if node is None:
+                break
+
+        if app_label is None:
+            return None
+
+        return app_label, name[len(app_label) + 1:]
 
 
 class ProjectMigrationLoaderMixin(object):
+    graph_cache = None
+    app_label_index = None
+
+    def get_app_label_index(self):
+        """ Returns the app label index, building it on first use """
+
+        if self.app_label_index is None:
+            self.app_label_index = AppLabelIndex(
+                app_config.label for app_config in apps.get_app_configs())
+
+        return self.app_label_index
+
+    def load_migration(self, path, app_label, migration_name, load_module):
+        """
+        Loads the migration in the file at path. When the graph metadata can
+        be read from the graph cache or from the source without executing it,
+        a LazyMigration is returned and the module isn't imported. The path
+        is kept in migration_paths, keyed on the migration's key.
+        """
+
+        self.migration_paths[app_label, migration_name] = path
+
+        cache = self.graph_cache
+        header = None
+
+        if cache is not None:
+            header = cache.get(path)
+
+        if header is None:
+            header = read_migration_header(path)
+
+            if header is not None and cache is not None:
+                cache.set(path, header)
+
+        if header is not None:
+            return LazyMigration(
+                migration_name, app_label, load_module, **header)
+
+        module = load_module()
+
+        if not hasattr(module, "Migration"):
+            raise BadMigrationError(
+                "Migration %s in app %s has no Migration class" %
+                (migration_name, app_label))
+
+        migration = module.Migration(migration_name, app_label)
+
+        # South-style migrations are never cached so they're always detected
+        if cache is not None and not hasattr(migration, 'forwards'):
+            cache.set(path, {
+                'dependencies': migration.dependencies,
+                'replaces': migration.replaces,
+                'run_before': migration.run_before,
+            })
+
+        return migration
+
+    def load_disk(self):
+        """
+        Loads the migrations for all apps from disk. Only the graph metadata
+        is loaded up front, see load_migration.
+        """
+
+        # NOTE: This mirrors the standard MigrationLoader.load_disk
+        self.disk_migrations = {}
+        self.migration_paths = {}
+        self.unmigrated_apps = set()
+        self.migrated_apps = set()
+
+        for app_config in apps.get_app_configs():
+            if django.VERSION < (1, 8) and app_config.models_module is None:
+                continue
+
+            # Get the migrations module directory
+            module_name = self.migrations_module(app_config.label)
+            was_loaded = module_name in sys.modules
+
+            try:
+                module = import_module(module_name)
+            except ImportError as e:
+                no_module = "No module named" in str(e)
+
+                if no_module and MIGRATIONS_MODULE_NAME in str(e):
+                    self.unmigrated_apps.add(app_config.label)
+                    continue
+
+                raise
+            else:
+                # PY3 will happily import empty dirs as namespaces, and the
+                # module may not be a package (e.g. migrations.py).
+                if not (hasattr(module, '__file__') and
+                        hasattr(module, '__path__')):
+                    self.unmigrated_apps.add(app_config.label)
+                    continue
+
+                # Force a reload if it's already loaded (tests need this)
+                if was_loaded:
+                    six.moves.reload_module(module)
+
+            self.migrated_apps.add(app_config.label)
+            directory = os.path.dirname(module.__file__)
+            south_style_migrations = False
+
+            for migration_name in self.list_migration_files(directory):
+                load_module = partial(
+                    import_module, "%s.%s" % (module_name, migration_name))
+                path = os.path.join(directory, migration_name + '.py')
+
+                try:
+                    migration = self.load_migration(
+                        path, app_config.label, migration_name, load_module)
+                except ImportError as e:
+                    # Ignore South import errors, as we're triggering them
+                    if "south" in str(e).lower():
+                        south_style_migrations = True
+                        break
+
+                    raise
+
+                lazy = isinstance(migration, LazyMigration)
+
+                # Ignore South-style migrations
+                if not lazy and hasattr(migration, "forwards"):
+                    south_style_migrations = True
+                    break
+
+                key = app_config.label, migration_name
+                self.disk_migrations[key] = migration
+
+            if south_style_migrations:
+                self.migrated_apps.discard(app_config.label)
+                self.unmigrated_apps.add(app_config.label)
+
+    def list_migration_files(self, migrations_dir):
+        """ Returns the module names of the migration files in a directory """
+
+        migration_names = []
+
+        # Code cribbed from standard MigrationLoader class
+        for name in os.listdir(migrations_dir):
+            is_file = os.path.isfile(os.path.join(migrations_dir, name))
+
+            if is_file and name.endswith('.py'):
+                import_name = name.rsplit('.', 1)[0]
+                if import_name[0] not in '_.~':
+                    migration_names.append(import_name)
+
+        return migration_names
+
+    @timed('loader.get_app_migrations')
     def get_app_migrations(self, migrations_dir, non_package=False,
                            ignore_missing_directory=True):
         migrations_by_app = defaultdict(list)
@@ -33,43 +393,27 @@ class ProjectMigrationLoaderMixin(object):
                           "No such directory: " + migrations_dir,
                           migrations_dir)
 
-        migration_names = []
+        app_label_index = self.get_app_label_index()
 
-        # Code cribbed from standard MigrationLoader class
-        for name in os.listdir(migrations_dir):
-            is_file = os.path.isfile(os.path.join(migrations_dir, name))
+        for migration_file in self.list_migration_files(migrations_dir):
+            resolved = app_label_index.resolve(migration_file)
 
-            if is_file and name.endswith('.py'):
-                import_name = name.rsplit('.', 1)[0]
-                if import_name[0] not in '_.~':
-                    migration_names.append(import_name)
-
-        for app_config in apps.get_app_configs():
-            app_label = app_config.label
+            if resolved is None:
+                continue  # Not a migration for an installed app
 
-            app_migration_files = [
-                name for name in migration_names if name.startswith(app_label)
-            ]
+            app_label, migration_name = resolved
+            path = os.path.join(migrations_dir, migration_file + '.py')
 
-            for migration_file in app_migration_files:
-                migration_name = migration_file.lstrip(app_label)[1:]
+            if non_package:
+                load_module = partial(
+                    import_pending, migrations_dir, migration_file)
+            else:
+                load_module = partial(
+                    import_module, "%s.%s" % (
+                        PROJECT_MIGRATIONS_MODULE_NAME, migration_file))
 
-                try:
-                    if non_package:
-                        sys.path.insert(0, migrations_dir)
-                        module = import_module(migration_file)
-                    else:
-                        module_name = (
-                            "%s.%s" % (PROJECT_MIGRATIONS_MODULE_NAME,
-                                       migration_file)
-                        )
-                        module = import_module(module_name)
-                finally:
-                    if non_package:
-                        sys.path.pop(0)
-
-                migrations_by_app[app_label].append(
-                    module.Migration(migration_name, app_label))
+            migrations_by_app[app_label].append(self.load_migration(
+                path, app_label, migration_name, load_module))
 
         return migrations_by_app
 
@@ -95,6 +439,7 @@ class ProjectMigrationLoaderMixin(object):
         return project_migrations
 
     # XXX - This is broke in 1.7 with regards to replaces so we need to copy it
+    @timed('loader.build_graph')
     def build_graph(self):  # pragma: no cover
         """
         Builds a migration dependency graph using both the disk and database.
@@ -102,14 +447,20 @@ class ProjectMigrationLoaderMixin(object):
         usually a problem as generally migration stuff runs in a one-shot
         process.
         """
-        # Load disk data
-        self.load_disk()
+        # Load disk data, which only imports modules when really needed
+        self.graph_cache = get_graph_cache()
+        with phase('loader.load_disk'):
+            self.load_disk()
+        if self.graph_cache is not None:
+            with phase('loader.graph_cache.save'):
+                self.graph_cache.save()
         # Load database data
         if self.connection is None:
             self.applied_migrations = set()
         else:
-            recorder = MigrationRecorder(self.connection)
-            self.applied_migrations = recorder.applied_migrations()
+            with phase('loader.applied_migrations'):
+                recorder = MigrationRecorder(self.connection)
+                self.applied_migrations = recorder.applied_migrations()
         # Do first pass to separate out replacing and non-replacing migrations
         normal = {}
         replacing = {}
@@ -132,6 +483,32 @@ class ProjectMigrationLoaderMixin(object):
         for key, migration in replacing.items():
             for replaced in migration.replaces:
                 reverse_replacements.setdefault(replaced, set()).add(key)
+        # A squashed migration whose replaced migrations are all replaced by a
+        # collected migration is folded into the collected migration, which
+        # then replaces the squashed migration as well. It's left out of the
+        # collected migration's replaces so it isn't recorded as applied, as
+        # Django only records the migrations a squashed migration replaces.
+        folded = {}
+        collected_keys = set(getattr(self, 'pending_migrations', ()))
+        for key, migration in list(replacing.items()):
+            if key in collected_keys:
+                continue
+            outer_keys = collected_keys.intersection(*[
+                reverse_replacements[replaced]
+                for replaced in migration.replaces])
+            if not outer_keys:
+                continue
+            del replacing[key]
+            for replaced in migration.replaces:
+                reverse_replacements[replaced].discard(key)
+            if all(replaced in self.applied_migrations
+                   for replaced in migration.replaces):
+                self.applied_migrations.add(key)
+            else:
+                self.applied_migrations.discard(key)
+            for outer_key in outer_keys:
+                folded.setdefault(outer_key, []).append(key)
+                reverse_replacements.setdefault(key, set()).add(outer_key)
         # Carry out replacements if we can - that is, if all replaced migration
         # are either unapplied or missing.
         for key, migration in replacing.items():
@@ -140,20 +517,20 @@ class ProjectMigrationLoaderMixin(object):
             # Do the check. We can replace if all our replace targets are
             # applied, or if all of them are unapplied.
             applied = self.applied_migrations
-            replaces = migration.replaces
+            replaces = list(migration.replaces) + folded.get(key, [])
             applied_statuses = [(target in applied) for target in replaces]
             can_replace = all(applied_statuses) or (not any(applied_statuses))
             if not can_replace:
                 continue
             # Alright, time to replace. Step through the replaced migrations
             # and remove, repointing dependencies if needs be.
-            for replaced in migration.replaces:
+            for replaced in replaces:
                 if replaced in normal:
                     # We don't care if the replaced migration doesn't exist;
                     # the usage pattern here is to delete things after a while.
                     del normal[replaced]
                 for child_key in reverse_dependencies.get(replaced, set()):
-                    if child_key in migration.replaces:
+                    if child_key in replaces:
                         continue
                     # List of migrations whose dependency on `replaced` needs
                     # to be updated to a dependency on `key`.
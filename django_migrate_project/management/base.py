@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+import sys
+
+from django.apps import apps
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.state import ProjectState
+
+from django_migrate_project.timings import phase
+
+
+class MigrationCommandMixin(object):
+    """
+    Checks shared by the commands which apply migrations. Commands set
+    command_name, used to name the timing phases, and migrations_description
+    to say which migrations they apply, such as 'collected'.
+    """
+
+    command_name = None
+    migrations_description = None
+
+    def check_unapplied(self, unapplied):
+        """ Reports any unapplied migrations, and exits with 1 if there are """
+
+        if self.verbosity > 0:
+            if unapplied:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    "Unapplied migrations:"))
+
+                for app_label, migration_name in unapplied:
+                    self.stdout.write("  %s.%s" % (app_label, migration_name))
+            else:
+                self.stdout.write("No %s migrations to apply." %
+                                  self.migrations_description)
+
+        if unapplied:
+            sys.exit(1)
+
+    def check_model_changes(self, executor):
+        """ Tells the user if there's model changes not in migrations """
+
+        with phase('%s.autodetector' % self.command_name):
+            autodetector = MigrationAutodetector(
+                executor.loader.project_state(),
+                ProjectState.from_apps(apps),
+            )
+            changes = autodetector.changes(graph=executor.loader.graph)
+
+        # If there's changes not in migrations, tell them how to fix it
+        if changes:
+            self.stdout.write(self.style.NOTICE(
+                "  Your models have changes that are not yet reflected"
+                " in a migration, and so won't be applied."
+            ))
+            self.stdout.write(self.style.NOTICE(
+                "  Run 'manage.py makeprojectmigrations' to make new "
+                "migrations, and then run 'manage.py migrateproject' "
+                "to apply them."
+            ))
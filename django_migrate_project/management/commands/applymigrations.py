@@ -4,7 +4,6 @@ from optparse import make_option
 
 import os
 
-from django.apps import apps
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management.commands.migrate import Command as MigrateCommand
@@ -12,22 +11,38 @@ from django.core.management.sql import (
     emit_post_migrate_signal, emit_pre_migrate_signal,
 )
 from django.db import connections, DEFAULT_DB_ALIAS
-from django.db.migrations.autodetector import MigrationAutodetector
-from django.db.migrations.executor import MigrationExecutor
-from django.db.migrations.state import ProjectState
+from django.db.migrations.recorder import MigrationRecorder
 
+from django_migrate_project.check import get_unapplied_pending_migrations
+from django_migrate_project.executor import (
+    migration_transaction, ProjectMigrationExecutor
+)
 from django_migrate_project.loader import (
     PendingMigrationLoader, DEFAULT_PENDING_MIGRATIONS_DIRECTORY
 )
+from django_migrate_project.management.base import MigrationCommandMixin
+from django_migrate_project.manifest import PendingPlan
+from django_migrate_project.profiling import (
+    command_profile, PROFILE_OPTIONS
+)
+from django_migrate_project.timings import (
+    command_timings, phase, timed, TIMINGS_OPTIONS
+)
 
 
 # NOTE: Much of this code is borrowed and modified from the standard migrate
-class Command(MigrateCommand):
+class Command(MigrationCommandMixin, MigrateCommand):
     help = "Migrate a project using previously collected migrations."
+    command_name = 'applymigrations'
+    migrations_description = 'collected'
 
     option_list = BaseCommand.option_list + (
         make_option("--unapply", action='store_true',  dest='unapply',
                     default=False, help="Unapply the migrations instead."),
+        make_option("--check", action='store_true', dest='check',
+                    default=False, help=("Exit with a non-zero status if "
+                                         "there are collected migrations to "
+                                         "apply, without applying them.")),
         make_option("--input-dir", action='store', dest='input_dir',
                     default=None, help=("Directory to load the collected "
                                         "migrations from.")),
@@ -37,13 +52,31 @@ class Command(MigrateCommand):
         make_option('--fake', action='store_true', dest='fake', default=False,
                     help=("Mark migrations as run without actually running "
                           "them")),
+        make_option("--check-model-changes", action='store_true',
+                    dest='check_model_changes', default=False,
+                    help=("When there's nothing to apply, check for model "
+                          "changes not yet reflected in a migration.")),
+        make_option("--single-transaction", action='store_true',
+                    dest='single_transaction', default=False,
+                    help=("Apply all the migrations in a single transaction, "
+                          "so none are applied if any fail.")),
+        make_option("--coalesce-rebuilds", action='store_true',
+                    dest='coalesce_rebuilds', default=False,
+                    help=("On SQLite, rebuild a table once for adjacent "
+                          "changes to the fields of a model, rather than "
+                          "once for each change.")),
         make_option("--database", action='store', dest='database',
                     default=DEFAULT_DB_ALIAS,
                     help=("Nominates a database to synchronize. Defaults to "
                           "the \"default\" database.")),
-    )
+    ) + TIMINGS_OPTIONS + PROFILE_OPTIONS
     args = ""
 
+    def execute(self, *args, **options):
+        with command_profile(options), \
+                command_timings('applymigrations', options):
+            return super(Command, self).execute(*args, **options)
+
     def handle(self, *args, **options):
         self.verbosity = verbosity = options.get('verbosity')
         self.interactive = interactive = options.get('interactive')
@@ -81,44 +114,49 @@ class Command(MigrateCommand):
         except AttributeError:  # pragma: no cover
             pass
 
-        executor = MigrationExecutor(connection,
-                                     self.migration_progress_callback)
+        if options.get('check'):
+            if options.get('unapply'):
+                raise CommandError(
+                    "The --check and --unapply options can't be combined.")
 
-        # Replace the loader with a pending migration one
-        executor.loader = PendingMigrationLoader(
-            connection, pending_migrations_dir=migrations_dir)
+            self.check_unapplied(
+                get_unapplied_pending_migrations(migrations_dir, db))
+            return
 
-        targets = executor.loader.graph.leaf_nodes()
-        pending_migration_keys = executor.loader.pending_migrations.keys()
+        single_transaction = options.get('single_transaction')
 
-        if options.get('unapply'):
-            targets = []
+        if single_transaction and not connection.features.can_rollback_ddl:
+            raise CommandError(
+                "The --single-transaction option needs a database which can "
+                "roll back schema changes.")
 
-            # We only want to unapply the collected migrations
-            for key, migration in executor.loader.pending_migrations.items():
-                app_label, migration_name = key
-                migration_found = False
+        executor = None
+        pending_plan = None
 
-                for dependency in migration.dependencies:
-                    pending = dependency in pending_migration_keys
+        if not options.get('unapply'):
+            with phase('applymigrations.pending_plan'):
+                pending_plan = PendingPlan.from_directory(migrations_dir)
 
-                    if dependency[0] == app_label and not pending:
-                        result = executor.loader.check_key(dependency,
-                                                           app_label)
-                        dependency = result or dependency
+        if pending_plan is not None:
+            with phase('applymigrations.applied_migrations'):
+                recorder = MigrationRecorder(connection)
+                applied_migrations = recorder.applied_migrations()
 
-                        targets.append(dependency)
-                        migration_found = True
+            if not pending_plan.is_applied(applied_migrations):
+                pending_plan = None
 
-                if not migration_found:
-                    targets.append((app_label, None))
+        if pending_plan is not None:
+            # The manifest shows there's nothing to apply, so there's no need
+            # to load the migrations and build the graph
+            targets = pending_plan.targets
+            pending_migration_keys = []
+            plan = []
         else:
-            # Trim non-collected migrations
-            for migration_key in list(targets):
-                if migration_key not in pending_migration_keys:
-                    targets.remove(migration_key)
-
-        plan = executor.migration_plan(targets)
+            executor = self.get_executor(
+                connection, migrations_dir, options.get('coalesce_rebuilds'))
+            targets, plan = self.get_targets_and_plan(executor, options)
+            pending_migration_keys = (
+                executor.loader.pending_migrations.keys())
 
         MIGRATE_HEADING = self.style.MIGRATE_HEADING
         MIGRATE_LABEL = self.style.MIGRATE_LABEL
@@ -138,46 +176,95 @@ class Command(MigrateCommand):
                         % (target[1], target[0])
                     )
 
-        try:  # pragma: no cover
-            emit_pre_migrate_signal([], verbosity, interactive,
-                                    connection.alias)
-        except TypeError:  # pragma: no cover
-            emit_pre_migrate_signal(verbosity, interactive, connection.alias)
+        with phase('applymigrations.pre_migrate'):
+            try:  # pragma: no cover
+                emit_pre_migrate_signal([], verbosity, interactive,
+                                        connection.alias)
+            except TypeError:  # pragma: no cover
+                emit_pre_migrate_signal(
+                    verbosity, interactive, connection.alias)
 
         # Migrate!
         if verbosity > 0:
             self.stdout.write(MIGRATE_HEADING("Running migrations:"))
 
-        if not plan:
-            if verbosity > 0:
-                self.stdout.write("  No migrations to apply.")
-                # If there's changes not in migrations, tell them how to fix it
-                autodetector = MigrationAutodetector(
-                    executor.loader.project_state(),
-                    ProjectState.from_apps(apps),
-                )
-                changes = autodetector.changes(graph=executor.loader.graph)
-                if changes:
-                    self.stdout.write(self.style.NOTICE(
-                        "  Your models have changes that are not yet reflected"
-                        " in a migration, and so won't be applied."
-                    ))
-                    self.stdout.write(self.style.NOTICE(
-                        "  Run 'manage.py makeprojectmigrations' to make new "
-                        "migrations, and then run 'manage.py migrateproject' "
-                        "to apply them."
-                    ))
-        else:
-            executor.migrate(targets, plan, fake=options.get("fake", False))
+        if not plan and verbosity > 0:
+            self.stdout.write("  No migrations to apply.")
 
-        # A little database clean-up
-        for app_label, migration_name in pending_migration_keys:
-            executor.recorder.record_unapplied(app_label, migration_name)
+            if options.get('check_model_changes'):
+                # The graph is only needed for this on the fast path
+                if executor is None:
+                    executor = self.get_executor(connection, migrations_dir)
+
+                self.check_model_changes(executor)
+
+        with migration_transaction(connection, single_transaction):
+            if plan:
+                with phase('applymigrations.migrate'):
+                    executor.migrate(
+                        targets, plan, fake=options.get("fake", False))
+
+            # A little database clean-up
+            with phase('applymigrations.record_unapplied'):
+                if pending_migration_keys:
+                    executor.recorder.record_unapplied_many(
+                        pending_migration_keys)
 
         # Send the post_migrate signal, so individual apps can do whatever they
         # need to do at this point.
-        try:  # pragma: no cover
-            emit_post_migrate_signal([], verbosity, interactive,
-                                     connection.alias)
-        except TypeError:  # pragma: no cover
-            emit_post_migrate_signal(verbosity, interactive, connection.alias)
+        with phase('applymigrations.post_migrate'):
+            try:  # pragma: no cover
+                emit_post_migrate_signal([], verbosity, interactive,
+                                         connection.alias)
+            except TypeError:  # pragma: no cover
+                emit_post_migrate_signal(
+                    verbosity, interactive, connection.alias)
+
+    @timed('applymigrations.get_executor')
+    def get_executor(self, connection, migrations_dir,
+                     coalesce_rebuilds=False):
+        # Only the pending migration loader is built, not a stock one as well
+        loader = PendingMigrationLoader(
+            connection, pending_migrations_dir=migrations_dir)
+
+        return ProjectMigrationExecutor(
+            connection, self.migration_progress_callback, loader=loader,
+            coalesce_rebuilds=coalesce_rebuilds)
+
+    @timed('applymigrations.migration_plan')
+    def get_targets_and_plan(self, executor, options):
+        """ Works out the targets and plan from the migration graph """
+
+        targets = executor.loader.graph.leaf_nodes()
+        pending_migration_keys = executor.loader.pending_migrations.keys()
+
+        if options.get('unapply'):
+            targets = []
+
+            # We only want to unapply the collected migrations
+            for key, migration in executor.loader.pending_migrations.items():
+                app_label, migration_name = key
+                migration_found = False
+
+                for dependency in migration.dependencies:
+                    pending = dependency in pending_migration_keys
+
+                    if dependency[0] == app_label and not pending:
+                        result = executor.loader.check_key(dependency,
+                                                           app_label)
+                        dependency = result or dependency
+
+                        targets.append(dependency)
+                        migration_found = True
+
+                if not migration_found:
+                    targets.append((app_label, None))
+        else:
+            # Trim non-collected migrations
+            for migration_key in list(targets):
+                if migration_key not in pending_migration_keys:
+                    targets.remove(migration_key)
+
+        plan = executor.migration_plan(targets)
+
+        return targets, plan
@@ -1,12 +1,11 @@
 from __future__ import unicode_literals
 
 from collections import defaultdict
-from copy import copy
-from itertools import combinations, takewhile
 from optparse import make_option
 
+import hashlib
 import os
-import shutil
+import py_compile
 
 from django.apps import apps
 from django.conf import settings
@@ -14,12 +13,28 @@ from django.core.management.base import BaseCommand, CommandError
 from django.db import connections, DEFAULT_DB_ALIAS
 from django.db.migrations import Migration
 from django.db.migrations.graph import CircularDependencyError
-from django.db.migrations.optimizer import MigrationOptimizer
-from django.db.migrations.writer import MigrationWriter
 
+from django_migrate_project.cache import get_optimizer_cache
+from django_migrate_project.graph import (
+    find_strongly_connected_components, split_app_migrations,
+    walk_app_migrations
+)
 from django_migrate_project.loader import (
     ProjectMigrationLoader, DEFAULT_PENDING_MIGRATIONS_DIRECTORY
 )
+from django_migrate_project.manifest import (
+    CollectionManifest, get_swappable_settings, MANIFEST_FILENAME
+)
+from django_migrate_project.optimizer import (
+    optimize_in_parallel, optimize_operations
+)
+from django_migrate_project.profiling import (
+    command_profile, PROFILE_OPTIONS
+)
+from django_migrate_project.timings import (
+    command_timings, phase, TIMINGS_OPTIONS
+)
+from django_migrate_project.writer import render_migrations, replace_directory
 
 
 class Command(BaseCommand):
@@ -29,6 +44,20 @@ class Command(BaseCommand):
         make_option("--no-optimize", action='store_true', dest='no_optimize',
                     default=False, help=("Do not try to optimize the squashed "
                                          "operations.")),
+        make_option("--jobs", action='store', dest='jobs', type='int',
+                    default=1, help=("Number of processes to optimize and "
+                                     "render the collected migrations in.")),
+        make_option("--optimize-window", action='store',
+                    dest='optimize_window', type='int', default=None,
+                    help=("Only try to optimize each operation with this many "
+                          "of the operations following it.")),
+        make_option("--optimize-timeout", action='store',
+                    dest='optimize_timeout', type='float', default=None,
+                    help=("Seconds to spend optimizing each app before using "
+                          "the best result so far.")),
+        make_option("--no-compile", action='store_true', dest='no_compile',
+                    default=False, help=("Do not compile the collected "
+                                         "migrations to bytecode.")),
         make_option("--output-dir", action='store', dest='output_dir',
                     default=None, help=("Directory to output the collected "
                                         "migrations to.")),
@@ -36,15 +65,25 @@ class Command(BaseCommand):
                     default=DEFAULT_DB_ALIAS,
                     help=("Nominates a database to synchronize. Defaults to "
                           "the \"default\" database.")),
-    )
+    ) + TIMINGS_OPTIONS + PROFILE_OPTIONS
     args = ""
 
     def _make_name(self, idx):
         return "{0:04d}".format(idx + 1)
 
+    def execute(self, *args, **options):
+        with command_profile(options), \
+                command_timings('collectmigrations', options):
+            return super(Command, self).execute(*args, **options)
+
     def handle(self, *args, **options):
         self.verbosity = options.get('verbosity')
         self.no_optimize = options.get('no_optimize')
+        self.no_compile = options.get('no_compile')
+        self.jobs = options.get('jobs') or 1
+        self.optimize_window = options.get('optimize_window')
+        self.optimize_timeout = options.get('optimize_timeout')
+        self.optimizer_cache = None
         migrations_dir = options.get('output_dir')
 
         try:
@@ -65,6 +104,15 @@ class Command(BaseCommand):
             raise CommandError(
                 "Provide a real directory path via the --output-dir option.")
 
+        if self.jobs < 1:
+            raise CommandError("The --jobs option must be at least 1.")
+        elif self.optimize_window is not None and self.optimize_window < 1:
+            raise CommandError(
+                "The --optimize-window option must be at least 1.")
+        elif self.optimize_timeout is not None and self.optimize_timeout <= 0:
+            raise CommandError(
+                "The --optimize-timeout option must be more than 0.")
+
         db = options.get('database')
         connection = connections[db]
 
@@ -89,7 +137,8 @@ class Command(BaseCommand):
         app_migrations = defaultdict(list)
 
         # Check for conflicts
-        conflicts = loader.detect_conflicts()
+        with phase('collectmigrations.detect_conflicts'):
+            conflicts = loader.detect_conflicts()
         if conflicts:
             name_str = "; ".join(
                 "%s in %s" % (", ".join(names), app)
@@ -109,221 +158,289 @@ class Command(BaseCommand):
                 app_label, migration_name = migration_key
                 app_migrations[app_label].append(migration)
 
-        def list_of_lists():
-            result_list = []
-            result_list.append([])
-
-            return result_list
-
-        leaf_nodes = loader.graph.leaf_nodes()
-        new_app_migrations = defaultdict(list_of_lists)
-        new_app_leaf_migrations = {}
+        with phase('collectmigrations.walk_app_migrations'):
+            new_app_migrations = walk_app_migrations(
+                loader, loader.graph.leaf_nodes())
+
+        # Split up the migrations for apps which depend on each other in a
+        # cycle, otherwise the collected migrations would too
+        migration_keys = [
+            (migration.app_label, migration.name)
+            for migrations in new_app_migrations.values()
+            for migration in migrations
+        ]
+
+        with phase('collectmigrations.split_app_migrations'):
+            splits = split_app_migrations(loader.graph, migration_keys)
+
+        for app_label, key_sets in splits.items():
+            migrations = new_app_migrations[app_label]
+            new_app_migrations[app_label] = [
+                [migration for migration in migrations
+                 if (migration.app_label, migration.name) in key_set]
+                for key_set in key_sets
+            ]
 
-        # NOTE: Grabbed from Django mainline and modified
-        def _find_common_ancestors(nodes):
-            # Grab out the migrations in question, and work out their
-            # common ancestor.
-            migrations = []
-            for migration_key in nodes:
-                migration = loader.get_migration(*migration_key)
-                forwards_plan = loader.graph.forwards_plan(migration_key)
-                applied = loader.applied_migrations
-
-                def valid_node(node):
-                    return node not in applied and node not in leaf_nodes
+        app_migrations = new_app_migrations
 
-                ancestry = [node for node in forwards_plan if valid_node(node)]
-                migration.ancestry = ancestry
-                migrations.append(migration)
-            items_equal = lambda seq: all(item == seq[0] for item in seq[1:])
-            migrations_gens = zip(*[m.ancestry for m in migrations])
-            common_ancestors = takewhile(items_equal, migrations_gens)
+        if self.verbosity > 0:
+            self.stdout.write(MIGRATE_HEADING("Collecting migrations:"))
 
-            return list(common_ancestors)
+            for app in sorted(apps_with_models):
+                write = self.stdout.write
 
-        def walk_nodes(current_app, migration_key):
-            if migration_key not in loader.applied_migrations:
-                app_label, migration_name = migration_key
-                key_result = loader.check_key(migration_key, current_app)
-                migration_key = key_result or migration_key
-                migration = loader.get_migration(*migration_key)
+                if app in app_migrations:
+                    write("  Migrations collected for app '%s'" % app)
+                else:
+                    write("  No unapplied migrations for app '%s'" % app)
 
-                if app_label == current_app:
-                    if migration not in new_app_migrations[app_label][0]:
-                        new_app_migrations[app_label][0].append(migration)
-                for dep_key in migration.dependencies:
-                    walk_nodes(app_label, dep_key)
+        # No migrations to bundle up, so return early
+        if not app_migrations:
+            return
 
-        for migration_key in loader.graph.leaf_nodes():
-            app_label, migration_name = migration_key
-            new_app_leaf_migrations[app_label] = (app_label, migration_name)
-            walk_nodes(app_label, migration_key)
+        if not self.no_optimize:
+            self.optimizer_cache = get_optimizer_cache()
 
-        migrating_apps = []
+        manifest = CollectionManifest(
+            migrations_dir, self.no_optimize, self.optimize_window,
+            not self.no_compile, get_swappable_settings(
+                migration for migration_sets in app_migrations.values()
+                for migration_set in migration_sets
+                for migration in migration_set))
 
-        def find_common_ancestors(node1, node2):
-            dependent_apps_1 = set()
-            dependent_apps_2 = set()
+        # Where each collected migration ended up, as the app label, set
+        # index and name of the project migration replacing it
+        project_keys = {}
 
-            migration1 = loader.get_migration(node1[0], node1[1])
-            migration2 = loader.get_migration(node2[0], node2[1])
+        for app_label, migration_sets in app_migrations.items():
+            for idx, migration_set in enumerate(migration_sets):
+                name = self._make_name(idx) + '_project'
 
-            def walk_dependencies(migration, app_set):
-                migration_key = (migration.app_label, migration.name)
-                forwards_plan = loader.graph.forwards_plan(migration_key)
+                for migration in migration_set:
+                    migration_key = (migration.app_label, migration.name)
+                    project_keys[migration_key] = (app_label, idx, name)
 
-                for dependency in list(forwards_plan)[:-1]:
-                    app_label, migration_name = dependency
+        collected = []
+        changed_sets = {}
 
-                    if app_label not in migrating_apps:
-                        continue
-                    else:
-                        app_set.add(app_label)
+        # Only migrations whose inputs changed since the last collection need
+        # optimizing and writing again, the rest are kept as they are
+        with phase('collectmigrations.manifest'):
+            for app_label in sorted(app_migrations):
+                migration_sets = app_migrations[app_label]
+                for idx, migration_set in enumerate(migration_sets):
+                    filename = "%s_%s_project.py" % (
+                        app_label, self._make_name(idx))
+                    replaces, dependencies = self.get_dependencies(
+                        migration_set)
+                    dependencies = self.resolve_dependencies(
+                        loader, app_label, idx, dependencies, project_keys)
+                    entry = manifest.make_entry(
+                        replaces, dependencies,
+                        [(key, loader.migration_paths.get(key))
+                         for key in self.get_keys(migration_set)])
+
+                    if not manifest.is_current(filename, entry):
+                        changed_sets[app_label, idx] = migration_set
+
+                    collected.append((app_label, idx, filename, replaces,
+                                      dependencies, entry))
+
+        filenames = [collected_file[2] for collected_file in collected]
+
+        if not changed_sets and manifest.is_unchanged(filenames):
+            if self.verbosity > 0:
+                self.stdout.write(MIGRATE_HEADING(
+                    "Collected migrations are up to date."))
 
-                    dep_migration = loader.get_migration(*dependency)
-                    walk_dependencies(dep_migration, app_set)
+            return
 
-            walk_dependencies(migration1, dependent_apps_1)
-            walk_dependencies(migration2, dependent_apps_2)
+        optimizations = {}
+
+        if self.jobs > 1 and not self.no_optimize:
+            with phase('collectmigrations.optimize_in_parallel'):
+                optimizations = self.optimize_in_parallel(changed_sets)
+
+        kept_files = []
+        new_files = []
+        new_migrations = []
+        new_entries = []
+
+        with phase('collectmigrations.create_app_migrations'):
+            for app_label, idx, filename, replaces, dependencies, entry in \
+                    collected:
+                if (app_label, idx) not in changed_sets:
+                    if self.verbosity > 0:
+                        self.stdout.write(MIGRATE_HEADING(
+                            "(Keeping unchanged '%s'.)" % filename))
+
+                    manifest.keep(filename)
+                    kept_files.append(filename)
+                    continue
+
+                migration, complete = self.create_app_migration(
+                    app_label, self._make_name(idx),
+                    changed_sets[app_label, idx], replaces, dependencies,
+                    optimizations.get((app_label, idx)))
+
+                new_files.append(filename)
+                new_migrations.append(migration)
+
+                # Results cut short by the timeout are redone next time
+                new_entries.append(entry if complete else None)
+
+        with phase('collectmigrations.render_migrations'):
+            output = render_migrations(new_migrations, self.jobs)
+
+        for filename, entry, contents in zip(new_files, new_entries, output):
+            manifest.add(filename, entry, hashlib.sha1(contents).hexdigest())
+
+        manifest.set_plan(*self.get_plan(collected))
+
+        files = list(zip(new_files, output))
+        files.append((MANIFEST_FILENAME, manifest.dumps()))
+
+        # Write everything to a new directory which only replaces the old
+        # one once it's complete, so a failure never loses the previous
+        # collection or leaves a mix of new and old files behind
+        compile_file = None if self.no_compile else self.compile_migration
+        with phase('collectmigrations.replace_directory'):
+            replace_directory(migrations_dir, files, compile_file, kept_files)
+
+        if self.optimizer_cache is not None:
+            with phase('collectmigrations.optimizer_cache.save'):
+                self.optimizer_cache.save()
+
+            if self.verbosity > 1:
+                self.stdout.write(
+                    "  Reused %s of %s cached optimizations." % (
+                        self.optimizer_cache.hits,
+                        self.optimizer_cache.hits +
+                        self.optimizer_cache.misses))
+
+    def get_plan(self, collected):
+        """
+        Returns the keys of the collected migrations in the order they apply
+        in, and the keys of the last collected migration for each app, which
+        applying them targets.
+        """
+
+        keys = [(app_label, self._make_name(idx) + '_project')
+                for app_label, idx, _, _, _, _ in collected]
+        targets = set(keys)
+        parents = {}
+
+        for key, collected_migration in zip(keys, collected):
+            dependencies = collected_migration[4]
+            parents[key] = [dependency for dependency in dependencies
+                            if dependency in targets]
+
+        # Without cycles every component is a single migration, coming after
+        # the migrations it depends on
+        components = find_strongly_connected_components(sorted(keys), parents)
+        plan = [key for component in components for key in component]
+
+        for key in keys:
+            for parent in parents[key]:
+                if parent[0] == key[0]:
+                    targets.discard(parent)
+
+        return plan, sorted(targets)
+
+    def get_dependencies(self, migrations):
+        """
+        Returns the sorted keys of the migrations, which the collected
+        migration replaces, and its sorted dependencies on anything else.
+
+        A squashed migration is replaced by the migrations it replaces, as
+        those are what Django records as applied when it applies it.
+        """
 
-            if dependent_apps_1.intersection(dependent_apps_2):
-                return _find_common_ancestors([node1, node2])
-            else:  # pragma: no cover
-                return []
+        dependencies = set()
+        keys = set()
+        replaces = set()
 
-        for migration_key in leaf_nodes:
-            app_label, migration_name = migration_key
+        # Create the list of migrations this one will replace
+        for migration in migrations:
+            key = (migration.app_label, migration.name)
+            keys.add(key)
 
-            if migration_key not in loader.applied_migrations:
-                migrating_apps.append(app_label)
+            if migration.replaces:
+                replaces.update(tuple(replaced)
+                                for replaced in migration.replaces)
+            else:
+                replaces.add(key)
 
-        app_pairs = combinations(migrating_apps, 2)
+        # Find dependencies on anything that isn't being replaced
+        for migration in migrations:
+            for dependency in migration.dependencies:
+                different_app = (dependency[0] != migration.app_label)
 
-        for app_pair in app_pairs:
-            migration1 = new_app_leaf_migrations[app_pair[0]]
-            migration2 = new_app_leaf_migrations[app_pair[1]]
-            common_ancestors = find_common_ancestors(migration1, migration2)
+                if different_app or not (dependency in keys or
+                                         dependency in replaces):
+                    dependencies.add(dependency)
 
-            if common_ancestors:
-                most_recently_common = common_ancestors[-1][0]
+        return sorted(replaces), sorted(dependencies)
 
-                app_label, migration_name = most_recently_common
-                migration = loader.get_migration(app_label, migration_name)
+    def get_keys(self, migrations):
+        return sorted((migration.app_label, migration.name)
+                      for migration in migrations)
 
-                # Check if we need to split out migrations to prevent cycles
-                for migrations in new_app_migrations[app_label]:  # pragma: nb
-                    if migration in migrations:  # pragma: no branch
-                        idx = migrations.index(migration)
-                        split_migration = migrations[idx:]
-                        new_app_migrations[app_label].insert(
-                            0, split_migration)
+    def resolve_dependencies(self, loader, app_label, migration_idx,
+                             dependencies, project_keys):
+        """
+        Points dependencies on collected migrations at the project
+        migrations replacing them.
+        """
 
-                        for migration in split_migration:
-                            migrations.remove(migration)
+        resolved = []
 
-                        break
+        for dependency in dependencies:
+            migration_key = (
+                loader.check_key(dependency, app_label) or dependency)
+            project_key = project_keys.get(migration_key)
 
-        app_migrations = new_app_migrations
+            # If there is a project level migration for the dep
+            if project_key is not None:
+                dep_app, idx, name = project_key
 
-        if self.verbosity > 0:
-            self.stdout.write(MIGRATE_HEADING("Collecting migrations:"))
+                if (dep_app, idx) == (app_label, migration_idx):
+                    raise CircularDependencyError(  # pragma: nc
+                        "Migration has self for dependency: %s.%s_project" %
+                        (app_label, self._make_name(migration_idx))
+                    )
 
-            for app in sorted(apps_with_models):
-                write = self.stdout.write
+                # And the dependency is a replaced migration
+                if dependency in project_keys:
+                    dependency = (dep_app, name)
 
-                if app in app_migrations:
-                    write("  Migrations collected for app '%s'" % app)
-                else:
-                    write("  No unapplied migrations for app '%s'" % app)
+            if dependency not in resolved:
+                resolved.append(dependency)
 
-        # No migrations to bundle up, so return early
-        if not app_migrations:
-            return
+        return resolved
 
-        try:
-            # Delete the output dir to avoid a combination of new and old files
-            if os.path.exists(migrations_dir):
-                shutil.rmtree(migrations_dir)
+    def compile_migration(self, file_path):
+        """
+        Compile a collected migration to bytecode, so it isn't compiled from
+        source on every host applying it, or on every run where the code
+        directory is read-only. Where supported, the bytecode is validated
+        against a hash of the source rather than its mtime, which doesn't
+        survive copying the files around.
+        """
 
-            os.mkdir(migrations_dir)
+        kwargs = {}
+        invalidation_mode = getattr(py_compile, 'PycInvalidationMode', None)
 
-            project_migrations = defaultdict(list)
+        if invalidation_mode is not None:  # pragma: no cover
+            kwargs['invalidation_mode'] = invalidation_mode.CHECKED_HASH
 
-            # Create migrations for each individual app
-            for app_label in app_migrations:
-                migration_sets = app_migrations[app_label]
-                for idx, migration_set in enumerate(migration_sets):
-                    index_name = self._make_name(idx)
-                    project_migrations[app_label].append(
-                        self.create_app_migration(
-                            app_label, index_name, migration_set
-                        )
-                    )
+        py_compile.compile(file_path, doraise=True, **kwargs)
 
-            # Resolve dependencies between the consolidated migrations and save
-            for app_label, migrations in project_migrations.items():
-                for migration_idx, migration in enumerate(migrations):
-                    for dependency in copy(migration.dependencies):
-                        dep_app = dependency[0]
-
-                        # If there is a project level migration for the dep app
-                        if dep_app in project_migrations:
-                            other = None
-                            migration_key = (dep_app, dependency[1])
-                            result = loader.check_key(migration_key, app_label)
-                            migration_key = result or migration_key
-                            dep_mig = loader.get_migration(*migration_key)
-                            dep_migs = app_migrations[dep_app]
-
-                            for idx, migration_set in enumerate(dep_migs):
-                                if dep_mig in migration_set:
-                                    other_migs = project_migrations[dep_app]
-                                    other = other_migs[idx]
-                                    break
-
-                            if other is None:
-                                continue
-                            elif other == migration:  # pragma: no cover
-                                raise CircularDependencyError(
-                                    "Migration has self for "
-                                    "dependency: %s" % (migration,)
-                                )
-
-                            # And the dependency is a replaced migration
-                            if dependency in other.replaces:
-                                migration.dependencies.remove(dependency)
-                                index = self._make_name(idx)
-                                migration.dependencies.append(
-                                    (dep_app, index + '_project'))
-
-                    # Write the migration to disk
-                    index = self._make_name(migration_idx)
-                    filename = app_label + '_' + index + '_project.py'
-                    file_path = os.path.join(migrations_dir, filename)
-                    writer = MigrationWriter(migration)
-
-                    with open(file_path, 'wb') as output_file:
-                        output = writer.as_string()
-                        output_file.write(output)  # pragma: no branch
-        except:
-            # Delete the output dir to avoid a combination of new and old files
-            if os.path.exists(migrations_dir):
-                shutil.rmtree(migrations_dir)
-
-            raise
-
-    def create_app_migration(self, app_label, idx, migrations):
-        """ Create a migration for the app which replaces the migrations """
+    def gather_operations(self, migrations):
+        """ Gather up the operations of the migrations, in order """
 
         operations = []
-        dependencies = set()
-        replaces = set()
 
-        # Create the list of migrations this one will replace
-        for migration in migrations:
-            replaces.add((migration.app_label, migration.name))
-
-        # Gather up the operations to perform and find dependencies
         for migration in migrations:
             # Apparently we need to reverse the operations list now
             new_operations = list(migration.operations)
@@ -331,16 +448,51 @@ class Command(BaseCommand):
 
             operations.extend(new_operations)
 
-            for dependency in migration.dependencies:
-                different_app = (dependency[0] != migration.app_label)
+        # Reverse operations list
+        operations.reverse()
 
-                if different_app or dependency not in replaces:
-                    dependencies.add(dependency)
+        return operations
 
-        MIGRATE_HEADING = self.style.MIGRATE_HEADING
+    def optimize_in_parallel(self, migration_sets):
+        """
+        Optimize the operations for the sets of migrations, keyed on the app
+        label and set index, in a pool of processes. Returns a dict of the
+        optimization results with the same keys, which is empty if the
+        operations couldn't be sent to the pool, leaving them to be
+        optimized one at a time.
+        """
 
-        # Reverse operations list
-        operations.reverse()
+        keys = sorted(migration_sets)
+        jobs = [(self.gather_operations(migration_sets[key]), key[0])
+                for key in keys]
+
+        if len(jobs) < 2:
+            return {}
+
+        results = optimize_in_parallel(
+            jobs, self.jobs, self.optimizer_cache, self.optimize_window,
+            self.optimize_timeout)
+
+        if results is None:
+            if self.verbosity > 0:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    "(Operations can't be sent to other processes, "
+                    "optimizing in this one.)"))
+
+            return {}
+
+        return dict(zip(keys, results))
+
+    def create_app_migration(self, app_label, idx, migrations, replaces,
+                             dependencies, optimization=None):
+        """
+        Create a migration for the app which replaces the migrations. Returns
+        the migration, and whether its operations were fully optimized.
+        """
+
+        operations = self.gather_operations(migrations)
+
+        MIGRATE_HEADING = self.style.MIGRATE_HEADING
 
         if self.no_optimize:
             if self.verbosity > 0:
@@ -352,8 +504,12 @@ class Command(BaseCommand):
                 self.stdout.write(MIGRATE_HEADING(
                     "Optimizing '" + app_label + "'..."))
 
-            optimizer = MigrationOptimizer()
-            new_operations = optimizer.optimize(operations, app_label)
+            if optimization is None:
+                optimization = optimize_operations(
+                    operations, app_label, self.optimizer_cache,
+                    self.optimize_window, self.optimize_timeout)
+
+            new_operations = optimization.operations
 
             if self.verbosity > 0:
                 if len(new_operations) == len(operations):
@@ -364,11 +520,24 @@ class Command(BaseCommand):
                         (len(operations), len(new_operations))
                     )
 
+                if optimization.timed_out:
+                    self.stdout.write(
+                        "  Ran out of time, using the best result so far.")
+
+            if self.verbosity > 1:
+                self.stdout.write(
+                    "  Eliminated %s operations in %.2fs%s." % (
+                        len(operations) - len(new_operations),
+                        optimization.elapsed,
+                        " (cached)" if optimization.cached else ""))
+
         # Make a new migration class with these operations
         migration_class = type(str('Migration'), (Migration, ), {
             'dependencies': dependencies,
             'operations': new_operations,
-            'replaces': sorted(replaces),
+            'replaces': replaces,
         })
 
-        return migration_class(idx + '_project', app_label)
+        complete = optimization is None or not optimization.timed_out
+
+        return migration_class(idx + '_project', app_label), complete
@@ -13,8 +13,14 @@ from django.db.migrations.writer import MigrationWriter
 from django_migrate_project.loader import (
     ProjectMigrationLoader, PROJECT_MIGRATIONS_MODULE_NAME
 )
+from django_migrate_project.profiling import (
+    command_profile, PROFILE_OPTIONS
+)
 from django_migrate_project.questioner import (
     ProjectInteractiveMigrationQuestioner)
+from django_migrate_project.timings import (
+    command_timings, timed, TIMINGS_OPTIONS
+)
 
 
 # Monkey patch to avoid duplicating code
@@ -37,10 +43,15 @@ class Command(MakeMigrationsCommand):
         make_option('--noinput', action='store_false', dest='interactive',
                     default=True, help=("Tells Django to NOT prompt the user "
                                         "for input of any kind.")),
-    )
+    ) + TIMINGS_OPTIONS + PROFILE_OPTIONS
 
     args = ""
 
+    def execute(self, *args, **options):
+        with command_profile(options), \
+                command_timings('makeprojectmigrations', options):
+            return super(Command, self).execute(*args, **options)
+
     def handle(self, *app_labels, **options):
         migrations_dir = os.path.join(
             settings.BASE_DIR, PROJECT_MIGRATIONS_MODULE_NAME)
@@ -56,6 +67,7 @@ class Command(MakeMigrationsCommand):
 
         super(Command, self).handle(*app_labels, **options)
 
+    @timed('makeprojectmigrations.write_migration_files')
     def write_migration_files(self, changes):
         """ Takes a changes dict and writes them out as migration files. """
 
@@ -4,7 +4,6 @@ from optparse import make_option
 
 import os
 
-from django.apps import apps
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management.commands.migrate import Command as MigrateCommand
@@ -12,35 +11,65 @@ from django.core.management.sql import (
     emit_post_migrate_signal, emit_pre_migrate_signal,
 )
 from django.db import connections, DEFAULT_DB_ALIAS
-from django.db.migrations.autodetector import MigrationAutodetector
-from django.db.migrations.executor import MigrationExecutor
-from django.db.migrations.state import ProjectState
 
-from django_migrate_project.loader import (
-    ProjectMigrationLoader, PROJECT_MIGRATIONS_MODULE_NAME
+from django_migrate_project.check import get_unapplied_project_migrations
+from django_migrate_project.executor import (
+    migration_transaction, ProjectMigrationExecutor
+)
+from django_migrate_project.loader import PROJECT_MIGRATIONS_MODULE_NAME
+from django_migrate_project.management.base import MigrationCommandMixin
+from django_migrate_project.profiling import (
+    command_profile, PROFILE_OPTIONS
+)
+from django_migrate_project.timings import (
+    command_timings, phase, TIMINGS_OPTIONS
 )
 
 
 # NOTE: Much of this code is borrowed and modified from the standard migrate
-class Command(MigrateCommand):
+class Command(MigrationCommandMixin, MigrateCommand):
     help = "Migrate a project using previously collected migrations."
+    command_name = 'migrateproject'
+    migrations_description = 'project'
 
     option_list = BaseCommand.option_list + (
         make_option("--unapply", action='store_true',  dest='unapply',
                     default=False, help="Unapply the migrations instead."),
+        make_option("--check", action='store_true', dest='check',
+                    default=False, help=("Exit with a non-zero status if "
+                                         "there are project migrations to "
+                                         "apply, without applying them.")),
         make_option("--noinput", action='store_false', dest='interactive',
                     default=True, help=("Tells Django to NOT prompt the user "
                                         "for input of any kind.")),
         make_option('--fake', action='store_true', dest='fake', default=False,
                     help=("Mark migrations as run without actually running "
                           "them")),
+        make_option("--check-model-changes", action='store_true',
+                    dest='check_model_changes', default=False,
+                    help=("When there's nothing to apply, check for model "
+                          "changes not yet reflected in a migration.")),
+        make_option("--single-transaction", action='store_true',
+                    dest='single_transaction', default=False,
+                    help=("Apply all the migrations in a single transaction, "
+                          "so none are applied if any fail.")),
+        make_option("--coalesce-rebuilds", action='store_true',
+                    dest='coalesce_rebuilds', default=False,
+                    help=("On SQLite, rebuild a table once for adjacent "
+                          "changes to the fields of a model, rather than "
+                          "once for each change.")),
         make_option("--database", action='store', dest='database',
                     default=DEFAULT_DB_ALIAS,
                     help=("Nominates a database to synchronize. Defaults to "
                           "the \"default\" database.")),
-    )
+    ) + TIMINGS_OPTIONS + PROFILE_OPTIONS
     args = ""
 
+    def execute(self, *args, **options):
+        with command_profile(options), \
+                command_timings('migrateproject', options):
+            return super(Command, self).execute(*args, **options)
+
     def handle(self, *args, **options):
         self.verbosity = verbosity = options.get('verbosity')
         self.interactive = interactive = options.get('interactive')
@@ -67,11 +96,26 @@ class Command(MigrateCommand):
         except AttributeError:  # pragma: no cover
             pass
 
-        executor = MigrationExecutor(connection,
-                                     self.migration_progress_callback)
+        if options.get('check'):
+            if options.get('unapply'):
+                raise CommandError(
+                    "The --check and --unapply options can't be combined.")
+
+            self.check_unapplied(get_unapplied_project_migrations(db))
+            return
 
-        # Replace the loader with a project-level one
-        executor.loader = ProjectMigrationLoader(connection)
+        single_transaction = options.get('single_transaction')
+
+        if single_transaction and not connection.features.can_rollback_ddl:
+            raise CommandError(
+                "The --single-transaction option needs a database which can "
+                "roll back schema changes.")
+
+        # Uses a project-level loader rather than a stock one
+        with phase('migrateproject.get_executor'):
+            executor = ProjectMigrationExecutor(
+                connection, self.migration_progress_callback,
+                coalesce_rebuilds=options.get('coalesce_rebuilds'))
 
         targets = executor.loader.graph.leaf_nodes()
 
@@ -107,7 +151,8 @@ class Command(MigrateCommand):
                 if migration_key not in project_migration_keys:
                     targets.remove(migration_key)
 
-        plan = executor.migration_plan(targets)
+        with phase('migrateproject.migration_plan'):
+            plan = executor.migration_plan(targets)
 
         MIGRATE_HEADING = self.style.MIGRATE_HEADING
         MIGRATE_LABEL = self.style.MIGRATE_LABEL
@@ -127,11 +172,13 @@ class Command(MigrateCommand):
                         % (target[1], target[0])
                     )
 
-        try:  # pragma: no cover
-            emit_pre_migrate_signal([], verbosity, interactive,
-                                    connection.alias)
-        except TypeError:  # pragma: no cover
-            emit_pre_migrate_signal(verbosity, interactive, connection.alias)
+        with phase('migrateproject.pre_migrate'):
+            try:  # pragma: no cover
+                emit_pre_migrate_signal([], verbosity, interactive,
+                                        connection.alias)
+            except TypeError:  # pragma: no cover
+                emit_pre_migrate_signal(
+                    verbosity, interactive, connection.alias)
 
         # Migrate!
         if verbosity > 0:
@@ -140,29 +187,21 @@ class Command(MigrateCommand):
         if not plan:
             if verbosity > 0:
                 self.stdout.write("  No migrations to apply.")
-                # If there's changes not in migrations, tell them how to fix it
-                autodetector = MigrationAutodetector(
-                    executor.loader.project_state(),
-                    ProjectState.from_apps(apps),
-                )
-                changes = autodetector.changes(graph=executor.loader.graph)
-                if changes:
-                    self.stdout.write(self.style.NOTICE(
-                        "  Your models have changes that are not yet reflected"
-                        " in a migration, and so won't be applied."
-                    ))
-                    self.stdout.write(self.style.NOTICE(
-                        "  Run 'manage.py makeprojectmigrations' to make new "
-                        "migrations, and then re-run "
-                        "'manage.py migrateproject' to apply them."
-                    ))
+
+                if options.get('check_model_changes'):
+                    self.check_model_changes(executor)
         else:
-            executor.migrate(targets, plan, fake=options.get("fake", False))
+            with migration_transaction(connection, single_transaction), \
+                    phase('migrateproject.migrate'):
+                executor.migrate(
+                    targets, plan, fake=options.get("fake", False))
 
         # Send the post_migrate signal, so individual apps can do whatever they
         # need to do at this point.
-        try:  # pragma: no cover
-            emit_post_migrate_signal([], verbosity, interactive,
-                                     connection.alias)
-        except TypeError:  # pragma: no cover
-            emit_post_migrate_signal(verbosity, interactive, connection.alias)
+        with phase('migrateproject.post_migrate'):
+            try:  # pragma: no cover
+                emit_post_migrate_signal([], verbosity, interactive,
+                                         connection.alias)
+            except TypeError:  # pragma: no cover
+                emit_post_migrate_signal(
+                    verbosity, interactive, connection.alias)
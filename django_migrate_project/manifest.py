@@ -0,0 +1,269 @@
+from __future__ import unicode_literals
+
+import json
+import os
+
+import django
+from django.db.migrations.migration import SwappableTuple
+
+from django_migrate_project import __version__
+from django_migrate_project.cache import hash_file
+
+
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 2
+
+
+def read_manifest(directory):
+    """ Returns the data in the directory's manifest, or None """
+
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def get_swappable_settings(migrations):
+    """
+    Returns the swappable settings the migrations depend on, as a dict of
+    setting names to their values. Dependencies read from the migration's
+    source know their setting's name, those of migrations which had to be
+    imported only know its value, so they're keyed on that instead.
+    """
+
+    swappable_settings = {}
+
+    for migration in migrations:
+        for dependency in migration.dependencies:
+            if isinstance(dependency, SwappableTuple):
+                setting_name = getattr(
+                    dependency, 'setting_name', dependency.setting)
+                swappable_settings[setting_name] = dependency.setting
+
+    return swappable_settings
+
+
+class CollectionManifest(object):
+    """
+    Manifest of a directory of collected migrations, kept in the directory.
+
+    For each collected migration file it lists the migrations it replaces,
+    the hashes of their source files, its dependencies and the hash of the
+    file itself. When none of those have changed since the last collection,
+    and the file hasn't been edited since, it can be kept as it is instead
+    of optimizing and rendering it again.
+
+    It also records the plan for applying the collected migrations, see
+    PendingPlan.
+
+    The swappable settings are those the collected migrations depend on,
+    see get_swappable_settings.
+    """
+
+    def __init__(self, directory, no_optimize=False, optimize_window=None,
+                 compiled=True, swappable_settings=None):
+        self.directory = directory
+        self.no_optimize = no_optimize
+        self.optimize_window = optimize_window
+        self.compiled = compiled
+        self.swappable_settings = swappable_settings or {}
+        self.entries = {}
+        self.previous_entries = {}
+        self.previously_compiled = None
+        self.plan = None
+
+        data = read_manifest(directory)
+
+        if data and data.get('environment') == self.environment():
+            self.previous_entries = data.get('files', {})
+            self.previously_compiled = data.get('compiled')
+
+    def environment(self):
+        """ Things which change every collected file if they change """
+
+        return {
+            'version': MANIFEST_VERSION,
+            'collector': __version__,
+            'django': django.get_version(),
+            'swappable_settings': self.swappable_settings,
+            'no_optimize': self.no_optimize,
+            'optimize_window': self.optimize_window,
+        }
+
+    def make_entry(self, replaces, dependencies, source_paths):
+        """
+        Returns the manifest entry for a collected migration, without its
+        output hash, or None if any of the source files are missing. The
+        source paths are the (key, path) pairs of the migrations it was
+        collected from.
+        """
+
+        sources = {}
+
+        for (app_label, name), path in source_paths:
+            if path is None:
+                return None
+
+            try:
+                sources["%s.%s" % (app_label, name)] = hash_file(path)
+            except (IOError, OSError):
+                return None
+
+        return {
+            'replaces': [list(key) for key in replaces],
+            'dependencies': [list(key) for key in dependencies],
+            'sources': sources,
+        }
+
+    def is_current(self, filename, entry):
+        """
+        Whether the file from the last collection was made from the same
+        inputs as the entry, and hasn't been changed since.
+        """
+
+        previous = self.previous_entries.get(filename)
+
+        if entry is None or previous is None:
+            return False
+
+        for field in ('replaces', 'dependencies', 'sources'):
+            if previous.get(field) != entry[field]:
+                return False
+
+        try:
+            output_hash = hash_file(os.path.join(self.directory, filename))
+        except (IOError, OSError):
+            return False
+
+        return output_hash == previous.get('output')
+
+    def is_unchanged(self, filenames):
+        """
+        Whether the directory holds exactly the given files, all current,
+        compiled the same way, so there's nothing to do at all.
+        """
+
+        if self.previously_compiled != self.compiled:
+            return False
+
+        try:
+            existing = set(name for name in os.listdir(self.directory)
+                           if name.endswith('.py'))
+        except OSError:
+            return False
+
+        return existing == set(filenames)
+
+    def keep(self, filename):
+        """ Carries the entry for a file over from the last collection """
+
+        self.entries[filename] = self.previous_entries[filename]
+
+    def add(self, filename, entry, output_hash):
+        """ Adds the entry for a newly written file """
+
+        if entry is not None:
+            entry = dict(entry, output=output_hash)
+            self.entries[filename] = entry
+
+    def set_plan(self, migrations, targets):
+        """
+        Records the order to apply the collected migrations in, and the
+        targets to apply them up to.
+        """
+
+        self.plan = {
+            'migrations': [list(key) for key in migrations],
+            'targets': [list(key) for key in targets],
+        }
+
+    def dumps(self):
+        data = {
+            'environment': self.environment(),
+            'compiled': self.compiled,
+            'files': self.entries,
+            'plan': self.plan,
+        }
+
+        return json.dumps(data, indent=2, sort_keys=True).encode('utf-8')
+
+
+class PendingPlan(object):
+    """
+    The plan for applying a directory of collected migrations, read from the
+    manifest collectmigrations left in it.
+
+    Checking whether the collected migrations have been applied only needs
+    the applied migrations, not the migration graph, which is a lot quicker
+    to find out on a project with a long migration history.
+    """
+
+    def __init__(self, migrations, targets, replaces):
+        self.migrations = migrations
+        self.targets = targets
+        self.replaces = replaces
+
+    @classmethod
+    def from_directory(cls, directory):
+        """
+        Returns the plan for the directory, or None if there's no manifest
+        with a plan or the files in the directory don't all match it.
+        """
+
+        data = read_manifest(directory)
+
+        if not data or not data.get('plan'):
+            return None
+
+        entries = data.get('files', {})
+        migrations = [tuple(key) for key in data['plan']['migrations']]
+        filenames = ["%s_%s.py" % key for key in migrations]
+        existing = [name for name in os.listdir(directory)
+                    if name.endswith('.py')]
+
+        if sorted(existing) != sorted(filenames) or \
+                sorted(filenames) != sorted(entries):
+            return None
+
+        replaces = {}
+
+        for key, filename in zip(migrations, filenames):
+            try:
+                output_hash = hash_file(os.path.join(directory, filename))
+            except (IOError, OSError):  # pragma: no cover
+                return None
+
+            if output_hash != entries[filename].get('output'):
+                return None
+
+            replaces[key] = [
+                tuple(replaced) for replaced in entries[filename]['replaces']]
+
+        return cls(migrations,
+                   [tuple(key) for key in data['plan']['targets']],
+                   replaces)
+
+    def unapplied(self, applied_migrations):
+        """
+        Returns the keys of the collected migrations which still need
+        applying, in the order they apply in. A collected migration is
+        applied once every migration it replaces is.
+        """
+
+        return [key for key in self.migrations
+                if not all(replaced in applied_migrations
+                           for replaced in self.replaces[key])]
+
+    def is_applied(self, applied_migrations):
+        """
+        Whether every migration the collected migrations replace is applied,
+        so applying them would do nothing. If any collected migration is
+        recorded itself, a previous apply didn't finish cleaning up.
+        """
+
+        for key in self.migrations:
+            if key in applied_migrations:
+                return False
+
+        return not self.unapplied(applied_migrations)
@@ -0,0 +1,163 @@
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+import time
+
+from django.db.migrations.optimizer import MigrationOptimizer
+from django.utils.six.moves import cPickle as pickle
+
+from django_migrate_project.parallel import map_in_pool
+
+
+OptimizationResult = namedtuple(
+    'OptimizationResult', ['operations', 'elapsed', 'timed_out', 'cached'])
+
+
+class BoundedMigrationOptimizer(MigrationOptimizer):
+    """
+    Migration optimizer which can be bounded for huge lists of operations.
+
+    The window limits how many of the following operations each operation
+    is compared against, and the timeout limits the total time spent. When
+    time runs out the result of the last complete pass is returned, which is
+    always a valid (if less optimized) list of operations.
+    """
+
+    def __init__(self, window=None, timeout=None):
+        super(BoundedMigrationOptimizer, self).__init__()
+
+        self.window = window
+        self.timeout = timeout
+        self.deadline = None
+        self.timed_out = False
+
+    def optimize(self, operations, app_label=None):
+        self.timed_out = False
+
+        if self.timeout is not None:
+            self.deadline = time.time() + self.timeout
+
+        return super(BoundedMigrationOptimizer, self).optimize(
+            operations, app_label)
+
+    def optimize_inner(self, operations, app_label=None):
+        # NOTE: Grabbed from Django mainline and modified
+        new_operations = []
+        for i, operation in enumerate(operations):
+            if self.deadline is not None and time.time() > self.deadline:
+                # Returning the operations unchanged ends the optimization
+                self.timed_out = True
+                return operations
+
+            if self.window is None:
+                others = operations[i + 1:]
+            else:
+                others = operations[i + 1:i + 1 + self.window]
+
+            # Compare it to each operation after it
+            for j, other in enumerate(others):
+                result = self.reduce(
+                    operation, other, operations[i + 1:i + j + 1])
+                if result is not None:
+                    # Optimize! Add result, then remaining others, then return
+                    new_operations.extend(result)
+                    new_operations.extend(operations[i + 1:i + 1 + j])
+                    new_operations.extend(operations[i + j + 2:])
+                    return new_operations
+                if not self.can_optimize_through(operation, other, app_label):
+                    new_operations.append(operation)
+                    break
+            else:
+                new_operations.append(operation)
+        return new_operations
+
+
+def optimize_operations(operations, app_label, cache=None, window=None,
+                        timeout=None):
+    """
+    Optimizes the operations for a migration of the given app, reusing the
+    result from the optimizer cache if one is given and has it.
+
+    Returns an OptimizationResult with the optimized operations, how long
+    they took to optimize, and whether the timeout cut that short.
+    """
+
+    start = time.time()
+    key = None
+
+    if cache is not None:
+        key = cache.make_key(operations, app_label, window)
+        cached_operations = cache.get(key)
+
+        if cached_operations is not None:
+            return OptimizationResult(
+                cached_operations, time.time() - start, False, True)
+
+    optimizer = BoundedMigrationOptimizer(window, timeout)
+    optimized_operations = optimizer.optimize(operations, app_label)
+
+    # A result cut short by the timeout depends on the machine, so only
+    # complete results are cached
+    if cache is not None and not optimizer.timed_out:
+        cache.set(key, optimized_operations)
+
+    return OptimizationResult(
+        optimized_operations, time.time() - start, optimizer.timed_out, False)
+
+
+def optimize_pickled(payload):
+    operations, app_label, window, timeout = pickle.loads(payload)
+    result = optimize_operations(
+        operations, app_label, window=window, timeout=timeout)
+
+    return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+
+
+def optimize_in_parallel(jobs, processes, cache=None, window=None,
+                         timeout=None):
+    """
+    Optimizes a list of (operations, app_label) jobs in a pool of processes,
+    returning an OptimizationResult for each job in the same order. Jobs
+    found in the optimizer cache, if one is given, aren't sent to the pool.
+
+    Returns None if any of the operations can't be pickled to send them to
+    the pool, such as RunPython operations using lambdas, in which case the
+    jobs need optimizing in this process instead.
+    """
+
+    results = [None] * len(jobs)
+    keys = [None] * len(jobs)
+
+    if cache is not None:
+        for idx, (operations, app_label) in enumerate(jobs):
+            start = time.time()
+            keys[idx] = cache.make_key(operations, app_label, window)
+            cached_operations = cache.get(keys[idx])
+
+            if cached_operations is not None:
+                results[idx] = OptimizationResult(
+                    cached_operations, time.time() - start, False, True)
+
+    missing = [idx for idx, result in enumerate(results) if result is None]
+
+    if not missing:
+        return results
+
+    try:
+        payloads = [
+            pickle.dumps(jobs[idx] + (window, timeout),
+                         pickle.HIGHEST_PROTOCOL)
+            for idx in missing]
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+    pickled_results = map_in_pool(optimize_pickled, payloads, processes)
+
+    for idx, pickled_result in zip(missing, pickled_results):
+        results[idx] = pickle.loads(pickled_result)
+
+        if cache is not None and not results[idx].timed_out:
+            cache.set(keys[idx], results[idx].operations)
+
+    return results
@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+import multiprocessing
+
+import django
+from django.apps import apps
+
+
+def init_worker():
+    # Workers which aren't forked from the command need Django set up
+    if not apps.ready:  # pragma: no cover
+        django.setup()
+
+
+def map_in_pool(function, payloads, processes):
+    """
+    Maps the function over the payloads in a pool of processes, returning
+    the results in the same order as the payloads.
+    """
+
+    pool = multiprocessing.Pool(
+        min(processes, len(payloads)), initializer=init_worker)
+
+    try:
+        results = pool.map(function, payloads, chunksize=1)
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return results
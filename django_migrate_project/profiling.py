@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from optparse import make_option
+
+import cProfile
+import pstats
+import sys
+
+from django.core.management.base import CommandError
+
+from django_migrate_project.timings import NULL_PHASE, recording_phases
+
+
+# The phases each choice of --profile-phase profiles, as in the timings
+PROFILE_PHASES = {
+    'loader': (
+        'loader.build_graph',
+        'loader.get_app_migrations',
+    ),
+    'optimizer': (
+        'collectmigrations.optimize_in_parallel',
+        'collectmigrations.create_app_migrations',
+    ),
+    'executor': (
+        'applymigrations.migrate',
+        'migrateproject.migrate',
+    ),
+}
+
+# How many functions the summary at verbosity 2 lists
+PROFILE_SUMMARY_LENGTH = 20
+
+PROFILE_OPTIONS = (
+    make_option("--profile", action='store', dest='profile', default=None,
+                help=("Profile the command and dump the stats to this file, "
+                      "which can be read with pstats.")),
+    make_option("--profile-phase", action='store', dest='profile_phase',
+                default=None, help=("Only profile this phase of the command, "
+                                    "one of: %s." % ", ".join(
+                                        sorted(PROFILE_PHASES)))),
+)
+
+
+class ProfiledPhase(object):
+    """ A phase being profiled, see PhaseProfiler """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        if self.profiler.depth == 0:
+            self.profiler.profile.enable()
+
+        self.profiler.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.depth -= 1
+
+        if self.profiler.depth == 0:
+            self.profiler.profile.disable()
+
+        return False
+
+
+class PhaseProfiler(object):
+    """
+    Profiles only the named phases, and anything run inside them, ignoring
+    the rest of the command.
+    """
+
+    def __init__(self, profile, phase_names):
+        self.profile = profile
+        self.phase_names = phase_names
+        self.depth = 0
+
+    def phase(self, name):
+        if name in self.phase_names:
+            return ProfiledPhase(self)
+
+        return NULL_PHASE
+
+
+def write_summary(profile, stream, length=PROFILE_SUMMARY_LENGTH):
+    """ Writes the functions with the most cumulative time to the stream """
+
+    profile.create_stats()
+
+    if not profile.stats:
+        stream.write("Nothing was profiled.\n")
+        return
+
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats('cumulative').print_stats(length)
+
+
+@contextmanager
+def record_profile(path, phase_name=None, stream=None):
+    """
+    Profiles everything run inside, or only the given phase of it, and
+    dumps the stats to the path. A summary is written to the stream if it's
+    given.
+    """
+
+    profile = cProfile.Profile()
+
+    try:
+        if phase_name is None:
+            profile.enable()
+
+            try:
+                yield profile
+            finally:
+                profile.disable()
+        else:
+            profiler = PhaseProfiler(profile, PROFILE_PHASES[phase_name])
+
+            with recording_phases(profiler):
+                yield profile
+    finally:
+        profile.dump_stats(path)
+
+        if stream is not None:
+            write_summary(profile, stream)
+
+
+def command_profile(options):
+    """
+    Returns a context manager profiling a management command if its
+    --profile option was given.
+    """
+
+    phase_name = options.get('profile_phase')
+
+    if phase_name is not None and phase_name not in PROFILE_PHASES:
+        raise CommandError("Unknown phase to profile '%s', choose from: %s" % (
+            phase_name, ", ".join(sorted(PROFILE_PHASES))))
+
+    if not options.get('profile'):
+        if phase_name is not None:
+            raise CommandError("--profile-phase requires --profile")
+
+        return NULL_PHASE
+
+    stream = None
+
+    if int(options.get('verbosity', 1)) >= 2:
+        stream = options.get('stdout') or sys.stdout
+
+    return record_profile(options['profile'], phase_name, stream)
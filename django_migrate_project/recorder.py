@@ -0,0 +1,62 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Q
+
+
+# Most keys recorded by a single query, even where the backend has no limit
+# on the number of parameters
+MAX_BATCH_SIZE = 500
+
+
+class ProjectMigrationRecorder(MigrationRecorder):
+    """
+    Migration recorder which can also record many migrations at once, with
+    a query per batch of keys rather than one per key. Batches are kept under
+    the backend's limit on query parameters, such as SQLite's 999.
+    """
+
+    def batch_size(self, field_names, keys):
+        fields = [self.Migration._meta.get_field(name) for name in field_names]
+        batch_size = self.connection.ops.bulk_batch_size(fields, keys)
+
+        return max(min(batch_size, MAX_BATCH_SIZE), 1)
+
+    def record_applied_many(self, keys):
+        """ Records that the migrations with these keys were applied """
+
+        keys = list(keys)
+
+        if not keys:
+            return
+
+        self.ensure_schema()
+        batch_size = self.batch_size(('app', 'name', 'applied'), keys)
+        migrations = [self.Migration(app=app_label, name=migration_name)
+                      for app_label, migration_name in keys]
+
+        self.migration_qs.bulk_create(migrations, batch_size=batch_size)
+
+    def record_unapplied_many(self, keys):
+        """ Records that the migrations with these keys were unapplied """
+
+        keys = list(keys)
+
+        if not keys:
+            return
+
+        self.ensure_schema()
+        batch_size = self.batch_size(('app', 'name'), keys)
+
+        with transaction.atomic(using=self.connection.alias):
+            for start in range(0, len(keys), batch_size):
+                batch = keys[start:start + batch_size]
+
+                # Equivalent to WHERE (app, name) IN (...), which not every
+                # backend supports
+                condition = Q(*[Q(app=app_label, name=migration_name)
+                                for app_label, migration_name in batch])
+                condition.connector = Q.OR
+
+                self.migration_qs.filter(condition).delete()
@@ -0,0 +1,291 @@
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+from functools import wraps
+from optparse import make_option
+
+import json
+import sys
+import time
+
+from django.core.management.base import OutputWrapper
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2 can't trace memory allocations
+    tracemalloc = None
+
+wall_clock = getattr(time, 'perf_counter', time.time)
+cpu_clock = getattr(time, 'process_time', None) or time.clock
+
+
+TIMINGS_OPTIONS = (
+    make_option("--timings", action='store_true', dest='timings',
+                default=False, help=("Report the time and memory spent in "
+                                     "each phase of the command.")),
+    make_option("--timings-file", action='store', dest='timings_file',
+                default=None, help=("Write the timings report to this file "
+                                    "as JSON.")),
+)
+
+# What's recording phases, such as Timings, if anything
+active_recorders = []
+
+
+class NullPhase(object):
+    """ Stands in for a phase when nothing is being timed """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class PhaseGroup(object):
+    """ Enters the phases of several recorders at once """
+
+    def __init__(self, phases):
+        self.phases = phases
+
+    def __enter__(self):
+        for recorder_phase in self.phases:
+            recorder_phase.__enter__()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        for recorder_phase in reversed(self.phases):
+            recorder_phase.__exit__(*exc_info)
+
+        return False
+
+
+class Phase(object):
+    """ A named phase being timed, see Timings """
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.depth = None
+        self.wall = None
+        self.cpu = None
+        self.memory_peak = None
+
+    def __enter__(self):
+        self.timings.start(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.stop(self)
+        return False
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'depth': self.depth,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'memory_peak': self.memory_peak,
+        }
+
+
+class Timings(object):
+    """
+    Records the wall time, CPU time and peak traced memory of named phases,
+    which can be nested. The memory peak of a phase is how far the traced
+    memory rose above where it was when the phase started, and is None where
+    tracemalloc isn't available.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.phases = []
+        self.stack = []
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.memory_offset = 0
+        self.last_peak = 0
+        self.started_tracing = False
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def start(self, phase):
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+
+            current = self.update_peaks()
+            phase.memory_start = phase.memory_max = current
+
+        phase.depth = len(self.stack)
+        self.phases.append(phase)
+        self.stack.append(phase)
+
+        phase.cpu_start = cpu_clock()
+        phase.wall_start = wall_clock()
+
+    def stop(self, phase):
+        phase.wall = wall_clock() - phase.wall_start
+        phase.cpu = cpu_clock() - phase.cpu_start
+
+        if self.trace_memory:
+            self.update_peaks()
+            phase.memory_peak = phase.memory_max - phase.memory_start
+
+        self.stack.remove(phase)
+
+        if self.trace_memory and not self.stack and self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def update_peaks(self):
+        """
+        Folds the traced memory peak since the last update into the open
+        phases, then resets the peak. Returns the current traced memory.
+
+        Tracing which something else started is left alone, as resetting
+        the peak would change what it sees. Its peak is then only folded in
+        if it rose since the last update, and otherwise the current traced
+        memory is.
+        """
+
+        current, peak = tracemalloc.get_traced_memory()
+        current += self.memory_offset
+        peak += self.memory_offset
+        peak_rose = peak > self.last_peak
+        self.last_peak = peak
+
+        if not (self.started_tracing or peak_rose):
+            peak = current
+
+        for phase in self.stack:
+            phase.memory_max = max(phase.memory_max, peak)
+
+        if self.started_tracing:
+            self.reset_peak(current)
+
+        return current
+
+    def reset_peak(self, current):
+        """ Resets the traced memory peak, given the current traced memory """
+
+        if hasattr(tracemalloc, 'reset_peak'):  # pragma: no cover
+            tracemalloc.reset_peak()
+        else:
+            # Restarting is the only way to reset the peak before Python 3.9,
+            # the blocks traced so far are carried over as an offset
+            tracemalloc.stop()
+            tracemalloc.start()
+            self.memory_offset = current
+
+    def report(self):
+        return [phase.as_dict() for phase in self.phases]
+
+    def write(self, stdout):
+        """ Writes a table of the phases, nested phases indented """
+
+        stdout.write("Timings:")
+
+        for phase in self.phases:
+            name = "  " * (phase.depth + 1) + phase.name
+
+            if phase.wall is None:  # pragma: no cover
+                continue  # Never finished
+
+            if phase.memory_peak is None:
+                memory = ""
+            else:
+                memory = "  %8.1f KiB peak" % (phase.memory_peak / 1024.0)
+
+            stdout.write("%-50s %8.3fs wall %8.3fs CPU%s" % (
+                name, phase.wall, phase.cpu, memory))
+
+    def dump(self, path):
+        with open(path, 'w') as timings_file:
+            json.dump({'phases': self.report()}, timings_file, indent=2)
+
+
+def phase(name):
+    """
+    Returns a context manager marking the named phase, which does nothing
+    unless something is recording phases.
+    """
+
+    if not active_recorders:
+        return NULL_PHASE
+    elif len(active_recorders) == 1:
+        return active_recorders[0].phase(name)
+
+    return PhaseGroup([recorder.phase(name) for recorder in active_recorders])
+
+
+def timed(name):
+    """ Decorator marking every call of a function as the named phase """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not active_recorders:
+                return func(*args, **kwargs)
+
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def recording_phases(recorder):
+    """ Passes the phases of everything run inside to the recorder """
+
+    active_recorders.append(recorder)
+
+    try:
+        yield recorder
+    finally:
+        active_recorders.remove(recorder)
+
+
+@contextmanager
+def record_timings(name, stdout=None, path=None):
+    """
+    Records timings for everything run inside, as phases of the named root
+    phase. The report is written to stdout if it's given, and as JSON to the
+    path if it's given.
+    """
+
+    timings = Timings()
+
+    try:
+        with recording_phases(timings), timings.phase(name):
+            yield timings
+    finally:
+        if stdout is not None:
+            timings.write(stdout)
+
+        if path:
+            timings.dump(path)
+
+
+def command_timings(name, options):
+    """
+    Returns a context manager recording timings for a management command if
+    its --timings or --timings-file options were given.
+    """
+
+    if not (options.get('timings') or options.get('timings_file')):
+        return NULL_PHASE
+
+    stdout = None
+
+    if options.get('timings'):
+        stdout = OutputWrapper(options.get('stdout') or sys.stdout)
+
+    return record_timings(name, stdout, options.get('timings_file'))
@@ -0,0 +1,169 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.db.migrations import Migration
+from django.db.migrations.writer import MigrationWriter
+from django.utils.six.moves import cPickle as pickle
+
+# Python 3 compatibility
+try:
+    from importlib.util import cache_from_source
+except ImportError:  # pragma: no cover
+    def cache_from_source(path):
+        return path + 'c'
+
+from django_migrate_project.parallel import map_in_pool
+
+
+def render_migration(migration):
+    """ Renders a migration to the contents of its file """
+
+    return MigrationWriter(migration).as_string()
+
+
+def pickle_migration(migration):
+    # Swappable dependencies are SwappableTuples, which can't be unpickled,
+    # but they're rendered like the plain tuples they are
+    dependencies = [tuple(dependency) for dependency in migration.dependencies]
+
+    return pickle.dumps((migration.name, migration.app_label, {
+        'dependencies': dependencies,
+        'operations': migration.operations,
+        'replaces': migration.replaces,
+    }), pickle.HIGHEST_PROTOCOL)
+
+
+def render_pickled(payload):
+    name, app_label, attributes = pickle.loads(payload)
+    migration_class = type(str('Migration'), (Migration, ), attributes)
+
+    return render_migration(migration_class(name, app_label))
+
+
+def render_migrations(migrations, processes=1):
+    """
+    Renders a list of migrations to the contents of their files, in a pool
+    of processes if more than one is given. The migrations are rendered in
+    this process instead if any of them can't be pickled to send them to
+    the pool, such as RunPython operations using lambdas.
+    """
+
+    if processes > 1 and len(migrations) > 1:
+        try:
+            payloads = [
+                pickle_migration(migration) for migration in migrations]
+        except (pickle.PicklingError, TypeError, AttributeError):
+            pass
+        else:
+            return map_in_pool(render_pickled, payloads, processes)
+
+    return [render_migration(migration) for migration in migrations]
+
+
+def fsync_directory(path):
+    """ Flushes a directory's entries to disk, where the platform allows """
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (OSError, AttributeError):  # pragma: no cover
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:  # pragma: no cover
+        # Not every platform or filesystem can fsync a directory
+        pass
+    finally:
+        os.close(fd)
+
+
+def copy_file(source_path, file_path):
+    """ Copies a file, keeping its mtime, and flushes it to disk """
+
+    shutil.copy2(source_path, file_path)
+
+    with open(file_path, 'rb+') as output_file:
+        os.fsync(output_file.fileno())
+
+
+def replace_directory(directory, files, compile_file=None, keep=()):
+    """
+    Writes the files, a list of (filename, contents) pairs, to a temporary
+    sibling of the directory and swaps it into the directory's place once
+    every file is safely on disk. If anything fails the temporary directory
+    is removed and whatever was in the directory before is left untouched.
+
+    The compile_file callable, if given, is called with the path of each
+    file after writing it. The files named in keep are copied over from the
+    directory as they are, along with their bytecode, keeping their mtimes.
+    """
+
+    directory = os.path.abspath(directory)
+    parent, name = os.path.split(directory)
+    temp_dir = tempfile.mkdtemp(dir=parent, prefix='.%s-' % name)
+
+    try:
+        for filename, contents in files:
+            file_path = os.path.join(temp_dir, filename)
+
+            with open(file_path, 'wb') as output_file:
+                output_file.write(contents)
+                output_file.flush()
+                os.fsync(output_file.fileno())
+
+            if compile_file is not None:
+                compile_file(file_path)
+
+        for filename in keep:
+            source_path = os.path.join(directory, filename)
+            file_path = os.path.join(temp_dir, filename)
+            copy_file(source_path, file_path)
+
+            if compile_file is None:
+                continue
+
+            bytecode_path = cache_from_source(source_path)
+
+            if os.path.exists(bytecode_path):
+                new_bytecode_path = cache_from_source(file_path)
+                bytecode_dir = os.path.dirname(new_bytecode_path)
+
+                if not os.path.isdir(bytecode_dir):
+                    os.mkdir(bytecode_dir)
+
+                copy_file(bytecode_path, new_bytecode_path)
+            else:
+                compile_file(file_path)
+
+        # mkdtemp only gives the owner access, unlike a normal directory
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_dir, 0o777 & ~umask)
+
+        fsync_directory(temp_dir)
+
+        if os.path.exists(directory):
+            # The old directory is moved aside rather than deleted, so it can
+            # be put back if the new one can't be moved into place
+            old_dir = temp_dir + '.old'
+            os.rename(directory, old_dir)
+
+            try:
+                os.rename(temp_dir, directory)
+            except BaseException:  # pragma: no cover
+                os.rename(old_dir, directory)
+                raise
+
+            shutil.rmtree(old_dir)
+        else:
+            os.rename(temp_dir, directory)
+
+        fsync_directory(parent)
+    except BaseException:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+        raise
@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 from copy import copy
 
+import json
 import os
 import shutil
 import sys
@@ -12,12 +13,20 @@ from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.migrations.executor import MigrationExecutor
 from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
 from django.db.models.signals import post_migrate, pre_migrate
 from django.test import modify_settings, override_settings, TransactionTestCase
 from django.utils import six
 
-from django_migrate_project.loader import DEFAULT_PENDING_MIGRATIONS_DIRECTORY
+from django_migrate_project.check import (
+    get_unapplied_pending_migrations, get_unapplied_project_migrations
+)
+from django_migrate_project.executor import ProjectMigrationExecutor
+from django_migrate_project.loader import (
+    DEFAULT_PENDING_MIGRATIONS_DIRECTORY, ProjectMigrationLoaderMixin
+)
 
 import mock
 
@@ -174,7 +183,7 @@ class ApplyMigrationsTest(TransactionTestCase):
         # Fully migrate the app the collected migration depends on
         call_command('migrate', 'blog', verbosity=0)
 
-        module = 'django_migrate_project.management.commands.applymigrations'
+        module = 'django_migrate_project.management.base'
         get_app_configs_path = module + '.apps.get_app_configs'
 
         app_configs = apps.get_app_configs()
@@ -222,7 +231,7 @@ class ApplyMigrationsTest(TransactionTestCase):
         call_command('applymigrations', verbosity=0,
                      input_dir=INITIAL_MIGRATION_DIR)
 
-        module = 'django_migrate_project.management.commands.applymigrations'
+        module = 'django_migrate_project.management.base'
         changes_path = module + '.MigrationAutodetector.changes'
 
         with mock.patch(changes_path) as changes:
@@ -230,11 +239,21 @@ class ApplyMigrationsTest(TransactionTestCase):
 
             out = six.StringIO()
             call_command('applymigrations', stdout=out, verbosity=1,
-                         input_dir=INITIAL_MIGRATION_DIR)
+                         input_dir=INITIAL_MIGRATION_DIR,
+                         check_model_changes=True)
 
             self.assertIn("have changes", out.getvalue().lower())
             self.assertIn("makeprojectmigrations", out.getvalue().lower())
 
+            # Model changes are only checked for when asked to
+            changes.reset_mock()
+            out = six.StringIO()
+            call_command('applymigrations', stdout=out, verbosity=1,
+                         input_dir=INITIAL_MIGRATION_DIR)
+
+            self.assertNotIn("have changes", out.getvalue().lower())
+            self.assertFalse(changes.called)
+
     def test_routine_migration(self):
         """ Test a non-initial collected migration """
 
@@ -253,6 +272,120 @@ class ApplyMigrationsTest(TransactionTestCase):
         loader = MigrationLoader(connection)
         self.assertNotEqual(loader.applied_migrations, applied_migrations)
 
+    def test_fake(self):
+        """ Test faking applying and unapplying a collected migration """
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        applied_migrations = copy(loader.applied_migrations)
+        table_names = connection.introspection.table_names()
+
+        out = six.StringIO()
+        call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                     fake=True, stdout=out, verbosity=1)
+
+        self.assertIn("applying blog.0001_project... faked",
+                      out.getvalue().lower())
+
+        # The replaced migrations are recorded, but nothing was run
+        loader = MigrationLoader(connection)
+        self.assertIn(('blog', '0001_initial'), loader.applied_migrations)
+        self.assertIn(('cookbook', '0001_initial'), loader.applied_migrations)
+        self.assertNotIn(('blog', '0001_project'), loader.applied_migrations)
+        self.assertEqual(connection.introspection.table_names(), table_names)
+
+        out = six.StringIO()
+        call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                     fake=True, unapply=True, stdout=out, verbosity=1)
+
+        self.assertIn("unapplying blog.0001_project... faked",
+                      out.getvalue().lower())
+
+        loader = MigrationLoader(connection)
+        self.assertEqual(loader.applied_migrations, applied_migrations)
+
+    def test_single_transaction(self):
+        """ Test applying collected migrations in a single transaction """
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        applied_migrations = copy(loader.applied_migrations)
+        table_names = connection.introspection.table_names()
+
+        apply_migration = MigrationExecutor.apply_migration
+        calls = []
+
+        def failing_apply_migration(*args, **kwargs):
+            calls.append(args)
+
+            if len(calls) > 1:
+                raise RuntimeError("Failed")
+
+            return apply_migration(*args, **kwargs)
+
+        # A failure leaves none of the migrations applied
+        with mock.patch.object(MigrationExecutor, 'apply_migration',
+                               autospec=True,
+                               side_effect=failing_apply_migration):
+            with self.assertRaises(RuntimeError):
+                call_command('applymigrations', single_transaction=True,
+                             input_dir=INITIAL_MIGRATION_DIR, verbosity=0)
+
+        self.assertEqual(len(calls), 2)
+
+        loader = MigrationLoader(connection)
+        self.assertEqual(loader.applied_migrations, applied_migrations)
+        self.assertEqual(connection.introspection.table_names(), table_names)
+
+        self.clear_migrations_modules()
+
+        call_command('applymigrations', single_transaction=True,
+                     input_dir=INITIAL_MIGRATION_DIR, verbosity=0)
+
+        loader = MigrationLoader(connection)
+        self.assertIn(('blog', '0002_tag'), loader.applied_migrations)
+        self.assertNotIn(('blog', '0001_project'), loader.applied_migrations)
+
+        # Databases which can't roll back schema changes aren't supported
+        with mock.patch.object(connection.features, 'can_rollback_ddl',
+                               False):
+            with self.assertRaises(CommandError):
+                call_command('applymigrations', single_transaction=True,
+                             input_dir=INITIAL_MIGRATION_DIR, verbosity=0)
+
+    def test_coalesce_rebuilds(self):
+        """ Test applying with table rebuilds coalesced, and their timings """
+
+        # Partial migration to set state
+        call_command('migrate', 'blog', '0001', verbosity=0)
+        call_command('migrate', 'cookbook', '0003', verbosity=0)
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        applied_migrations = copy(loader.applied_migrations)
+
+        self.tempdir = tempfile.mkdtemp()
+        timings_path = os.path.join(self.tempdir, 'timings.json')
+
+        call_command('applymigrations', input_dir=ROUTINE_MIGRATION_DIR,
+                     coalesce_rebuilds=True, timings_file=timings_path,
+                     verbosity=0)
+
+        loader = MigrationLoader(connection)
+        self.assertNotEqual(loader.applied_migrations, applied_migrations)
+
+        with open(timings_path) as timings_file:
+            names = [phase['name'] for phase in
+                     json.load(timings_file)['phases']]
+
+        self.assertIn('executor.table.cookbook_ingredient', names)
+
+        call_command('applymigrations', input_dir=ROUTINE_MIGRATION_DIR,
+                     coalesce_rebuilds=True, unapply=True, verbosity=0)
+
+        loader = MigrationLoader(connection)
+        self.assertEqual(loader.applied_migrations, applied_migrations)
+
     def test_unoptimized_migration(self):
         """ Test an unoptimized collected migration """
 
@@ -267,6 +400,263 @@ class ApplyMigrationsTest(TransactionTestCase):
         loader = MigrationLoader(connection)
         self.assertNotEqual(loader.applied_migrations, applied_migrations)
 
+    def test_graph_cache(self):
+        """ Test applying and unapplying with the graph cache enabled """
+
+        self.tempdir = tempfile.mkdtemp()
+        cache_path = os.path.join(self.tempdir, 'graph_cache.json')
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        applied_migrations = copy(loader.applied_migrations)
+
+        with override_settings(PROJECT_MIGRATIONS_GRAPH_CACHE=cache_path):
+            # Prime the cache so the apply runs from cached migrations
+            call_command('collectmigrations', verbosity=0,
+                         output_dir=os.path.join(self.tempdir, 'collected'))
+            self.assertTrue(os.path.exists(cache_path))
+
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         verbosity=0)
+
+            loader = MigrationLoader(connection)
+            self.assertNotEqual(loader.applied_migrations, applied_migrations)
+
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         unapply=True, verbosity=0)
+
+        loader = MigrationLoader(connection)
+        self.assertEqual(loader.applied_migrations, applied_migrations)
+
+    def test_single_graph_load(self):
+        """ Test that the graph is loaded and the recorder queried once """
+
+        # Apply first so the run being checked has nothing to do
+        call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                     verbosity=0)
+
+        # Both stock and project-aware loaders build a graph
+        build_graph = mock.patch.object(
+            MigrationLoader, 'build_graph', autospec=True,
+            side_effect=MigrationLoader.build_graph)
+        build_project_graph = mock.patch.object(
+            ProjectMigrationLoaderMixin, 'build_graph', autospec=True,
+            side_effect=ProjectMigrationLoaderMixin.build_graph)
+        applied_migrations = mock.patch.object(
+            MigrationRecorder, 'applied_migrations', autospec=True,
+            side_effect=MigrationRecorder.applied_migrations)
+
+        with build_graph as build_graph_mock, \
+                build_project_graph as build_project_graph_mock, \
+                applied_migrations as applied_migrations_mock:
+            call_command('applymigrations', verbosity=0,
+                         input_dir=INITIAL_MIGRATION_DIR)
+
+        self.assertEqual(build_graph_mock.call_count +
+                         build_project_graph_mock.call_count, 1)
+        self.assertEqual(applied_migrations_mock.call_count, 1)
+
+    def test_manifest_fast_path(self):
+        """ Test finding nothing to apply from the manifest alone """
+
+        self.tempdir = tempfile.mkdtemp()
+        collected_dir = os.path.join(self.tempdir, 'collected')
+
+        call_command('collectmigrations', output_dir=collected_dir,
+                     verbosity=0)
+        call_command('applymigrations', input_dir=collected_dir, verbosity=0)
+
+        build_project_graph = mock.patch.object(
+            ProjectMigrationLoaderMixin, 'build_graph', autospec=True,
+            side_effect=ProjectMigrationLoaderMixin.build_graph)
+
+        with build_project_graph as build_project_graph_mock:
+            call_command('applymigrations', input_dir=collected_dir,
+                         verbosity=0)
+
+        self.assertEqual(build_project_graph_mock.call_count, 0)
+
+        with build_project_graph as build_project_graph_mock:
+            out = six.StringIO()
+            call_command('applymigrations', input_dir=collected_dir,
+                         stdout=out, verbosity=1)
+
+        self.assertIn("target specific migration: 0002_project, from cookbook",
+                      out.getvalue().lower())
+        self.assertIn("no migrations to apply", out.getvalue().lower())
+        self.assertEqual(build_project_graph_mock.call_count, 0)
+
+        # The graph is still used for checking for model changes
+        with build_project_graph as build_project_graph_mock:
+            call_command('applymigrations', input_dir=collected_dir,
+                         stdout=six.StringIO(), verbosity=1,
+                         check_model_changes=True)
+
+        self.assertEqual(build_project_graph_mock.call_count, 1)
+
+        # Files which don't match the manifest aren't trusted
+        with open(os.path.join(collected_dir, 'blog_0001_project.py'),
+                  'a') as blog_file:
+            blog_file.write("# Edited\n")
+
+        with build_project_graph as build_project_graph_mock:
+            call_command('applymigrations', input_dir=collected_dir,
+                         verbosity=0)
+
+        self.assertEqual(build_project_graph_mock.call_count, 1)
+
+        # Nor is it used when the migrations aren't applied
+        call_command('migrate', 'blog', 'zero', verbosity=0)
+        call_command('migrate', 'cookbook', 'zero', verbosity=0)
+        call_command('collectmigrations', output_dir=collected_dir,
+                     verbosity=0)
+
+        with build_project_graph as build_project_graph_mock:
+            call_command('applymigrations', input_dir=collected_dir,
+                         verbosity=0)
+
+        self.assertEqual(build_project_graph_mock.call_count, 1)
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        self.assertIn(('cookbook', '0001_initial'), loader.applied_migrations)
+
+    def test_check(self):
+        """ Test checking for collected migrations to apply """
+
+        out = six.StringIO()
+
+        with self.assertRaises(SystemExit) as cm:
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         check=True, stdout=out, verbosity=1)
+
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("cookbook.0001_project", out.getvalue().lower())
+
+        # Nothing was applied
+        connection = connections[DEFAULT_DB_ALIAS]
+        loader = MigrationLoader(connection)
+        self.assertNotIn(('blog', '0001_initial'), loader.applied_migrations)
+
+        call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                     verbosity=0)
+
+        out = six.StringIO()
+        call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                     check=True, stdout=out, verbosity=1)
+
+        self.assertIn("no collected migrations to apply",
+                      out.getvalue().lower())
+
+        with self.assertRaises(CommandError):
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         check=True, unapply=True, verbosity=0)
+
+        # Checking never opens a transaction, so it works on any database
+        connection = connections[DEFAULT_DB_ALIAS]
+
+        with mock.patch.object(connection.features, 'can_rollback_ddl',
+                               False):
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         check=True, single_transaction=True, verbosity=0)
+
+    def test_check_missing_table(self):
+        """ Test checking never creates the table of applied migrations """
+
+        self.tempdir = tempfile.mkdtemp()
+        collected_dir = os.path.join(self.tempdir, 'collected')
+
+        call_command('collectmigrations', output_dir=collected_dir,
+                     verbosity=0)
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        no_tables = mock.patch.object(connection.introspection,
+                                      'table_names', return_value=[])
+        ensure_schema = mock.patch.object(MigrationRecorder, 'ensure_schema')
+
+        with no_tables, ensure_schema as ensure_schema_mock:
+            # With and without a manifest
+            for input_dir in (collected_dir, INITIAL_MIGRATION_DIR):
+                unapplied = get_unapplied_pending_migrations(input_dir)
+
+                self.assertIn(('blog', '0001_project'), unapplied)
+
+            # There's no project migrations here, but the database is read
+            self.assertEqual(get_unapplied_project_migrations(), [])
+
+        self.assertFalse(ensure_schema_mock.called)
+
+    def test_check_manifest(self):
+        """ Test checking with a manifest doesn't build the graph """
+
+        self.tempdir = tempfile.mkdtemp()
+        collected_dir = os.path.join(self.tempdir, 'collected')
+
+        call_command('collectmigrations', output_dir=collected_dir,
+                     verbosity=0)
+
+        build_project_graph = mock.patch.object(
+            ProjectMigrationLoaderMixin, 'build_graph', autospec=True,
+            side_effect=ProjectMigrationLoaderMixin.build_graph)
+
+        with build_project_graph as build_project_graph_mock:
+            out = six.StringIO()
+
+            with self.assertRaises(SystemExit):
+                call_command('applymigrations', input_dir=collected_dir,
+                             check=True, stdout=out, verbosity=1)
+
+            self.assertIn("blog.0001_project", out.getvalue().lower())
+
+            call_command('applymigrations', input_dir=collected_dir,
+                         verbosity=0)
+            build_project_graph_mock.reset_mock()
+
+            call_command('applymigrations', input_dir=collected_dir,
+                         check=True, verbosity=0)
+
+        self.assertEqual(build_project_graph_mock.call_count, 0)
+
+    def test_timings(self):
+        """ Test reporting the timings of each phase """
+
+        out = six.StringIO()
+        coalesce_path = 'django_migrate_project.executor.coalesce_migration'
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        apply_migration = ProjectMigrationExecutor.apply_migration
+        other_editors = []
+
+        def checking_apply_migration(executor, *args, **kwargs):
+            # Something else opening a schema editor while migrating
+            other_editors.append(connection.schema_editor())
+
+            return apply_migration(executor, *args, **kwargs)
+
+        with mock.patch(coalesce_path) as coalesce_migration, \
+                mock.patch.object(ProjectMigrationExecutor, 'apply_migration',
+                                  checking_apply_migration):
+            call_command('applymigrations', input_dir=INITIAL_MIGRATION_DIR,
+                         timings=True, stdout=out, verbosity=0)
+
+        output = out.getvalue()
+        self.assertIn("applymigrations.migrate", output)
+        self.assertIn("applymigrations.post_migrate", output)
+        self.assertIn("loader.load_disk", output)
+
+        # The time spent on each table is recorded without changing what's
+        # run to apply the migrations
+        self.assertIn("executor.table.blog_post", output)
+        self.assertFalse(coalesce_migration.called)
+
+        # Only the executor's own schema editors are timed
+        self.assertTrue(other_editors)
+
+        for schema_editor in other_editors:
+            self.assertNotIn('create_model', vars(schema_editor))
+
+        self.assertNotIn('schema_editor', vars(connection))
+
     def test_input_dir_error(self):
         """ Test running the management command with bad input dir option """
 
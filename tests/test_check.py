@@ -0,0 +1,41 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from django_migrate_project.check import get_unapplied_pending_migrations
+
+
+class GetUnappliedPendingMigrationsTest(SimpleTestCase):
+    """ Tests for get_unapplied_pending_migrations """
+
+    def test_missing_dir(self):
+        """ Test a directory which doesn't exist is rejected """
+
+        tempdir = tempfile.mkdtemp()
+        shutil.rmtree(tempdir)
+
+        with self.assertRaises(ValueError):
+            get_unapplied_pending_migrations(tempdir)
+
+    def test_empty_dir(self):
+        """ Test an empty directory is rejected """
+
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+
+        with self.assertRaises(ValueError):
+            get_unapplied_pending_migrations(tempdir)
+
+    def test_file(self):
+        """ Test a file is rejected rather than read as a directory """
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        with self.assertRaises(ValueError):
+            get_unapplied_pending_migrations(path)
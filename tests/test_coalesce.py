@@ -0,0 +1,213 @@
+from __future__ import unicode_literals
+
+from django.db import connections, DEFAULT_DB_ALIAS, migrations, models
+from django.db.backends.sqlite3.schema import DatabaseSchemaEditor
+from django.db.migrations.migration import Migration
+from django.db.migrations.state import ProjectState
+from django.test import SimpleTestCase, TransactionTestCase
+
+from django_migrate_project.coalesce import (
+    coalesce_migration, coalesce_operations, is_rebuildable, TableOperations
+)
+from django_migrate_project.loader import LazyMigration
+
+import mock
+
+
+APP_LABEL = 'coalesce_test'
+
+CREATE_ITEM = migrations.CreateModel(
+    name='Item',
+    fields=[
+        ('id', models.AutoField(primary_key=True, auto_created=True,
+                                serialize=False, verbose_name='ID')),
+        ('name', models.CharField(max_length=10, default='')),
+        ('old', models.IntegerField(default=0)),
+    ],
+)
+
+FIELD_OPERATIONS = [
+    migrations.AddField(
+        model_name='item',
+        name='size',
+        field=models.IntegerField(default=3),
+    ),
+    migrations.AlterField(
+        model_name='item',
+        name='name',
+        field=models.CharField(max_length=20, default=''),
+    ),
+    migrations.RemoveField(
+        model_name='item',
+        name='old',
+    ),
+    migrations.AddField(
+        model_name='item',
+        name='note',
+        field=models.CharField(max_length=10, default='new'),
+        preserve_default=False,
+    ),
+]
+
+
+class CoalesceOperationsTest(SimpleTestCase):
+    """ Tests for grouping field operations """
+
+    def test_grouping(self):
+        """ Test only adjacent operations on the same model are grouped """
+
+        other_field = migrations.AddField(
+            model_name='Other',
+            name='size',
+            field=models.IntegerField(default=0),
+        )
+        same_field = migrations.AlterField(
+            model_name='item',
+            name='size',
+            field=models.IntegerField(default=1),
+        )
+        delete_model = migrations.DeleteModel(name='Gone')
+
+        operations = coalesce_operations(
+            FIELD_OPERATIONS + [other_field, delete_model, same_field,
+                                same_field])
+
+        self.assertEqual([type(operation) for operation in operations], [
+            TableOperations, TableOperations, migrations.DeleteModel,
+            TableOperations, TableOperations])
+        self.assertEqual(operations[0].operations, FIELD_OPERATIONS)
+        self.assertEqual(operations[0].field_names,
+                         ['size', 'name', 'old', 'note'])
+        self.assertEqual(operations[1].model_name, 'other')
+        self.assertEqual(operations[3].operations, [same_field])
+        self.assertEqual(operations[4].operations, [same_field])
+
+    def test_migration(self):
+        """ Test the migration is copied rather than changed """
+
+        migration = Migration('0002_fields', APP_LABEL)
+        migration.operations = FIELD_OPERATIONS
+        coalesced = coalesce_migration(migration)
+
+        self.assertEqual(coalesced, migration)
+        self.assertIs(migration.operations, FIELD_OPERATIONS)
+        self.assertEqual(len(coalesced.operations), 1)
+        self.assertEqual(coalesced.operations[0].describe(),
+                         "Change fields size, name, old, note on item")
+
+    def test_lazy_migration(self):
+        """ Test a loaded lazy migration keeps its operations """
+
+        migration = Migration('0002_fields', APP_LABEL)
+        migration.operations = FIELD_OPERATIONS
+        module = mock.Mock(Migration=mock.Mock(return_value=migration))
+        lazy_migration = LazyMigration(
+            '0002_fields', APP_LABEL, mock.Mock(return_value=module))
+
+        self.assertIs(lazy_migration.operations, FIELD_OPERATIONS)
+
+        coalesced = coalesce_migration(lazy_migration)
+
+        self.assertEqual(coalesced, lazy_migration)
+        self.assertEqual(len(coalesced.operations), 1)
+        self.assertIs(lazy_migration.operations, FIELD_OPERATIONS)
+
+    def test_is_rebuildable(self):
+        """ Test which fields can be changed by rebuilding the table """
+
+        connection = connections[DEFAULT_DB_ALIAS]
+
+        self.assertTrue(is_rebuildable(models.IntegerField(), connection))
+        self.assertFalse(is_rebuildable(
+            models.AutoField(primary_key=True), connection))
+        self.assertFalse(is_rebuildable(
+            models.ManyToManyField('blog.Tag'), connection))
+
+
+class TableOperationsTest(TransactionTestCase):
+    """ Tests for applying grouped field operations """
+
+    def setUp(self):
+        self.connection = connections[DEFAULT_DB_ALIAS]
+        self.state = ProjectState()
+        CREATE_ITEM.state_forwards(APP_LABEL, self.state)
+
+        with self.connection.schema_editor() as editor:
+            CREATE_ITEM.database_forwards(
+                APP_LABEL, editor, ProjectState(), self.state)
+
+        with self.connection.cursor() as cursor:
+            for idx in range(3):
+                cursor.execute(
+                    "INSERT INTO coalesce_test_item (name, old) "
+                    "VALUES (%s, %s)", ['item%d' % idx, idx])
+
+    def tearDown(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS coalesce_test_item")
+
+    def describe_table(self):
+        """ Returns the columns and rows of the test table, in name order """
+
+        with self.connection.cursor() as cursor:
+            columns = [
+                column[0] for column in
+                self.connection.introspection.get_table_description(
+                    cursor, 'coalesce_test_item')
+            ]
+            cursor.execute("SELECT * FROM coalesce_test_item ORDER BY id")
+            rows = [sorted(zip(columns, row)) for row in cursor.fetchall()]
+
+        return sorted(columns), rows
+
+    def migrate(self, coalesce, backwards=False):
+        """
+        Applies the field operations, or unapplies them when backwards,
+        returning how many times the table was rebuilt.
+        """
+
+        migration = Migration('0002_fields', APP_LABEL)
+        migration.operations = FIELD_OPERATIONS
+
+        if coalesce:
+            migration.operations = coalesce_operations(FIELD_OPERATIONS)
+        remake_table = DatabaseSchemaEditor._remake_table
+
+        with mock.patch.object(DatabaseSchemaEditor, '_remake_table',
+                               autospec=True,
+                               side_effect=remake_table) as remake_mock:
+            with self.connection.schema_editor() as editor:
+                if backwards:
+                    migration.unapply(self.state.clone(), editor)
+                else:
+                    migration.apply(self.state.clone(), editor)
+
+        return remake_mock.call_count
+
+    def test_coalesced(self):
+        """ Test a single rebuild gives the same table as one per operation """
+
+        original = self.describe_table()
+
+        self.assertEqual(self.migrate(coalesce=False), len(FIELD_OPERATIONS))
+        expected = self.describe_table()
+
+        self.assertEqual(self.migrate(coalesce=False, backwards=True),
+                         len(FIELD_OPERATIONS))
+        self.assertEqual(self.describe_table()[0], original[0])
+
+        self.assertEqual(self.migrate(coalesce=True), 1)
+        self.assertEqual(self.describe_table(), expected)
+        self.assertEqual(expected[0], ['id', 'name', 'note', 'size'])
+        self.assertEqual(expected[1][0], [
+            ('id', 1), ('name', 'item0'), ('note', 'new'), ('size', 3)])
+
+        self.assertEqual(self.migrate(coalesce=True, backwards=True), 1)
+        self.assertEqual(self.describe_table()[0], original[0])
+
+    def test_other_vendor(self):
+        """ Test the operations are run one by one on other databases """
+
+        with mock.patch.object(self.connection, 'vendor', 'postgresql'):
+            self.assertEqual(self.migrate(coalesce=True),
+                             len(FIELD_OPERATIONS))
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from imp import load_source
+from itertools import chain, repeat
 from os.path import exists as path_exists
 
 # Python 3 compatibility
@@ -9,17 +10,37 @@ try:
 except ImportError:
     import builtins
 
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    def cache_from_source(path):
+        return path + 'c'
+
+import json
 import os
+import pstats
+import py_compile
 import shutil
+import struct
 import tempfile
 
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test import override_settings, TransactionTestCase
+from django.db.migrations import Migration
+from django.db.migrations.migration import swappable_dependency
+from django.test import override_settings, SimpleTestCase, TransactionTestCase
 from django.utils import six
 
 from django_migrate_project.loader import DEFAULT_PENDING_MIGRATIONS_DIRECTORY
+from django_migrate_project.management.commands.collectmigrations import (
+    Command as CollectMigrationsCommand
+)
+from django_migrate_project.manifest import (
+    CollectionManifest, get_swappable_settings, MANIFEST_FILENAME
+)
+from django_migrate_project.parallel import map_in_pool
+from django_migrate_project.writer import render_migrations
 
 import mock
 
@@ -213,17 +234,50 @@ class CollectMigrationsTest(TransactionTestCase):
 
         self.assertFalse(path_exists(DEFAULT_DIR))
 
-        module = 'django_migrate_project.management.commands.collectmigrations'
-        mkdir_path = module + '.os.mkdir'
-
-        with mock.patch(mkdir_path) as mkdir:
-            mkdir.side_effect = IOError()
+        with mock.patch('django_migrate_project.writer.os.rename') as rename:
+            rename.side_effect = OSError()
 
-            with self.assertRaises(IOError):
+            with self.assertRaises(OSError):
                 call_command('collectmigrations', verbosity=0)
 
         self.assertFalse(path_exists(DEFAULT_DIR))
 
+        # The temporary directory was cleaned up too
+        self.assertEqual(self.temporary_dirs(settings.BASE_DIR), [])
+
+    def test_failure_keeps_previous(self):
+        """ Test a failed collection leaves the previous collection alone """
+
+        self.tempdir = tempfile.mkdtemp()
+        output_dir = os.path.join(self.tempdir, 'pending')
+
+        call_command('collectmigrations', output_dir=output_dir, verbosity=0)
+        previous = self.read_output(output_dir)
+
+        render_path = ('django_migrate_project.management.commands.'
+                       'collectmigrations.render_migrations')
+
+        with mock.patch(render_path) as render_migrations:
+            render_migrations.return_value = [b'broken'] * 3
+
+            with mock.patch('django_migrate_project.writer.os.fsync') as fsync:
+                fsync.side_effect = OSError()
+
+                # Without optimizing every file changes
+                with self.assertRaises(OSError):
+                    call_command('collectmigrations', output_dir=output_dir,
+                                 no_optimize=True, verbosity=0)
+
+        self.assertEqual(self.read_output(output_dir), previous)
+        self.assertEqual(os.listdir(self.tempdir), ['pending'])
+
+    def temporary_dirs(self, dir):
+        """ Temporary directories left next to the output directory """
+
+        prefix = '.' + os.path.basename(DEFAULT_DIR)
+
+        return [name for name in os.listdir(dir) if name.startswith(prefix)]
+
     def test_output_dir_error(self):
         """ Test running the management command with bad output dir option """
 
@@ -280,6 +334,250 @@ class CollectMigrationsTest(TransactionTestCase):
         # One more time with no verbosity for full branch coverage
         call_command('collectmigrations', no_optimize=True, verbosity=0)
 
+    def test_bytecode(self):
+        """ Test that collected migrations are compiled to bytecode """
+
+        filenames = ('blog_0001_project.py', 'cookbook_0001_project.py',
+                     'cookbook_0002_project.py')
+
+        call_command('collectmigrations', verbosity=0)
+
+        for filename in filenames:
+            bytecode_path = cache_from_source(
+                os.path.join(DEFAULT_DIR, filename))
+            self.assertTrue(path_exists(bytecode_path))
+
+            if hasattr(py_compile, 'PycInvalidationMode'):  # pragma: no cover
+                with open(bytecode_path, 'rb') as bytecode_file:
+                    flags, = struct.unpack('<I', bytecode_file.read(8)[4:])
+
+                # Validated by the checked hash of the source
+                self.assertEqual(flags, 0b11)
+
+        call_command('collectmigrations', no_compile=True, verbosity=0)
+
+        for filename in filenames:
+            bytecode_path = cache_from_source(
+                os.path.join(DEFAULT_DIR, filename))
+            self.assertFalse(path_exists(bytecode_path))
+
+    def read_output(self, output_dir):
+        output = {}
+
+        for filename in os.listdir(output_dir):
+            if filename.endswith('.py'):
+                with open(os.path.join(output_dir, filename), 'rb') as f:
+                    output[filename] = f.read()
+
+        return output
+
+    def test_jobs(self):
+        """ Test optimizing in parallel gives the same output as serially """
+
+        self.tempdir = tempfile.mkdtemp()
+        serial_dir = os.path.join(self.tempdir, 'serial')
+        parallel_dir = os.path.join(self.tempdir, 'parallel')
+
+        call_command('collectmigrations', output_dir=serial_dir, verbosity=0)
+
+        out = six.StringIO()
+        call_command('collectmigrations', output_dir=parallel_dir, jobs=2,
+                     stdout=out, verbosity=1)
+
+        self.assertIn("optimizing 'cookbook'", out.getvalue().lower())
+        self.assertNotIn("optimizing in this one", out.getvalue().lower())
+        self.assertEqual(
+            self.read_output(serial_dir), self.read_output(parallel_dir))
+
+        # The swappable dependency of blog's posts on the user model
+        self.assertIn(b"('auth', ",
+                      self.read_output(parallel_dir)['blog_0001_project.py'])
+
+        # Operations which can't be pickled are optimized serially instead
+        fallback_dir = os.path.join(self.tempdir, 'fallback')
+        dumps_path = 'django_migrate_project.optimizer.pickle.dumps'
+
+        with mock.patch(dumps_path) as dumps:
+            dumps.side_effect = TypeError()
+
+            out = six.StringIO()
+            call_command('collectmigrations', output_dir=fallback_dir,
+                         jobs=2, stdout=out, verbosity=1)
+
+        self.assertIn("optimizing in this one", out.getvalue().lower())
+        self.assertEqual(
+            self.read_output(serial_dir), self.read_output(fallback_dir))
+
+        with self.assertRaises(CommandError):
+            call_command('collectmigrations', jobs=-1, verbosity=0)
+
+    def test_manifest(self):
+        """ Test only changed migrations are collected again """
+
+        self.tempdir = tempfile.mkdtemp()
+        output_dir = os.path.join(self.tempdir, 'pending')
+        blog_path = os.path.join(output_dir, 'blog_0001_project.py')
+        cookbook_path = os.path.join(output_dir, 'cookbook_0001_project.py')
+
+        call_command('collectmigrations', output_dir=output_dir, verbosity=0)
+        self.assertTrue(path_exists(os.path.join(output_dir, 'manifest.json')))
+
+        # Only the swappable settings the collected migrations depend on
+        with open(os.path.join(output_dir, 'manifest.json')) as f:
+            environment = json.load(f)['environment']
+
+        self.assertEqual(environment['swappable_settings'],
+                         {'AUTH_USER_MODEL': settings.AUTH_USER_MODEL})
+
+        # Make the existing files look old, to tell if they're rewritten
+        for filename in os.listdir(output_dir):
+            os.utime(os.path.join(output_dir, filename), (1, 1))
+
+        out = six.StringIO()
+        call_command('collectmigrations', output_dir=output_dir, stdout=out,
+                     verbosity=1)
+
+        self.assertIn("up to date", out.getvalue().lower())
+        self.assertNotIn("optimizing", out.getvalue().lower())
+        self.assertEqual(os.path.getmtime(blog_path), 1)
+
+        # A collected migration edited by hand is collected again
+        with open(cookbook_path, 'a') as cookbook_file:
+            cookbook_file.write("# Edited\n")
+
+        expected = self.read_output(output_dir)
+
+        out = six.StringIO()
+        call_command('collectmigrations', output_dir=output_dir, stdout=out,
+                     verbosity=1)
+
+        output = out.getvalue().lower()
+        self.assertIn("keeping unchanged 'blog_0001_project.py'", output)
+        self.assertIn("optimizing 'cookbook'", output)
+        self.assertNotIn("optimizing 'blog'", output)
+        self.assertEqual(os.path.getmtime(blog_path), 1)
+        self.assertNotEqual(os.path.getmtime(cookbook_path), 1)
+        self.assertNotEqual(
+            self.read_output(output_dir)['cookbook_0001_project.py'],
+            expected['cookbook_0001_project.py'])
+
+        # Different options give different files, so everything is redone
+        out = six.StringIO()
+        call_command('collectmigrations', output_dir=output_dir, stdout=out,
+                     no_optimize=True, verbosity=1)
+
+        self.assertNotIn("keeping unchanged", out.getvalue().lower())
+        self.assertNotEqual(os.path.getmtime(blog_path), 1)
+
+    def test_timings(self):
+        """ Test reporting the timings of each phase """
+
+        self.tempdir = tempfile.mkdtemp()
+        timings_path = os.path.join(self.tempdir, 'timings.json')
+
+        out = six.StringIO()
+        call_command('collectmigrations', timings=True,
+                     timings_file=timings_path, stdout=out, verbosity=0)
+
+        self.assertIn("timings:", out.getvalue().lower())
+        self.assertIn("collectmigrations.render_migrations", out.getvalue())
+
+        with open(timings_path) as timings_file:
+            report = json.load(timings_file)
+
+        names = [phase['name'] for phase in report['phases']]
+
+        self.assertEqual(names[0], 'collectmigrations')
+        self.assertIn('loader.build_graph', names)
+        self.assertIn('loader.applied_migrations', names)
+        self.assertIn('collectmigrations.split_app_migrations', names)
+        self.assertIn('collectmigrations.replace_directory', names)
+
+    def test_profile(self):
+        """ Test profiling the command and only its optimizer """
+
+        self.tempdir = tempfile.mkdtemp()
+        profile_path = os.path.join(self.tempdir, 'profile.stats')
+
+        call_command('collectmigrations', profile=profile_path,
+                     output_dir=os.path.join(self.tempdir, 'first'),
+                     verbosity=0)
+        self.assertTrue(os.path.exists(profile_path))
+
+        out = six.StringIO()
+        call_command('collectmigrations', profile=profile_path,
+                     profile_phase='optimizer', stdout=out, verbosity=2,
+                     output_dir=os.path.join(self.tempdir, 'second'))
+
+        stats = pstats.Stats(profile_path)
+        names = set(name for _, _, name in stats.stats)
+
+        self.assertIn('optimize_operations', names)
+        self.assertNotIn('build_graph', names)
+        self.assertIn("cumulative", out.getvalue())
+
+    def test_bounded_optimization(self):
+        """ Test optimizing with a window and a time budget """
+
+        out = six.StringIO()
+        call_command('collectmigrations', optimize_window=100,
+                     optimize_timeout=60, stdout=out, verbosity=2)
+
+        output = out.getvalue().lower()
+
+        self.assertIn("optimized from", output)
+        self.assertIn("eliminated 3 operations in", output)
+        self.assertNotIn("ran out of time", output)
+
+        blog_migrations, cookbook_migrations = self.load_migrations()
+
+        # A large enough window optimizes as well as an unbounded one
+        self.assertEqual(len(cookbook_migrations[1].Migration.operations),
+                         COOKBOOK_FULL_MIGRATION_OPERATION_COUNT[1])
+
+        # Running out of time keeps the operations as they were
+        clock = chain([0, 0], repeat(10))
+
+        with mock.patch('django_migrate_project.optimizer.time.time',
+                        side_effect=lambda: next(clock)):
+            out = six.StringIO()
+            call_command('collectmigrations', no_compile=True, jobs=1,
+                         optimize_timeout=5, stdout=out, verbosity=1)
+
+        self.assertIn("ran out of time", out.getvalue().lower())
+
+        with self.assertRaises(CommandError):
+            call_command('collectmigrations', optimize_window=0, verbosity=0)
+
+        with self.assertRaises(CommandError):
+            call_command('collectmigrations', optimize_timeout=0, verbosity=0)
+
+    def test_optimizer_cache(self):
+        """ Test that unchanged apps aren't optimized again """
+
+        self.tempdir = tempfile.mkdtemp()
+        cache_path = os.path.join(self.tempdir, 'optimizer_cache')
+        first_dir = os.path.join(self.tempdir, 'first')
+        second_dir = os.path.join(self.tempdir, 'second')
+
+        optimize_path = ('django_migrate_project.optimizer.'
+                         'MigrationOptimizer.optimize')
+
+        with override_settings(PROJECT_MIGRATIONS_OPTIMIZER_CACHE=cache_path):
+            call_command('collectmigrations', output_dir=first_dir,
+                         verbosity=0)
+
+            with mock.patch(optimize_path) as optimize:
+                out = six.StringIO()
+                call_command('collectmigrations', output_dir=second_dir,
+                             stdout=out, verbosity=2)
+
+                self.assertFalse(optimize.called)
+
+        self.assertIn("reused 3 of 3 cached", out.getvalue().lower())
+        self.assertEqual(
+            self.read_output(first_dir), self.read_output(second_dir))
+
     def test_alt_database(self):
         """ Test collecting migrations with an alternate database selected """
 
@@ -330,3 +628,108 @@ class CollectMigrationsTest(TransactionTestCase):
         call_command('collectmigrations', stdout=out, verbosity=0)
 
         self.assertFalse(out.getvalue())
+
+
+class GetDependenciesTest(SimpleTestCase):
+    """ Tests for the replaces and dependencies of a collected migration """
+
+    def make_migration(self, name, dependencies, replaces=None):
+        migration = Migration(name, 'blog')
+        migration.dependencies = dependencies
+        migration.replaces = replaces or []
+
+        return migration
+
+    def test_squashed(self):
+        """ Test a squashed migration is replaced by what it replaces """
+
+        squashed = self.make_migration(
+            '0001_squashed_0002_tag', [('auth', '0001_initial')],
+            replaces=[('blog', '0001_initial'), ('blog', '0002_tag')])
+        post = self.make_migration(
+            '0003_post', [('blog', '0001_squashed_0002_tag'),
+                          ('blog', '0002_tag')])
+
+        replaces, dependencies = CollectMigrationsCommand().get_dependencies(
+            [squashed, post])
+
+        # Django records the replaced migrations, not the squashed one
+        self.assertEqual(replaces, [
+            ('blog', '0001_initial'), ('blog', '0002_tag'),
+            ('blog', '0003_post')])
+        self.assertEqual(dependencies, [('auth', '0001_initial')])
+
+
+class RenderMigrationsTest(SimpleTestCase):
+    """ Tests for rendering collected migrations """
+
+    def test_swappable_dependency(self):
+        """ Test a swappable dependency renders the same in a pool """
+
+        # As parsed from the migration's source
+        user_dependency = swappable_dependency('auth.User')
+        user_dependency.setting_name = 'AUTH_USER_MODEL'
+
+        migrations = []
+
+        for app_label in ('blog', 'cookbook'):
+            migration = Migration('0001_project', app_label)
+            migration.dependencies = [user_dependency]
+            migrations.append(migration)
+
+        serial = render_migrations(migrations)
+
+        with mock.patch('django_migrate_project.writer.map_in_pool',
+                        wraps=map_in_pool) as map_in_pool_mock:
+            parallel = render_migrations(migrations, processes=2)
+
+        self.assertTrue(map_in_pool_mock.called)
+        self.assertEqual(parallel, serial)
+        self.assertIn(b"('auth', '__first__')", parallel[0])
+
+
+class CollectionManifestTest(SimpleTestCase):
+    """ Tests for the manifest of a directory of collected migrations """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def make_manifest(self, swappable_settings):
+        """ Writes a manifest with one entry, and returns a new one """
+
+        manifest = CollectionManifest(
+            self.tempdir, swappable_settings=swappable_settings)
+        manifest.add('blog_0001_project.py', {}, 'hash')
+
+        with open(os.path.join(self.tempdir, MANIFEST_FILENAME), 'wb') as f:
+            f.write(manifest.dumps())
+
+        return CollectionManifest(
+            self.tempdir, swappable_settings=swappable_settings)
+
+    def test_swappable_settings(self):
+        """ Test the swappable settings depended on are found """
+
+        user_dependency = swappable_dependency('auth.User')
+        user_dependency.setting_name = 'AUTH_USER_MODEL'
+        migration = Migration('0001_initial', 'blog')
+        migration.dependencies = [
+            user_dependency, swappable_dependency('shop.Customer'),
+            ('cookbook', '0001_initial')]
+
+        self.assertEqual(get_swappable_settings([migration]), {
+            'AUTH_USER_MODEL': 'auth.User',
+            'shop.Customer': 'shop.Customer',
+        })
+
+    def test_swappable_setting_changed(self):
+        """ Test changing any swappable setting depended on redoes all """
+
+        manifest = self.make_manifest({'CUSTOMER_MODEL': 'shop.Customer'})
+        self.assertIn('blog_0001_project.py', manifest.previous_entries)
+
+        manifest = CollectionManifest(
+            self.tempdir,
+            swappable_settings={'CUSTOMER_MODEL': 'accounts.Customer'})
+        self.assertEqual(manifest.previous_entries, {})
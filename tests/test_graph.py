@@ -0,0 +1,265 @@
+from __future__ import unicode_literals
+
+from django.db.migrations.graph import MigrationGraph
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.migration import Migration
+from django.test import SimpleTestCase
+
+from django_migrate_project.graph import (
+    find_strongly_connected_components, get_parents, split_app_migrations,
+    split_component_greedily, walk_app_migrations
+)
+
+import mock
+
+
+class SplitAssertionsMixin(object):
+    """ Assertions for checking how app migrations were split """
+
+    def assertAcyclic(self, graph, splits):
+        """
+        Applies the splits and checks each migration is in exactly one set
+        of its own app, and that the result is acyclic
+        """
+
+        set_index = {}
+
+        for app_label, migration_sets in splits.items():
+            for idx, migration_set in enumerate(migration_sets):
+                for key in migration_set:
+                    self.assertEqual(key[0], app_label)
+                    self.assertNotIn(key, set_index)
+                    set_index[key] = (app_label, idx)
+
+        self.assertEqual(set(set_index), set(graph.nodes))
+
+        edges = {}
+
+        for key in graph.nodes:
+            for parent in get_parents(graph, key):
+                if set_index[key] != set_index[parent]:
+                    edges.setdefault(set_index[key], set()).add(
+                        set_index[parent])
+
+        for app_label, migration_sets in splits.items():
+            for idx in range(1, len(migration_sets)):
+                edges.setdefault((app_label, idx), set()).add(
+                    (app_label, idx - 1))
+
+        components = find_strongly_connected_components(
+            sorted(set(set_index.values())), edges)
+
+        self.assertTrue(all(len(component) == 1 for component in components))
+
+
+class SplitAppMigrationsTest(SplitAssertionsMixin, SimpleTestCase):
+    """ Tests for splitting up app migrations to avoid cycles """
+
+    def make_graph(self, dependencies):
+        graph = MigrationGraph()
+
+        for key in dependencies:
+            graph.add_node(key, None)
+
+        for key, parents in dependencies.items():
+            for parent in parents:
+                graph.add_dependency(None, key, parent)
+
+        return graph
+
+    def test_strongly_connected_components(self):
+        """ Test that components come after the components they point to """
+
+        edges = {'a': ['b'], 'b': ['c'], 'c': ['b', 'd'], 'e': ['a']}
+        components = find_strongly_connected_components('abcde', edges)
+
+        self.assertEqual(components, [{'d'}, {'b', 'c'}, {'a'}, {'e'}])
+
+    def test_no_cycles(self):
+        """ Test that apps without cyclic dependencies aren't split """
+
+        graph = self.make_graph({
+            ('a', '1'): [],
+            ('a', '2'): [('a', '1')],
+            ('b', '1'): [('a', '2')],
+            ('c', '1'): [('b', '1'), ('a', '1')],
+        })
+
+        splits = split_app_migrations(graph, graph.nodes)
+
+        self.assertEqual(splits, {
+            'a': [{('a', '1'), ('a', '2')}],
+            'b': [{('b', '1')}],
+            'c': [{('c', '1')}],
+        })
+
+    def test_cycle(self):
+        """ Test splitting apps which depend on each other in a cycle """
+
+        # Each app depends on the other, only one of them needs a split
+        graph = self.make_graph({
+            ('a', '1'): [],
+            ('a', '2'): [('a', '1'), ('b', '1')],
+            ('b', '1'): [],
+            ('b', '2'): [('b', '1'), ('a', '1')],
+        })
+
+        splits = split_app_migrations(graph, graph.nodes)
+
+        self.assertEqual(len(splits['a']) + len(splits['b']), 3)
+        self.assertAcyclic(graph, splits)
+
+    # The apps depend on each other in a cycle, c on a, a on b and b on c.
+    # Peeling off b's newest migration first, as greedily choosing between
+    # equally sized sets does, leads to five sets, while four are enough
+    COMPETING_CHOICES = {
+        ('a', '1'): [('b', '1')],
+        ('b', '1'): [('c', '1')],
+        ('b', '2'): [('b', '1')],
+        ('c', '1'): [],
+        ('c', '2'): [('c', '1'), ('a', '1')],
+    }
+
+    def test_fewest_sets(self):
+        """ Test the fewest sets are found when choices compete """
+
+        graph = self.make_graph(self.COMPETING_CHOICES)
+        splits = split_app_migrations(graph, graph.nodes)
+
+        self.assertEqual(splits, {
+            'a': [{('a', '1')}],
+            'b': [{('b', '1'), ('b', '2')}],
+            'c': [{('c', '1')}, {('c', '2')}],
+        })
+        self.assertAcyclic(graph, splits)
+
+    def test_search_bound(self):
+        """ Test components too big to search are still split """
+
+        graph = self.make_graph(self.COMPETING_CHOICES)
+
+        with mock.patch('django_migrate_project.graph.MAX_SPLIT_STATES', 1):
+            splits = split_app_migrations(graph, graph.nodes)
+
+        self.assertEqual(sum(len(sets) for sets in splits.values()), 5)
+        self.assertAcyclic(graph, splits)
+
+    def test_large_cycle(self):
+        """ Test splitting a cycle across many apps with long histories """
+
+        dependencies = {}
+
+        for app_idx in range(8):
+            app_label = 'app%d' % app_idx
+            previous_label = 'app%d' % ((app_idx - 1) % 8)
+
+            for idx in range(30):
+                parents = [(app_label, '%04d' % (idx - 1))] if idx else []
+
+                # Each app depends on the one before it, and the first app
+                # on the last, every so often through their histories
+                if idx and idx % 7 == 0:
+                    parents.append((previous_label, '%04d' % (idx - 3)))
+
+                dependencies[app_label, '%04d' % idx] = parents
+
+        graph = self.make_graph(dependencies)
+
+        with mock.patch('django_migrate_project.graph.split_component_'
+                        'greedily', wraps=split_component_greedily) as greedy:
+            splits = split_app_migrations(graph, graph.nodes)
+
+        self.assertTrue(greedy.called)
+        self.assertAcyclic(graph, splits)
+
+
+class WalkAppMigrationsTest(SimpleTestCase):
+    """ Tests for walking the unapplied migrations of each app """
+
+    def make_loader(self, dependencies, applied=()):
+        loader = MigrationLoader(None, load=False)
+        loader.graph = MigrationGraph()
+        loader.applied_migrations = set(applied)
+
+        for key, parents in dependencies.items():
+            migration = Migration(key[1], key[0])
+            migration.dependencies = parents
+            loader.graph.add_node(key, migration)
+
+        for key, parents in dependencies.items():
+            for parent in parents:
+                loader.graph.add_dependency(None, key, parent)
+
+        return loader
+
+    def test_walk(self):
+        """ Test the migrations collected for each app, newest first """
+
+        loader = self.make_loader({
+            ('a', '1'): [],
+            ('a', '2'): [('a', '1')],
+            ('a', '3'): [('a', '2')],
+            ('b', '1'): [('a', '2')],
+            ('b', '2'): [('b', '1'), ('a', '3')],
+        }, applied=[('a', '1')])
+
+        app_migrations = walk_app_migrations(
+            loader, loader.graph.leaf_nodes())
+
+        self.assertEqual(
+            [migration.name for migration in app_migrations['a']],
+            ['3', '2'])
+        self.assertEqual(
+            [migration.name for migration in app_migrations['b']],
+            ['2', '1'])
+
+    def test_reached_from_other_app(self):
+        """ Test the order when an app is first reached from another app """
+
+        # The leaf of 'b' is walked first, reaching the middle of 'c'
+        loader = self.make_loader({
+            ('c', '1'): [],
+            ('c', '2'): [('c', '1')],
+            ('c', '3'): [('c', '2')],
+            ('b', '1'): [('c', '2')],
+        })
+
+        app_migrations = walk_app_migrations(loader, [('b', '1'), ('c', '3')])
+
+        self.assertEqual(
+            [migration.name for migration in app_migrations['c']],
+            ['3', '2', '1'])
+
+    def test_shared_ancestors(self):
+        """ Test that shared ancestors are only walked once """
+
+        # A ladder of diamonds, with 2 ** 100 paths from top to bottom
+        dependencies = {('a', '0000'): []}
+
+        for idx in range(1, 101):
+            previous = [('a', '%04d' % (idx - 1)), ('b', '%04d' % (idx - 1))]
+            dependencies[('a', '%04d' % idx)] = previous
+            dependencies[('b', '%04d' % idx)] = previous
+
+        dependencies[('b', '0000')] = []
+
+        loader = self.make_loader(dependencies)
+        app_migrations = walk_app_migrations(
+            loader, loader.graph.leaf_nodes())
+
+        self.assertEqual(len(app_migrations['a']), 101)
+        self.assertEqual(len(app_migrations['b']), 101)
+
+    def test_deep_history(self):
+        """ Test that long histories don't hit the recursion limit """
+
+        dependencies = {('a', '00000'): []}
+
+        for idx in range(1, 50000):
+            dependencies[('a', '%05d' % idx)] = [('a', '%05d' % (idx - 1))]
+
+        loader = self.make_loader(dependencies)
+        app_migrations = walk_app_migrations(loader, [('a', '49999')])
+
+        self.assertEqual(len(app_migrations['a']), 50000)
+        self.assertEqual(app_migrations['a'][0].name, '49999')
@@ -0,0 +1,497 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sys
+import tempfile
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.migrations import Migration, swappable_dependency
+from django.test import (
+    override_settings, SimpleTestCase, TransactionTestCase
+)
+
+from django_migrate_project.cache import MigrationGraphCache
+from django_migrate_project.header import read_migration_header
+from django_migrate_project.loader import (
+    AppLabelIndex, get_pending_namespace, import_pending, LazyMigration,
+    PendingMigrationLoader, ProjectMigrationLoader, proxy_class_attributes
+)
+
+import mock
+
+
+TEST_MIGRATIONS_DIR = os.path.join(settings.BASE_DIR, 'test_migrations')
+INITIAL_MIGRATION_DIR = os.path.join(TEST_MIGRATIONS_DIR, 'initial_migration')
+BLOG_MIGRATIONS_DIR = os.path.join(settings.BASE_DIR, 'blog', 'migrations')
+
+READ_HEADER_PATH = 'django_migrate_project.loader.read_migration_header'
+APPLIED_MIGRATIONS_PATH = ('django_migrate_project.loader.MigrationRecorder.'
+                           'applied_migrations')
+
+
+class AtomicMigration(Migration):
+    """ Stands in for Migration on Django versions with these attributes """
+
+    initial = None
+    atomic = True
+
+
+@proxy_class_attributes
+class LazyAtomicMigration(LazyMigration, AtomicMigration):
+    pass
+
+
+class LazyMigrationTest(SimpleTestCase):
+    """ Tests for migrations loaded on demand """
+
+    def make_lazy_migration(self, migration, lazy_class=LazyMigration):
+        module = mock.Mock(Migration=mock.Mock(return_value=migration))
+
+        return lazy_class(migration.name, migration.app_label,
+                          mock.Mock(return_value=module),
+                          dependencies=[('blog', '0001_initial')])
+
+    def test_header(self):
+        """ Test the header is used without loading the migration """
+
+        migration = Migration('0002_tag', 'blog')
+        lazy_migration = self.make_lazy_migration(migration)
+
+        self.assertEqual(lazy_migration.dependencies,
+                         [('blog', '0001_initial')])
+        self.assertIsNone(lazy_migration._migration)
+
+        self.assertIs(lazy_migration.operations, migration.operations)
+        self.assertEqual(migration.dependencies, [('blog', '0001_initial')])
+
+    def test_class_attributes(self):
+        """ Test class attributes come from the real migration """
+
+        migration = AtomicMigration('0002_tag', 'blog')
+        migration.initial = True
+        migration.atomic = False
+        lazy_migration = self.make_lazy_migration(
+            migration, LazyAtomicMigration)
+
+        self.assertTrue(lazy_migration.initial)
+        self.assertFalse(lazy_migration.atomic)
+
+        lazy_migration.atomic = True
+        self.assertTrue(migration.atomic)
+
+
+class AppLabelIndexTest(SimpleTestCase):
+    """ Tests for resolving migration file names to app labels """
+
+    def test_resolve(self):
+        """ Test resolving file names to their app label and migration """
+
+        index = AppLabelIndex(['blog', 'cookbook'])
+
+        self.assertEqual(index.resolve('blog_0001_project'),
+                         ('blog', '0001_project'))
+        self.assertEqual(index.resolve('cookbook_0002_project'),
+                         ('cookbook', '0002_project'))
+
+        # No app matches
+        self.assertIsNone(index.resolve('newspaper_0001_project'))
+        self.assertIsNone(index.resolve('blogger_0001_project'))
+        self.assertIsNone(index.resolve('blog'))
+
+    def test_longest_prefix(self):
+        """ Test that a file belongs only to the longest matching app label """
+
+        index = AppLabelIndex(['blog', 'blog_extra'])
+
+        self.assertEqual(index.resolve('blog_extra_0001_project'),
+                         ('blog_extra', '0001_project'))
+        self.assertEqual(index.resolve('blog_0001_project'),
+                         ('blog', '0001_project'))
+
+        # The app label is removed as a prefix, not as a set of characters
+        self.assertEqual(index.resolve('blog_extra_extra_0001'),
+                         ('blog_extra', 'extra_0001'))
+
+
+class MigrationHeaderTest(SimpleTestCase):
+    """ Tests for reading migration headers without importing them """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read_source(self, source):
+        path = os.path.join(self.tempdir, 'migration.py')
+
+        with open(path, 'wb') as migration_file:
+            migration_file.write(source.encode('utf-8'))
+
+        return read_migration_header(path)
+
+    def test_static_header(self):
+        """ Test reading a migration with literal attributes """
+
+        header = read_migration_header(
+            os.path.join(INITIAL_MIGRATION_DIR, 'blog_0001_project.py'))
+
+        self.assertEqual(header, {
+            'dependencies': [('cookbook', '0001_project')],
+            'replaces': [('blog', '0001_initial'), ('blog', '0002_tag')],
+            'run_before': [],
+        })
+
+    def test_swappable_dependency(self):
+        """ Test reading a migration with a swappable dependency """
+
+        header = read_migration_header(
+            os.path.join(BLOG_MIGRATIONS_DIR, '0003_post_user.py'))
+
+        self.assertEqual(header['dependencies'],
+                         [('auth', '__first__'), ('blog', '0002_tag')])
+        self.assertEqual(header['dependencies'][0].setting, 'auth.User')
+        self.assertEqual(header['dependencies'][0].setting_name,
+                         'AUTH_USER_MODEL')
+
+    def test_dynamic_header(self):
+        """ Test that dynamic migrations need to be imported """
+
+        migration_header = (
+            "from django.db import migrations\n"
+            "class Migration(migrations.Migration):\n"
+        )
+
+        # Non-literal dependencies
+        self.assertIsNone(self.read_source(
+            migration_header + "    dependencies = get_dependencies()\n"))
+        self.assertIsNone(self.read_source(
+            migration_header + "    dependencies = [('blog', NAME)]\n"))
+
+        # Methods, like South-style migrations have
+        self.assertIsNone(self.read_source(
+            migration_header + "    def forwards(self, orm):\n        pass\n"))
+
+        # Custom base classes
+        self.assertIsNone(self.read_source(
+            "class Migration(BaseMigration):\n    dependencies = []\n"))
+
+        # Changed after the class is defined
+        self.assertIsNone(self.read_source(
+            migration_header + "    pass\n"
+            "Migration.dependencies = [('blog', '0001_initial')]\n"))
+
+        # Not a migration
+        self.assertIsNone(self.read_source("x = 1\n"))
+        self.assertIsNone(self.read_source("class Migration(\n"))
+
+    def test_dynamic_migration_imported(self):
+        """ Test that the loader imports migrations it can't read """
+
+        pending_dir = os.path.join(self.tempdir, 'pending')
+        shutil.copytree(INITIAL_MIGRATION_DIR, pending_dir)
+
+        migration_path = os.path.join(pending_dir, 'blog_0001_project.py')
+
+        with open(migration_path, 'ab') as migration_file:
+            migration_file.write(b'\nMigration.run_before = []\n')
+
+        try:
+            loader = PendingMigrationLoader(
+                connections[DEFAULT_DB_ALIAS],
+                pending_migrations_dir=pending_dir)
+
+            blog_migration = loader.pending_migrations['blog', '0001_project']
+            cookbook_migration = loader.pending_migrations[
+                'cookbook', '0001_project']
+
+            self.assertNotIsInstance(blog_migration, LazyMigration)
+            self.assertIsInstance(cookbook_migration, LazyMigration)
+        finally:
+            sys.modules.pop("blog_0001_project", None)
+            sys.modules.pop("cookbook_0001_project", None)
+
+
+class PendingImportTest(SimpleTestCase):
+    """ Tests for importing migration files from a pending directory """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.pending_dir = os.path.join(self.tempdir, 'pending')
+
+        shutil.copytree(INITIAL_MIGRATION_DIR, self.pending_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+        namespace = get_pending_namespace(self.pending_dir)
+
+        for module_name in list(sys.modules):
+            if module_name.split('.')[0] == namespace:
+                del sys.modules[module_name]
+
+    def test_private_namespace(self):
+        """ Test that migration files aren't imported by their bare name """
+
+        module = import_pending(self.pending_dir, 'blog_0001_project')
+        namespace = get_pending_namespace(self.pending_dir)
+
+        self.assertEqual(module.__name__, namespace + '.blog_0001_project')
+        self.assertNotIn('blog_0001_project', sys.modules)
+        self.assertNotIn(self.pending_dir, sys.path)
+
+        # Another directory gets its own namespace
+        self.assertNotEqual(namespace, get_pending_namespace(self.tempdir))
+
+    def test_changed_file_reloaded(self):
+        """ Test that a module is only reused while its file is unchanged """
+
+        module = import_pending(self.pending_dir, 'blog_0001_project')
+        self.assertIs(
+            import_pending(self.pending_dir, 'blog_0001_project'), module)
+
+        migration_path = os.path.join(self.pending_dir, 'blog_0001_project.py')
+
+        with open(migration_path, 'ab') as migration_file:
+            migration_file.write(b'\nMigration.run_before = [("a", "b")]\n')
+
+        reloaded_module = import_pending(self.pending_dir, 'blog_0001_project')
+
+        self.assertIsNot(reloaded_module, module)
+        self.assertEqual(reloaded_module.Migration.run_before, [('a', 'b')])
+
+    def test_same_size_rewrite(self):
+        """ Test a file rewritten in the same second with the same size """
+
+        # Bytecode needs writing for it to be reused
+        dont_write_bytecode = mock.patch.object(
+            sys, 'dont_write_bytecode', False)
+        dont_write_bytecode.start()
+        self.addCleanup(dont_write_bytecode.stop)
+
+        migration_path = os.path.join(self.pending_dir, 'blog_0001_project.py')
+
+        with open(migration_path, 'ab') as migration_file:
+            migration_file.write(b'\nMigration.run_before = [("a", "b")]\n')
+
+        mtime = int(os.stat(migration_path).st_mtime)
+        os.utime(migration_path, (mtime, mtime + 0.25))
+        import_pending(self.pending_dir, 'blog_0001_project')
+
+        with open(migration_path, 'rb') as migration_file:
+            source = migration_file.read()
+
+        with open(migration_path, 'wb') as migration_file:
+            migration_file.write(source.replace(b'"a", "b"', b'"c", "d"'))
+
+        # Bytecode checked by mtime in whole seconds would still match
+        os.utime(migration_path, (mtime, mtime + 0.5))
+        reloaded_module = import_pending(self.pending_dir, 'blog_0001_project')
+
+        self.assertEqual(reloaded_module.Migration.run_before, [('c', 'd')])
+
+
+class GraphCacheTest(TransactionTestCase):
+    """ Tests for the on-disk migration graph cache """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tempdir, 'graph_cache.json')
+        self.pending_dir = os.path.join(self.tempdir, 'pending')
+
+        shutil.copytree(INITIAL_MIGRATION_DIR, self.pending_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+        # Destroy modules that were loaded for migrations
+        sys.modules.pop("blog_0001_project", None)
+        sys.modules.pop("cookbook_0001_project", None)
+        sys.modules.pop("cookbook_0002_project", None)
+
+    def load(self):
+        connection = connections[DEFAULT_DB_ALIAS]
+
+        with override_settings(PROJECT_MIGRATIONS_GRAPH_CACHE=self.cache_path):
+            return PendingMigrationLoader(
+                connection, pending_migrations_dir=self.pending_dir)
+
+    def test_cache_disabled(self):
+        """ Test that no cache is used or written by default """
+
+        loader = ProjectMigrationLoader(connections[DEFAULT_DB_ALIAS])
+
+        self.assertIsNone(loader.graph_cache)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_cached_graph(self):
+        """ Test that a cached load matches a fresh one without parsing """
+
+        with mock.patch(READ_HEADER_PATH, wraps=read_migration_header) as read:
+            loader = self.load()
+            self.assertTrue(read.called)
+
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        with mock.patch(READ_HEADER_PATH, wraps=read_migration_header) as read:
+            cached_loader = self.load()
+            self.assertFalse(read.called)
+
+        for migration in cached_loader.disk_migrations.values():
+            self.assertIsInstance(migration, LazyMigration)
+            self.assertIsNone(migration._migration)
+
+        self.assertEqual(set(loader.graph.nodes),
+                         set(cached_loader.graph.nodes))
+        self.assertEqual(loader.graph.leaf_nodes(),
+                         cached_loader.graph.leaf_nodes())
+
+        for key, migration in loader.graph.nodes.items():
+            cached_migration = cached_loader.graph.nodes[key]
+
+            self.assertEqual(sorted(migration.dependencies),
+                             sorted(cached_migration.dependencies))
+            self.assertEqual(migration.replaces, cached_migration.replaces)
+
+        # Operations are loaded on demand
+        key = ('blog', '0001_project')
+        self.assertEqual(len(cached_loader.graph.nodes[key].operations),
+                         len(loader.graph.nodes[key].operations))
+
+    def test_stale_entry(self):
+        """ Test that only changed files are reloaded """
+
+        self.load()
+
+        changed_path = os.path.join(self.pending_dir, 'blog_0001_project.py')
+
+        with open(changed_path, 'ab') as migration_file:
+            migration_file.write(b'\n# Changed\n')
+
+        # Touching a file without changing it keeps its entry
+        touched_path = os.path.join(
+            self.pending_dir, 'cookbook_0001_project.py')
+        os.utime(touched_path, (0, 0))
+
+        with mock.patch(READ_HEADER_PATH, wraps=read_migration_header) as read:
+            self.load()
+
+        read.assert_called_once_with(changed_path)
+
+        cache = MigrationGraphCache(self.cache_path)
+        self.assertIsNotNone(cache.get(changed_path))
+        self.assertIsNotNone(cache.get(touched_path))
+
+    def test_corrupt_cache(self):
+        """ Test that an unreadable cache file is ignored and rewritten """
+
+        with open(self.cache_path, 'wb') as cache_file:
+            cache_file.write(b'{not json')
+
+        self.load()
+
+        with mock.patch(READ_HEADER_PATH, wraps=read_migration_header) as read:
+            self.load()
+            self.assertFalse(read.called)
+
+    def test_swappable_setting(self):
+        """ Test swappable dependencies follow their setting when cached """
+
+        path = os.path.join(self.tempdir, 'swappable.py')
+
+        with open(path, 'w') as migration_file:
+            migration_file.write(
+                "from django.conf import settings\n"
+                "from django.db import migrations\n"
+                "class Migration(migrations.Migration):\n"
+                "    dependencies = [\n"
+                "        migrations.swappable_dependency(\n"
+                "            settings.TEST_SWAPPABLE_MODEL),\n"
+                "    ]\n")
+
+        with override_settings(TEST_SWAPPABLE_MODEL='blog.Post'):
+            cache = MigrationGraphCache(self.cache_path)
+            cache.set(path, read_migration_header(path))
+            cache.save()
+
+        with override_settings(TEST_SWAPPABLE_MODEL='cookbook.Recipe'):
+            header = MigrationGraphCache(self.cache_path).get(path)
+
+        self.assertEqual(header['dependencies'], [('cookbook', '__first__')])
+        self.assertEqual(header['dependencies'][0].setting, 'cookbook.Recipe')
+
+        # Without the setting, the entry can't be used
+        self.assertIsNone(MigrationGraphCache(self.cache_path).get(path))
+
+    def test_imported_swappable(self):
+        """ Test swappable dependencies with an unknown setting aren't kept """
+
+        path = os.path.join(self.pending_dir, 'blog_0001_project.py')
+        cache = MigrationGraphCache(self.cache_path)
+        cache.set(path, {
+            'dependencies': [swappable_dependency('blog.Post')],
+            'replaces': [],
+            'run_before': [],
+        })
+
+        self.assertIsNone(cache.get(path))
+
+
+class SquashedPendingMigrationLoader(PendingMigrationLoader):
+    """ Adds a squashed migration for the migrations blog_0001 replaces """
+
+    def load_disk(self):
+        super(SquashedPendingMigrationLoader, self).load_disk()
+
+        squashed = Migration('0001_squashed_0002_tag', 'blog')
+        squashed.replaces = [('blog', '0001_initial'), ('blog', '0002_tag')]
+        self.disk_migrations['blog', squashed.name] = squashed
+
+
+class SquashedMigrationTest(SimpleTestCase):
+    """ Tests for collected migrations replacing squashed migrations """
+
+    squashed_key = ('blog', '0001_squashed_0002_tag')
+    collected_key = ('blog', '0001_project')
+
+    def tearDown(self):
+        namespace = get_pending_namespace(INITIAL_MIGRATION_DIR)
+
+        for module_name in list(sys.modules):
+            if module_name.split('.')[0] == namespace:
+                del sys.modules[module_name]
+
+    def load(self, applied):
+        with mock.patch(APPLIED_MIGRATIONS_PATH, return_value=set(applied)):
+            return SquashedPendingMigrationLoader(
+                connections[DEFAULT_DB_ALIAS],
+                pending_migrations_dir=INITIAL_MIGRATION_DIR)
+
+    def test_unapplied(self):
+        """ Test the squashed migration is folded into the collected one """
+
+        loader = self.load([])
+
+        self.assertIn(self.collected_key, loader.graph.nodes)
+        self.assertNotIn(self.squashed_key, loader.graph.nodes)
+        self.assertNotIn(('blog', '0001_initial'), loader.graph.nodes)
+
+        # Migrations depending on the squashed migration depend on the
+        # collected one instead
+        self.assertIn(self.collected_key, loader.graph.forwards_plan(
+            ('blog', '0003_post_user')))
+
+        # It isn't recorded when the collected migration is applied
+        migration = loader.graph.nodes[self.collected_key]
+        self.assertNotIn(self.squashed_key, migration.replaces)
+
+    def test_applied(self):
+        """ Test the collected migration is applied along with the squash """
+
+        loader = self.load([('blog', '0001_initial'), ('blog', '0002_tag')])
+
+        self.assertNotIn(self.squashed_key, loader.graph.nodes)
+        self.assertIn(self.collected_key, loader.applied_migrations)
+        self.assertIn(self.squashed_key, loader.applied_migrations)
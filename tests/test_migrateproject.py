@@ -13,11 +13,14 @@ from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.db import connections, DEFAULT_DB_ALIAS
 from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
 from django.db.models.signals import post_migrate, pre_migrate
 from django.test import override_settings, TransactionTestCase
 from django.utils import six
 
-from django_migrate_project.loader import PROJECT_MIGRATIONS_MODULE_NAME
+from django_migrate_project.loader import (
+    PROJECT_MIGRATIONS_MODULE_NAME, ProjectMigrationLoaderMixin
+)
 
 import mock
 
@@ -100,6 +103,49 @@ class MigrateProjectTest(TransactionTestCase):
                 call_command('migrate', 'event_calendar', 'zero', verbosity=0)
                 call_command('migrate', 'newspaper', 'zero', verbosity=0)
 
+    def test_check(self):
+        """ Test checking for project migrations to apply """
+
+        self.tempdir = tempfile.mkdtemp()
+
+        with override_settings(BASE_DIR=self.tempdir):
+            self.setup_migration_tree(settings.BASE_DIR)
+
+            out = six.StringIO()
+
+            with self.assertRaises(SystemExit) as cm:
+                call_command('migrateproject', check=True, stdout=out,
+                             verbosity=1)
+
+            self.assertEqual(cm.exception.code, 1)
+            self.assertIn("newspaper.", out.getvalue().lower())
+
+            call_command('migrateproject', verbosity=0)
+
+            try:
+                out = six.StringIO()
+                call_command('migrateproject', check=True, stdout=out,
+                             verbosity=1)
+
+                self.assertIn("no project migrations to apply",
+                              out.getvalue().lower())
+
+                with self.assertRaises(CommandError):
+                    call_command('migrateproject', check=True, unapply=True,
+                                 verbosity=0)
+
+                # Checking never opens a transaction, so it works on any
+                # database
+                features = connections[DEFAULT_DB_ALIAS].features
+
+                with mock.patch.object(features, 'can_rollback_ddl', False):
+                    call_command('migrateproject', check=True,
+                                 single_transaction=True, verbosity=0)
+            finally:
+                # Roll back migrations to a blank state
+                call_command('migrate', 'event_calendar', 'zero', verbosity=0)
+                call_command('migrate', 'newspaper', 'zero', verbosity=0)
+
     def test_migrations_dir_error(self):
         """ Test running the management command with a bad migrations dir """
 
@@ -236,6 +282,108 @@ class MigrateProjectTest(TransactionTestCase):
                 call_command('migrate', 'event_calendar', 'zero', verbosity=0)
                 call_command('migrate', 'newspaper', 'zero', verbosity=0)
 
+    def test_fake(self):
+        """ Test faking applying a project migration """
+
+        self.tempdir = tempfile.mkdtemp()
+
+        with override_settings(BASE_DIR=self.tempdir):
+            self.setup_migration_tree(settings.BASE_DIR)
+
+            connection = connections[DEFAULT_DB_ALIAS]
+            table_names = connection.introspection.table_names()
+
+            out = six.StringIO()
+            call_command('migrateproject', fake=True, stdout=out, verbosity=1)
+
+            try:
+                self.assertIn('faked', out.getvalue().lower())
+
+                # Migrations are recorded, but nothing was run
+                loader = MigrationLoader(connection)
+                migrated_apps = [app for app, _ in loader.applied_migrations]
+
+                self.assertIn('event_calendar', migrated_apps)
+                self.assertIn('newspaper', migrated_apps)
+                self.assertEqual(connection.introspection.table_names(),
+                                 table_names)
+            finally:
+                call_command('migrateproject', fake=True, unapply=True,
+                             verbosity=0)
+
+            loader = MigrationLoader(connection)
+            migrated_apps = [app for app, _ in loader.applied_migrations]
+
+            self.assertNotIn('event_calendar', migrated_apps)
+            self.assertNotIn('newspaper', migrated_apps)
+
+    def test_single_transaction(self):
+        """ Test applying project migrations in a single transaction """
+
+        self.tempdir = tempfile.mkdtemp()
+
+        with override_settings(BASE_DIR=self.tempdir):
+            self.setup_migration_tree(settings.BASE_DIR)
+
+            connection = connections[DEFAULT_DB_ALIAS]
+
+            # Databases which can't roll back schema changes aren't supported
+            with mock.patch.object(connection.features, 'can_rollback_ddl',
+                                   False):
+                with self.assertRaises(CommandError):
+                    call_command('migrateproject', single_transaction=True,
+                                 verbosity=0)
+
+            call_command('migrateproject', single_transaction=True,
+                         verbosity=0)
+
+            try:
+                loader = MigrationLoader(connection)
+                migrated_apps = [app for app, _ in loader.applied_migrations]
+
+                self.assertIn('event_calendar', migrated_apps)
+                self.assertIn('newspaper', migrated_apps)
+            finally:
+                # Roll back migrations to a blank state
+                call_command('migrate', 'event_calendar', 'zero', verbosity=0)
+                call_command('migrate', 'newspaper', 'zero', verbosity=0)
+
+    def test_single_graph_load(self):
+        """ Test that the graph is loaded and the recorder queried once """
+
+        self.tempdir = tempfile.mkdtemp()
+
+        # Both stock and project-aware loaders build a graph
+        build_graph = mock.patch.object(
+            MigrationLoader, 'build_graph', autospec=True,
+            side_effect=MigrationLoader.build_graph)
+        build_project_graph = mock.patch.object(
+            ProjectMigrationLoaderMixin, 'build_graph', autospec=True,
+            side_effect=ProjectMigrationLoaderMixin.build_graph)
+        applied_migrations = mock.patch.object(
+            MigrationRecorder, 'applied_migrations', autospec=True,
+            side_effect=MigrationRecorder.applied_migrations)
+
+        with override_settings(BASE_DIR=self.tempdir):
+            self.setup_migration_tree(settings.BASE_DIR)
+
+            # Migrate first, so that no migrations are available to apply
+            call_command('migrateproject', verbosity=0)
+
+            try:
+                with build_graph as build_graph_mock, \
+                        build_project_graph as build_project_graph_mock, \
+                        applied_migrations as applied_migrations_mock:
+                    call_command('migrateproject', verbosity=0)
+
+                self.assertEqual(build_graph_mock.call_count +
+                                 build_project_graph_mock.call_count, 1)
+                self.assertEqual(applied_migrations_mock.call_count, 1)
+            finally:
+                # Roll back migrations to a blank state
+                call_command('migrate', 'event_calendar', 'zero', verbosity=0)
+                call_command('migrate', 'newspaper', 'zero', verbosity=0)
+
     def test_signals(self):
         """ Test the signals emitted during the migration """
 
@@ -260,7 +408,7 @@ class MigrateProjectTest(TransactionTestCase):
 
         self.tempdir = tempfile.mkdtemp()
 
-        module = 'django_migrate_project.management.commands.migrateproject'
+        module = 'django_migrate_project.management.base'
         changes_path = module + '.MigrationAutodetector.changes'
 
         with override_settings(BASE_DIR=self.tempdir):
@@ -274,13 +422,22 @@ class MigrateProjectTest(TransactionTestCase):
                     changes.return_value = True
 
                     out = six.StringIO()
-                    call_command('migrateproject', stdout=out, verbosity=1)
+                    call_command('migrateproject', stdout=out, verbosity=1,
+                                 check_model_changes=True)
 
                     output = out.getvalue().lower()
 
                     self.assertIn("have changes", output)
                     self.assertIn("'manage.py makeprojectmigrations'", output)
                     self.assertIn("'manage.py migrateproject'", output)
+
+                    # Model changes are only checked for when asked to
+                    changes.reset_mock()
+                    out = six.StringIO()
+                    call_command('migrateproject', stdout=out, verbosity=1)
+
+                    self.assertNotIn("have changes", out.getvalue().lower())
+                    self.assertFalse(changes.called)
             finally:
                 # Roll back migrations to a blank state
                 # NOTE: This needs to be done before deleting anything or else
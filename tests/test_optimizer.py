@@ -0,0 +1,195 @@
+from __future__ import unicode_literals
+
+from itertools import chain, repeat
+
+import os
+import shutil
+import tempfile
+
+from django.db import migrations, models
+from django.test import SimpleTestCase
+
+from django_migrate_project.cache import OptimizerCache
+from django_migrate_project.optimizer import (
+    BoundedMigrationOptimizer, optimize_in_parallel, optimize_operations
+)
+
+import mock
+
+
+OPTIMIZE_PATH = 'django_migrate_project.optimizer.MigrationOptimizer.optimize'
+
+
+def make_operations(model_name):
+    return [
+        migrations.CreateModel(model_name, [
+            ('id', models.AutoField(primary_key=True)),
+        ]),
+        migrations.AddField(model_name, 'title', models.CharField(
+            max_length=100)),
+    ]
+
+
+class OptimizerCacheTest(SimpleTestCase):
+    """ Tests for the on-disk optimizer cache """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.tempdir, 'optimizer_cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_keys(self):
+        """ Test that keys depend on the operations and app label """
+
+        cache = OptimizerCache(self.cache_path)
+        key = cache.make_key(make_operations('Post'), 'blog')
+
+        self.assertEqual(key, cache.make_key(make_operations('Post'), 'blog'))
+        self.assertNotEqual(
+            key, cache.make_key(make_operations('Post'), 'cookbook'))
+        self.assertNotEqual(
+            key, cache.make_key(make_operations('Recipe'), 'blog'))
+
+        # Operations which can't be serialized can't be cached
+        operations = [migrations.RunPython(lambda apps, schema_editor: None)]
+        self.assertIsNone(cache.make_key(operations, 'blog'))
+
+    def test_cached_optimization(self):
+        """ Test that cached operations skip the optimizer """
+
+        cache = OptimizerCache(self.cache_path)
+        optimized = optimize_operations(make_operations('Post'), 'blog', cache)
+
+        self.assertEqual(len(optimized.operations), 1)
+        self.assertFalse(optimized.cached)
+        self.assertEqual(cache.misses, 1)
+
+        with mock.patch(OPTIMIZE_PATH) as optimize:
+            cached = optimize_operations(
+                make_operations('Post'), 'blog', OptimizerCache(
+                    self.cache_path))
+
+            self.assertFalse(optimize.called)
+
+        self.assertTrue(cached.cached)
+        self.assertEqual(len(cached.operations), 1)
+        self.assertEqual(cached.operations[0].deconstruct(),
+                         optimized.operations[0].deconstruct())
+
+        # Results for a different window are cached separately
+        windowed = optimize_operations(
+            make_operations('Post'), 'blog', cache, window=10)
+        self.assertFalse(windowed.cached)
+
+    def test_parallel_cached_optimization(self):
+        """ Test that cached jobs aren't sent to the process pool """
+
+        cache = OptimizerCache(self.cache_path)
+        optimize_operations(make_operations('Post'), 'blog', cache)
+
+        jobs = [(make_operations('Post'), 'blog'),
+                (make_operations('Recipe'), 'cookbook')]
+
+        results = optimize_in_parallel(jobs, 2, cache)
+
+        self.assertEqual(
+            [len(result.operations) for result in results], [1, 1])
+        self.assertEqual([result.cached for result in results], [True, False])
+        self.assertEqual(cache.hits, 1)
+        self.assertIsNotNone(
+            cache.get(cache.make_key(make_operations('Recipe'), 'cookbook')))
+
+    def test_eviction(self):
+        """ Test that the least recently used entries are evicted """
+
+        cache = OptimizerCache(self.cache_path)
+        keys = []
+
+        for idx, model_name in enumerate(('Post', 'Recipe', 'Tag')):
+            key = cache.make_key(make_operations(model_name), 'blog')
+            cache.set(key, make_operations(model_name))
+            os.utime(cache.entry_path(key), (idx, idx))
+            keys.append(key)
+
+        entry_size = os.path.getsize(cache.entry_path(keys[0]))
+
+        # Reading the oldest entry makes it the most recently used
+        self.assertIsNotNone(cache.get(keys[0]))
+
+        cache.max_size = entry_size * 2
+        cache.save()
+
+        self.assertTrue(os.path.exists(cache.entry_path(keys[0])))
+        self.assertFalse(os.path.exists(cache.entry_path(keys[1])))
+        self.assertTrue(os.path.exists(cache.entry_path(keys[2])))
+
+    def test_corrupt_entry(self):
+        """ Test that an unreadable entry is treated as missing """
+
+        cache = OptimizerCache(self.cache_path)
+        key = cache.make_key(make_operations('Post'), 'blog')
+        cache.set(key, make_operations('Post'))
+
+        with open(cache.entry_path(key), 'wb') as entry_file:
+            entry_file.write(b'not a pickle')
+
+        self.assertIsNone(cache.get(key))
+
+
+class BoundedMigrationOptimizerTest(SimpleTestCase):
+    """ Tests for bounding the optimizer on huge lists of operations """
+
+    def make_operations(self, separation):
+        # Operations on other models in between the two which can be merged
+        operations = make_operations('Post')
+        operations[1:1] = [
+            migrations.CreateModel('Model%d' % idx, [
+                ('id', models.AutoField(primary_key=True)),
+            ])
+            for idx in range(separation)
+        ]
+
+        return operations
+
+    def test_unbounded(self):
+        """ Test that an unbounded optimizer optimizes as usual """
+
+        optimizer = BoundedMigrationOptimizer()
+        operations = optimizer.optimize(self.make_operations(5), 'blog')
+
+        self.assertEqual(len(operations), 6)
+        self.assertFalse(optimizer.timed_out)
+
+    def test_window(self):
+        """ Test that operations are only compared within the window """
+
+        operations = self.make_operations(5)
+
+        optimizer = BoundedMigrationOptimizer(window=5)
+        self.assertEqual(len(optimizer.optimize(operations, 'blog')), 7)
+
+        optimizer = BoundedMigrationOptimizer(window=6)
+        self.assertEqual(len(optimizer.optimize(operations, 'blog')), 6)
+
+    def test_timeout(self):
+        """ Test that running out of time keeps the best result so far """
+
+        operations = self.make_operations(5) + make_operations('Tag')
+
+        # Time runs out once the first pass is done
+        clock = chain([0, 0], repeat(10))
+
+        with mock.patch('django_migrate_project.optimizer.time.time',
+                        side_effect=lambda: next(clock)):
+            optimizer = BoundedMigrationOptimizer(timeout=5)
+            result = optimizer.optimize(operations, 'blog')
+
+        # The first pass merged the 'Post' operations, but not the 'Tag' ones
+        self.assertTrue(optimizer.timed_out)
+        self.assertEqual(len(result), len(operations) - 1)
+
+        result = optimize_operations(operations, 'blog', timeout=60)
+        self.assertFalse(result.timed_out)
+        self.assertEqual(len(result.operations), len(operations) - 2)
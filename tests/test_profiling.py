@@ -0,0 +1,110 @@
+from __future__ import unicode_literals
+
+import os
+import pstats
+import shutil
+import tempfile
+
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from django.utils import six
+
+from django_migrate_project import timings
+from django_migrate_project.profiling import (
+    command_profile, PROFILE_PHASES, record_profile
+)
+from django_migrate_project.timings import NULL_PHASE, phase, record_timings
+
+
+def profiled_function():
+    return sum(range(10))
+
+
+def unprofiled_function():
+    return sum(range(10))
+
+
+class ProfilingTest(SimpleTestCase):
+    """ Tests for profiling commands and their phases """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'profile.stats')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def function_names(self):
+        stats = pstats.Stats(self.path)
+        return set(name for _, _, name in stats.stats)
+
+    def test_whole(self):
+        """ Test profiling everything run inside """
+
+        with record_profile(self.path):
+            profiled_function()
+
+        self.assertIn('profiled_function', self.function_names())
+
+    def test_phase(self):
+        """ Test profiling only the chosen phase """
+
+        phase_name = PROFILE_PHASES['loader'][0]
+
+        with record_profile(self.path, 'loader'):
+            unprofiled_function()
+
+            with phase(phase_name):
+                profiled_function()
+
+        self.assertEqual(timings.active_recorders, [])
+
+        names = self.function_names()
+        self.assertIn('profiled_function', names)
+        self.assertNotIn('unprofiled_function', names)
+
+    def test_with_timings(self):
+        """ Test profiling a phase while timings are recorded too """
+
+        phase_name = PROFILE_PHASES['executor'][0]
+
+        with record_profile(self.path, 'executor'):
+            with record_timings('test') as recorded:
+                with phase(phase_name):
+                    profiled_function()
+
+        self.assertEqual(
+            [phase_report['name'] for phase_report in recorded.report()],
+            ['test', phase_name])
+        self.assertIn('profiled_function', self.function_names())
+
+    def test_summary(self):
+        """ Test the summary written at verbosity 2 """
+
+        out = six.StringIO()
+
+        with command_profile({'profile': self.path, 'verbosity': 2,
+                              'stdout': out}):
+            profiled_function()
+
+        self.assertIn("profiled_function", out.getvalue())
+
+        # Nothing is listed when the phase never ran
+        out = six.StringIO()
+
+        with command_profile({'profile': self.path, 'verbosity': 2,
+                              'profile_phase': 'optimizer', 'stdout': out}):
+            profiled_function()
+
+        self.assertIn("nothing was profiled", out.getvalue().lower())
+
+    def test_options(self):
+        """ Test the options are checked """
+
+        self.assertIs(command_profile({}), NULL_PHASE)
+
+        with self.assertRaises(CommandError):
+            command_profile({'profile_phase': 'loader'})
+
+        with self.assertRaises(CommandError):
+            command_profile({'profile': self.path, 'profile_phase': 'foo'})
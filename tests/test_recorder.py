@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test import TransactionTestCase
+
+from django_migrate_project.recorder import (
+    MAX_BATCH_SIZE, ProjectMigrationRecorder
+)
+
+import mock
+
+
+class ProjectMigrationRecorderTest(TransactionTestCase):
+    """ Tests for ProjectMigrationRecorder """
+
+    def setUp(self):
+        self.recorder = ProjectMigrationRecorder(
+            connections[DEFAULT_DB_ALIAS])
+        self.keys = [('recorder_test', '%04d_migration' % idx)
+                     for idx in range(1200)]
+
+    def tearDown(self):
+        self.recorder.migration_qs.filter(app='recorder_test').delete()
+
+    def recorded_keys(self):
+        return set(self.recorder.migration_qs.filter(
+            app='recorder_test').values_list('app', 'name'))
+
+    def test_record_many(self):
+        """ Test recording more migrations than fit in a single query """
+
+        self.recorder.record_applied_many(self.keys)
+        self.assertEqual(self.recorded_keys(), set(self.keys))
+
+        self.recorder.record_unapplied_many(self.keys[:1000])
+        self.assertEqual(self.recorded_keys(), set(self.keys[1000:]))
+
+        self.recorder.record_unapplied_many(self.keys[1000:])
+        self.assertEqual(self.recorded_keys(), set())
+
+    def test_nothing_to_record(self):
+        """ Test recording no migrations doesn't touch the database """
+
+        with mock.patch.object(self.recorder, 'ensure_schema') as ensure:
+            self.recorder.record_applied_many([])
+            self.recorder.record_unapplied_many(iter([]))
+
+        self.assertFalse(ensure.called)
+
+    def test_ensure_schema_once(self):
+        """ Test the schema is only checked once for many migrations """
+
+        ensure_schema = self.recorder.ensure_schema
+
+        with mock.patch.object(self.recorder, 'ensure_schema',
+                               side_effect=ensure_schema) as ensure:
+            self.recorder.record_applied_many(self.keys)
+            self.assertEqual(ensure.call_count, 1)
+
+            self.recorder.record_unapplied_many(self.keys)
+            self.assertEqual(ensure.call_count, 2)
+
+    def test_batch_size(self):
+        """ Test batches stay within the backend's parameter limit """
+
+        ops = self.recorder.connection.ops
+
+        with mock.patch.object(ops, 'bulk_batch_size', return_value=10):
+            self.assertEqual(self.recorder.batch_size(('app',), self.keys), 10)
+
+        with mock.patch.object(ops, 'bulk_batch_size',
+                               return_value=len(self.keys)):
+            self.assertEqual(self.recorder.batch_size(('app',), self.keys),
+                             MAX_BATCH_SIZE)
+
+        with mock.patch.object(ops, 'bulk_batch_size', return_value=0):
+            self.assertEqual(self.recorder.batch_size(('app',), []), 1)
@@ -0,0 +1,322 @@
+from __future__ import unicode_literals
+
+from unittest import skipUnless
+
+import gc
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from django.db.migrations import Migration
+from django.db.migrations.graph import MigrationGraph
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase
+
+from benchmarks.synthetic_project import generate_project
+from django_migrate_project.graph import (
+    split_app_migrations, walk_app_migrations
+)
+from django_migrate_project.loader import PendingMigrationLoader
+from django_migrate_project.timings import wall_clock
+from tests.test_graph import SplitAssertionsMixin
+
+
+# The scaling tests take a while, so they only run when asked for
+SCALING_TESTS = os.environ.get('MIGRATE_PROJECT_SCALING_TESTS')
+
+# How much the cost may grow when the size doubles, linear growth with some
+# slack for noise
+MAX_GROWTH = 2.5
+
+# The longest splitting a single cycle of apps may take, in seconds
+MAX_CYCLE_SPLIT_TIME = 1.0
+
+REPEAT = 5
+COLLECT_REPEAT = 3
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIGRATION_TEMPLATE = """\
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [%s]
+
+    operations = []
+"""
+
+
+def best_time(func, repeat=REPEAT):
+    """
+    Returns the best wall time of calling func repeat times. Like timeit,
+    garbage collection is turned off while timing, as it adds noise.
+    """
+
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        for _ in range(repeat):
+            start = wall_clock()
+            func()
+            elapsed = wall_clock() - start
+
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return best
+
+
+def make_loader(app_count, migration_count, cycles=False, seed=0):
+    """
+    Returns a loader with a graph of apps with a chain of migrations each,
+    where a fifth of the migrations also depend on a migration of an earlier
+    app. With cycles, pairs of neighbouring apps also depend on each other
+    in the middle of their histories.
+    """
+
+    rand = random.Random(seed)
+    loader = MigrationLoader(None, load=False)
+    loader.graph = MigrationGraph()
+    loader.applied_migrations = set()
+    dependencies = {}
+
+    for app_idx in range(app_count):
+        app_label = 'app%d' % app_idx
+
+        for idx in range(migration_count):
+            key = (app_label, '%04d' % idx)
+            parents = []
+
+            if idx > 0:
+                parents.append((app_label, '%04d' % (idx - 1)))
+
+            # Never on the app it's paired with, which could make a cycle
+            earlier_count = app_idx - app_idx % 2
+
+            if earlier_count and idx > 0 and rand.random() < 0.2:
+                parents.append(('app%d' % rand.randrange(earlier_count),
+                                '%04d' % rand.randrange(migration_count)))
+
+            dependencies[key] = parents
+
+        if cycles and app_idx % 2:
+            late = migration_count * 3 // 4
+            early = migration_count // 4
+            previous_label = 'app%d' % (app_idx - 1)
+            dependencies[app_label, '%04d' % late].append(
+                (previous_label, '%04d' % early))
+            dependencies[previous_label, '%04d' % late].append(
+                (app_label, '%04d' % early))
+
+    for key, parents in dependencies.items():
+        migration = Migration(key[1], key[0])
+        migration.dependencies = parents
+        loader.graph.add_node(key, migration)
+
+    for key, parents in dependencies.items():
+        for parent in parents:
+            loader.graph.add_dependency(None, key, parent)
+
+    return loader
+
+
+def make_cycle_graph(app_count, migration_count):
+    """
+    Returns a graph of apps with a chain of migrations each, where each app
+    depends on the one before it, and the first app on the last, every so
+    often through their histories. So all the apps are in a single cycle.
+    """
+
+    graph = MigrationGraph()
+
+    for app_idx in range(app_count):
+        for idx in range(migration_count):
+            graph.add_node(('app%d' % app_idx, '%04d' % idx), None)
+
+    for app_idx in range(app_count):
+        app_label = 'app%d' % app_idx
+        previous_label = 'app%d' % ((app_idx - 1) % app_count)
+
+        for idx in range(1, migration_count):
+            graph.add_dependency(None, (app_label, '%04d' % idx),
+                                 (app_label, '%04d' % (idx - 1)))
+
+            if idx % 7 == 0:
+                graph.add_dependency(None, (app_label, '%04d' % idx),
+                                     (previous_label, '%04d' % (idx - 3)))
+
+    return graph
+
+
+@skipUnless(SCALING_TESTS, "Set MIGRATE_PROJECT_SCALING_TESTS to run the "
+                           "scaling tests")
+class ScalingTest(SplitAssertionsMixin, SimpleTestCase):
+    """
+    Tests that the loader and collector scale roughly linearly, by measuring
+    them on synthetic migration graphs of doubling sizes.
+    """
+
+    def assertScales(self, name, measure, sizes):
+        """
+        Asserts the cost grows by no more than MAX_GROWTH on average each
+        time the size doubles. The average is taken between the smallest and
+        largest sizes, which evens out the noise of any single measurement.
+        """
+
+        costs = [measure(size) for size in sizes]
+        doublings = math.log(float(sizes[-1]) / sizes[0], 2)
+        growth = (costs[-1] / max(costs[0], 1e-6)) ** (1 / doublings)
+
+        self.assertLessEqual(growth, MAX_GROWTH, (
+            "%s grew %.2fx per doubling, costs for sizes %r: %r" % (
+                name, growth, sizes, costs)))
+
+    def test_walk_app_migrations(self):
+        """ Test walking the migrations of each app """
+
+        def measure(app_count):
+            loader = make_loader(app_count, 50)
+            leaf_nodes = loader.graph.leaf_nodes()
+
+            return best_time(lambda: walk_app_migrations(loader, leaf_nodes))
+
+        self.assertScales('walk_app_migrations', measure, (200, 400, 800))
+
+    def test_walk_app_migrations_calls(self):
+        """ Test each migration is only looked up a bounded number of times """
+
+        def measure(app_count):
+            loader = make_loader(app_count, 50)
+            calls = []
+            get_migration = loader.get_migration
+
+            def counting_get_migration(*key):
+                calls.append(key)
+                return get_migration(*key)
+
+            loader.get_migration = counting_get_migration
+            walk_app_migrations(loader, loader.graph.leaf_nodes())
+
+            return float(len(calls))
+
+        self.assertScales('get_migration calls', measure, (50, 100, 200))
+
+    def test_split_app_migrations(self):
+        """ Test splitting the migrations of apps in cycles """
+
+        def measure(app_count):
+            loader = make_loader(app_count, 20, cycles=True)
+            keys = list(loader.graph.nodes)
+
+            return best_time(lambda: split_app_migrations(loader.graph, keys))
+
+        self.assertScales('split_app_migrations', measure, (200, 400, 800))
+
+    def test_split_app_cycle(self):
+        """ Test splitting a single cycle across more and more apps """
+
+        def measure(app_count):
+            graph = make_cycle_graph(app_count, 30)
+            keys = list(graph.nodes)
+            splits = split_app_migrations(graph, keys)
+            elapsed = best_time(lambda: split_app_migrations(graph, keys))
+
+            self.assertAcyclic(graph, splits)
+            self.assertLess(elapsed, MAX_CYCLE_SPLIT_TIME)
+
+            return elapsed
+
+        self.assertScales('split_app_migrations', measure, (8, 32, 128))
+
+    def test_load_pending_migrations(self):
+        """ Test loading a directory of collected migrations """
+
+        def measure(migration_count):
+            pending_dir = tempfile.mkdtemp()
+
+            try:
+                for idx in range(migration_count):
+                    dependency = ""
+
+                    if idx > 0:
+                        dependency = "('newspaper', '%05d_project')" % (
+                            idx - 1)
+
+                    path = os.path.join(
+                        pending_dir, 'newspaper_%05d_project.py' % idx)
+
+                    with open(path, 'w') as migration_file:
+                        migration_file.write(MIGRATION_TEMPLATE % dependency)
+
+                return best_time(lambda: PendingMigrationLoader(
+                    None, pending_migrations_dir=pending_dir))
+            finally:
+                shutil.rmtree(pending_dir)
+
+        self.assertScales('PendingMigrationLoader', measure,
+                          (1000, 2000, 4000))
+
+    def collect_time(self, app_count, migration_count):
+        """
+        Returns the best time collectmigrations took on a synthetic project,
+        as reported by its timings, so starting Django isn't counted.
+        """
+
+        project_dir = tempfile.mkdtemp()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            [ROOT_DIR] + os.environ.get('PYTHONPATH', '').split(os.pathsep)))
+        env.pop('DJANGO_SETTINGS_MODULE', None)  # Use the project's settings
+        best = None
+
+        try:
+            generate_project(project_dir, app_count=app_count,
+                             migration_count=migration_count,
+                             dependency_density=0.2, squashed_ratio=0.1)
+
+            for run in range(COLLECT_REPEAT):
+                timings_path = os.path.join(project_dir, 'timings.json')
+
+                # A new output directory each time, so nothing is kept from
+                # the last collection
+                subprocess.check_call([
+                    sys.executable, 'manage.py', 'collectmigrations',
+                    '--verbosity', '0', '--timings-file', timings_path,
+                    '--output-dir', os.path.join(project_dir, 'out%d' % run),
+                ], cwd=project_dir, env=env)
+
+                with open(timings_path) as timings_file:
+                    elapsed = json.load(timings_file)['phases'][0]['wall']
+
+                if best is None or elapsed < best:
+                    best = elapsed
+        finally:
+            shutil.rmtree(project_dir)
+
+        return best
+
+    def test_collect_apps(self):
+        """ Test collecting migrations for more apps """
+
+        self.assertScales('collectmigrations',
+                          lambda app_count: self.collect_time(app_count, 10),
+                          (20, 40, 80))
+
+    def test_collect_migrations(self):
+        """ Test collecting more migrations for each app """
+
+        self.assertScales(
+            'collectmigrations',
+            lambda migration_count: self.collect_time(10, migration_count),
+            (20, 40, 80))
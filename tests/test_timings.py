@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+
+import mock
+
+from django.test import SimpleTestCase
+from django.utils import six
+
+from django_migrate_project import timings
+from django_migrate_project.timings import (
+    NULL_PHASE, phase, record_timings, timed, tracemalloc
+)
+
+
+@timed('test.timed')
+def timed_function(value):
+    return value * 2
+
+
+class TimingsTest(SimpleTestCase):
+    """ Tests for recording timings of phases """
+
+    def test_disabled(self):
+        """ Test phases do nothing unless timings are being recorded """
+
+        self.assertEqual(timings.active_recorders, [])
+        self.assertIs(phase('test.phase'), NULL_PHASE)
+
+        with phase('test.phase'):
+            pass
+
+        self.assertEqual(timed_function(2), 4)
+
+    def test_nested_phases(self):
+        """ Test nested phases are recorded in order with their depth """
+
+        out = six.StringIO()
+
+        with record_timings('test', stdout=out) as recorded:
+            with phase('test.outer'):
+                with phase('test.inner'):
+                    self.assertEqual(timed_function(2), 4)
+
+            with phase('test.after'):
+                pass
+
+        self.assertEqual(timings.active_recorders, [])
+
+        report = recorded.report()
+        self.assertEqual(
+            [(phase_report['name'], phase_report['depth'])
+             for phase_report in report],
+            [('test', 0), ('test.outer', 1), ('test.inner', 2),
+             ('test.timed', 3), ('test.after', 1)])
+
+        for phase_report in report:
+            self.assertGreaterEqual(phase_report['wall'], 0)
+            self.assertGreaterEqual(phase_report['cpu'], 0)
+
+        self.assertGreaterEqual(report[0]['wall'], report[1]['wall'])
+        self.assertIn("test.inner", out.getvalue())
+
+    def test_memory_peak(self):
+        """ Test the memory peak of a phase is traced """
+
+        if tracemalloc is None:  # pragma: no cover
+            self.skipTest("tracemalloc isn't available")
+
+        with record_timings('test') as recorded:
+            with phase('test.allocate'):
+                data = [0] * (1024 * 1024)
+                del data
+
+            with phase('test.idle'):
+                pass
+
+        report = dict((phase_report['name'], phase_report)
+                      for phase_report in recorded.report())
+
+        # A list of a million items takes at least 8MB on 64-bit platforms
+        self.assertGreater(report['test.allocate']['memory_peak'], 4000000)
+        self.assertLess(report['test.idle']['memory_peak'], 1000000)
+        self.assertGreater(report['test']['memory_peak'], 4000000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_memory_peak_tracing(self):
+        """ Test tracing started elsewhere is left alone """
+
+        if tracemalloc is None:  # pragma: no cover
+            self.skipTest("tracemalloc isn't available")
+
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+
+        # Traced before the timings, and lost if tracing were restarted
+        class Kept(object):
+            pass
+
+        kept = Kept()
+
+        with mock.patch.object(tracemalloc, 'stop') as stop:
+            with record_timings('test') as recorded:
+                with phase('test.allocate'):
+                    data = [0] * (1024 * 1024)
+                    del data
+
+                with phase('test.idle'):
+                    pass
+
+        self.assertFalse(stop.called)
+        self.assertTrue(tracemalloc.is_tracing())
+        self.assertIsNotNone(tracemalloc.get_object_traceback(kept))
+
+        # The peak wasn't reset either
+        self.assertGreater(tracemalloc.get_traced_memory()[1], 4000000)
+
+        report = dict((phase_report['name'], phase_report)
+                      for phase_report in recorded.report())
+
+        self.assertGreater(report['test.allocate']['memory_peak'], 4000000)
+        self.assertLess(report['test.idle']['memory_peak'], 1000000)
+        self.assertGreater(report['test']['memory_peak'], 4000000)